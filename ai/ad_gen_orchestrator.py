@@ -1,21 +1,24 @@
 import json
 
 from ai.agents.facebook_ad_gen.domain.ad_gen_dto import AdGenDto, convert_to_dict
-from ai.agents.facebook_ad_gen.master import AdGeneratorAgent
+from ai.agent_registry import agent_registry, AD_GEN
+from ai.utils.checkpointer import mark_finished, thread_config
+from ai.utils.state_view import DELTA, FULL, step_state
 
 
 class AdGenOrchestrator:
     def __init__(self):
-        self.agent = AdGeneratorAgent()
+        self.agent = agent_registry.get(AD_GEN)
 
-    def generate_response(self, resp, config):
+    def generate_response(self, resp, config, view: str = FULL, before: dict = None):
         agent_state = self.agent.get_state(config)
         next_step = agent_state.next[0] if agent_state.next else "final_draft"
-        return {"workflow_step": next_step, "state": resp}
-
-    def run_ad_gen_workflow(self, session_id: str, **kwargs):
-        agent_config = {"configurable": {"thread_id": session_id}}
+        if not agent_state.next:
+            mark_finished(self.agent.memory, config)
+        return {"workflow_step": next_step, "state": step_state(before or {}, resp, view)}
 
+    def prepare_input(self, agent_config, **kwargs):
+        """Applies the human feedback of a resumed session. Returns the graph input, None when resuming."""
         result = self.agent.get_state(agent_config).next
 
         if result:
@@ -23,15 +26,37 @@ class AdGenOrchestrator:
             if next_step == 'human':
                 self.agent.update_state(config=agent_config, state={"human_feedback": kwargs.get("human_feedback")},
                                         node_name=next_step)
-            resp = self.agent.continue_run(config=agent_config)
-            return self.generate_response(resp, agent_config)
+            return None
 
         # First time flow
         ad_gen_dto = kwargs.get("ad_gen_dto")
-        inputs = convert_to_dict(ad_gen_dto)
-        resp = self.agent.run(**inputs, config=agent_config)
+        return convert_to_dict(ad_gen_dto)
+
+    def run_ad_gen_workflow(self, session_id: str, view: str = FULL, **kwargs):
+        agent_config = thread_config(AD_GEN, session_id)
+
+        inputs = self.prepare_input(agent_config, **kwargs)
+        if inputs is None:
+            before = self.agent.get_state(agent_config).values if view == DELTA else None
+            resp = self.agent.continue_run(config=agent_config)
+        else:
+            before = self.agent.build_inputs(**inputs)
+            resp = self.agent.run(**inputs, config=agent_config)
+
+        return self.generate_response(resp, agent_config, view, before)
+
+    def stream_ad_gen_workflow(self, session_id: str, **kwargs):
+        """Same as run_ad_gen_workflow but yields ("update", {"node", "output"}) as each node finishes,
+        followed by ("final", response)."""
+        agent_config = thread_config(AD_GEN, session_id)
+
+        inputs = self.prepare_input(agent_config, **kwargs)
+        graph_input = None if inputs is None else self.agent.build_inputs(**inputs)
+        for update in self.agent.stream(graph_input, config=agent_config):
+            for node, output in update.items():
+                yield "update", {"node": node, "output": output}
 
-        return self.generate_response(resp, agent_config)
+        yield "final", self.generate_response(self.agent.get_state(agent_config).values, agent_config)
 
 
 if __name__ == "__main__":
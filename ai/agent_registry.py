@@ -0,0 +1,98 @@
+import importlib
+import threading
+import time
+
+BLOG_GEN = "blog_gen"
+AD_GEN = "ad_gen"
+INSTAGRAM_POST_GEN = "instagram_post_gen"
+PERSONALIZED_MARKETING = "personalized_marketing"
+VIDEO_TO_BLOG = "video_to_blog"
+BRAND_PERSONA = "brand_persona"
+
+
+class AgentRegistry:
+    """Builds every agent (compiled graph, checkpointer and model clients) once per process.
+
+    Compiled graphs keep no per-run state, everything a run needs comes in through the config and the
+    checkpointer, so one instance is shared by all requests and worker threads.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._agents = {}
+        self._build_locks = {}
+        self._lock = threading.Lock()
+        self.build_seconds = {}
+
+    def register(self, name: str, factory):
+        """`factory` builds the agent, either a callable or a "module:attribute" path that is only imported
+        when the agent is first needed, so processes only load the model SDKs of the workflows they run."""
+        with self._lock:
+            self._factories[name] = factory
+            self._build_locks[name] = threading.Lock()
+
+    def names(self) -> list:
+        return list(self._factories)
+
+    def _factory(self, name: str):
+        factory = self._factories[name]
+        if isinstance(factory, str):
+            module_name, _, attribute = factory.partition(":")
+            factory = getattr(importlib.import_module(module_name), attribute)
+        return factory
+
+    def get(self, name: str):
+        agent = self._agents.get(name)
+        if agent is not None:
+            return agent
+
+        # one lock per agent, so building a slow agent does not hold up the others
+        with self._build_locks[name]:
+            agent = self._agents.get(name)
+            if agent is None:
+                start = time.perf_counter()
+                agent = self._factory(name)()
+                self.build_seconds[name] = time.perf_counter() - start
+                self._agents[name] = agent
+        return agent
+
+    def warm_up(self, names=None):
+        """Builds the agents and runs a checkpoint read through each graph, so the first request skips both."""
+        from ai.utils.checkpointer import thread_config
+
+        for name in names or self.names():
+            agent = self.get(name)
+            if hasattr(agent, "get_state"):
+                agent.get_state(thread_config(name, "warm-up"))
+        return dict(self.build_seconds)
+
+
+agent_registry = AgentRegistry()
+agent_registry.register(BLOG_GEN, "ai.agents.blog_gen.BlogGeneratorAgent:BlogGeneratorAgent")
+agent_registry.register(AD_GEN, "ai.agents.facebook_ad_gen.master:AdGeneratorAgent")
+agent_registry.register(INSTAGRAM_POST_GEN, "ai.agents.instagram_post_gen.master:InstagramPostGenAgent")
+agent_registry.register(PERSONALIZED_MARKETING, "ai.agents.personalized_marketing_agent.master:MarketingAgent")
+agent_registry.register(VIDEO_TO_BLOG, "ai.agents.repurpose_video_agent.master:VideoToBlogPostAgent")
+agent_registry.register(BRAND_PERSONA, "ai.agents.brand_persona.brand_persona_agent:BrandPersonaAI")
+
+
+if __name__ == "__main__":
+    # Per-request setup cost: constructing an agent (the old behaviour) against a registry lookup
+    from dotenv import load_dotenv
+    _ = load_dotenv()
+
+    rounds = 20
+    print(f"{'agent':<24}{'construct (ms)':>16}{'registry (ms)':>16}")
+    for name in agent_registry.names():
+        factory = agent_registry._factory(name)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            factory()
+        construct_ms = (time.perf_counter() - start) / rounds * 1000
+
+        agent_registry.get(name)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            agent_registry.get(name)
+        registry_ms = (time.perf_counter() - start) / rounds * 1000
+        print(f"{name:<24}{construct_ms:>16.3f}{registry_ms:>16.4f}")
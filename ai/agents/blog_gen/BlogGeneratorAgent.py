@@ -1,12 +1,9 @@
-import sqlite3
-
 from ai.agents.blog_gen.Creator import Creator
 from ai.agents.blog_gen.Editor import Editor
 from ai.agents.blog_gen.Human import Human
 from ai.agents.blog_gen.Writer import Writer
 from ai.domain.State import BlogGeneratorState
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.checkpoint.sqlite import SqliteSaver
+from ai.utils.checkpointer import get_checkpointer
 from langgraph.constants import END
 from langgraph.graph import StateGraph
 
@@ -19,17 +16,8 @@ def check_include_images(state: dict):
 
 
 class BlogGeneratorAgent:
-    def __init__(self):
-        self.model = ChatGoogleGenerativeAI(
-            model="gemini-1.5-pro",
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-            # other params...
-        )
-        conn = sqlite3.connect("checkpoints.sqlite", check_same_thread=False)
-        self.memory = SqliteSaver(conn)
+    def __init__(self, checkpointer=None):
+        self.memory = checkpointer or get_checkpointer()
 
         editor_agent = Editor()
         human_agent = Human()
@@ -67,6 +55,10 @@ class BlogGeneratorAgent:
                                   "max_sections": max_sections,
                                   "max_images": max_images, "include_images": include_images}, config)
 
+    def stream(self, inputs, config: dict):
+        # yields {node_name: node_output} after each node, None inputs resumes an interrupted run
+        return self.graph.stream(inputs, config, stream_mode="updates")
+
     def update_state(self, config: dict, state: dict, node_name: str):
         self.graph.update_state(config=config, values=state, as_node=node_name)
         pass
@@ -1,8 +1,5 @@
 import json
-import sqlite3
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.constants import END
 from langgraph.graph import StateGraph
 from langgraph.types import Send
@@ -11,6 +8,7 @@ from ai.agents.facebook_ad_gen.creator import Creator
 from ai.agents.facebook_ad_gen.domain.state import AdGeneratorState
 from ai.agents.facebook_ad_gen.human import Human
 from ai.agents.facebook_ad_gen.planner import Planner
+from ai.utils.checkpointer import get_checkpointer
 
 
 def continue_to_image_gen(state: AdGeneratorState):
@@ -22,9 +20,8 @@ def continue_to_image_gen(state: AdGeneratorState):
 
 
 class AdGeneratorAgent:
-    def __init__(self):
-        conn = sqlite3.connect("ad_gen_checkpoints.sqlite", check_same_thread=False)
-        self.memory = SqliteSaver(conn)
+    def __init__(self, checkpointer=None):
+        self.memory = checkpointer or get_checkpointer()
 
         planner_agent = Planner()
         human_agent = Human()
@@ -50,14 +47,20 @@ class AdGeneratorAgent:
                                       interrupt_before=["human"])
 
     def run(self, objective, details, brand_persona, config: dict):
-        inputs = {
+        inputs = self.build_inputs(objective, details, brand_persona)
+        response: AdGeneratorState = self.graph.invoke(inputs, config)
+        return response
+
+    def build_inputs(self, objective, details, brand_persona):
+        return {
             "objective": objective,
             "product_or_service_details": details,
             "brand_persona": brand_persona,
         }
-        response: AdGeneratorState = self.graph.invoke(inputs, config)
-        return response
 
+    def stream(self, inputs, config: dict):
+        # yields {node_name: node_output} after each node, None inputs resumes an interrupted run
+        return self.graph.stream(inputs, config, stream_mode="updates")
 
     def continue_run(self, config: dict):
         return self.graph.invoke(None, config)
@@ -1,18 +1,16 @@
 from ai.agents.instagram_post_gen.creator import Creator
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.graph import StateGraph
 from langgraph.constants import END
 from langgraph.types import Send
 
-import sqlite3
 
 from ai.agents.instagram_post_gen.domain.state import InstagramPostState
+from ai.utils.checkpointer import get_checkpointer
 
 
 class InstagramPostGenAgent:
-    def __init__(self):
-        conn = sqlite3.connect("instagram_post_checkpoints.sqlite", check_same_thread=False)
-        self.memory = SqliteSaver(conn)
+    def __init__(self, checkpointer=None):
+        self.memory = checkpointer or get_checkpointer()
 
         creator = Creator()
 
@@ -1,5 +1,3 @@
-import sqlite3
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.constants import END
 from langgraph.graph import StateGraph
 
@@ -7,6 +5,7 @@ from ai.agents.personalized_marketing_agent.analyst import CustomerAnalyst
 from ai.agents.personalized_marketing_agent.domain.whiteboard import Whiteboard
 from ai.agents.personalized_marketing_agent.editor import Editor
 from ai.agents.personalized_marketing_agent.writer import Writer
+from ai.utils.checkpointer import get_checkpointer
 
 
 def get_node_name(content_type):
@@ -19,9 +18,8 @@ def get_node_name(content_type):
 
 
 class MarketingAgent:
-    def __init__(self):
-        conn = sqlite3.connect("email_checkpoints.sqlite", check_same_thread=False)
-        self.memory = SqliteSaver(conn)
+    def __init__(self, checkpointer=None):
+        self.memory = checkpointer or get_checkpointer()
 
         analyst = CustomerAnalyst()
         editor = Editor()
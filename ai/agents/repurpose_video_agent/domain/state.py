@@ -11,6 +11,10 @@ class VideoAnalyzerState(TypedDict):
     blog_post: str
     keywords: str
     video_file_path: str
+    # sha256 of the uploaded video, computed while it was received
+    content_hash: str
+    # first node to run after upload_video when the earlier node outputs were cached
+    resume_from: str
     seo_metadata: str
 
 
@@ -1,16 +1,21 @@
-import sqlite3
 from ai.agents.repurpose_video_agent.video_analyzer import VideoAnalyzer
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.graph import StateGraph
 from langgraph.constants import END
 
 from ai.agents.repurpose_video_agent.domain.state import VideoAnalyzerState, OutputState
+from ai.agents.repurpose_video_agent.result_cache import video_result_cache, HIT, PARTIAL, MISS
+from ai.utils.cancellation import check_cancelled
+from ai.utils.checkpointer import get_checkpointer
+
+# bump whenever prompts or nodes change, so results of the old pipeline are not reused
+PIPELINE_VERSION = "1"
+NODES = ["upload_video", "analyze_video", "get_outline", "get_introduction", "write_sections", "seo_keywords", "images"]
 
 
 class VideoToBlogPostAgent:
-    def __init__(self):
-        conn = sqlite3.connect("video_to_blog_checkpoints.sqlite", check_same_thread=False)
-        self.memory = SqliteSaver(conn)
+    def __init__(self, result_cache=video_result_cache, checkpointer=None):
+        self.result_cache = result_cache
+        self.memory = checkpointer or get_checkpointer()
 
         video_analyzer = VideoAnalyzer()
 
@@ -24,7 +29,8 @@ class VideoToBlogPostAgent:
         workflow.add_node("seo_keywords", video_analyzer.add_seo_keywords)
         workflow.add_node("images", video_analyzer.add_images)
 
-        workflow.add_edge("upload_video", "analyze_video")
+        # with cached node outputs in the state the workflow continues after the deepest cached node
+        workflow.add_conditional_edges("upload_video", self.next_after_upload, NODES[1:])
         workflow.add_edge("analyze_video", "get_outline")
         workflow.add_edge("get_outline", "get_introduction")
         workflow.add_edge("get_introduction", "write_sections")
@@ -36,11 +42,54 @@ class VideoToBlogPostAgent:
 
         self.graph = workflow.compile(checkpointer=self.memory)
 
-    def run(self, video_file_path, config: dict):
+    @staticmethod
+    def next_after_upload(state: VideoAnalyzerState):
+        return state.get("resume_from") or "analyze_video"
+
+    def run(self, video_file_path, config: dict, content_hash: str = None):
         inputs = {
             "video_file_path": video_file_path,
+            "content_hash": content_hash,
         }
-        return self.graph.invoke(inputs, config)
+        if not content_hash:
+            return self.graph.invoke(inputs, config)
+        return self.run_cached(inputs, config)
+
+    def run_cached(self, inputs: dict, config: dict):
+        """Runs the workflow, reusing the node outputs stored for the same video and storing the new ones."""
+        content_hash = inputs["content_hash"]
+        cached = self.result_cache.get(content_hash, PIPELINE_VERSION)
+        state = {}
+        cached_nodes = 0
+        for node in NODES:
+            if node not in cached:
+                break
+            state.update(cached[node])
+            cached_nodes += 1
+
+        if cached_nodes == len(NODES):
+            self.result_cache.record_lookup(HIT)
+            print(f"Video {content_hash} was processed before, returning the cached blog post")
+            return self.output(state)
+
+        self.result_cache.record_lookup(PARTIAL if cached_nodes > 1 else MISS)
+        inputs = {**state, **inputs}
+        if cached_nodes > 1:
+            # the video is uploaded again anyway (or reused while it exists), it is needed by the later nodes
+            inputs["resume_from"] = NODES[cached_nodes]
+            print(f"Resuming video {content_hash} at {NODES[cached_nodes]}")
+
+        for update in self.graph.stream(inputs, config, stream_mode="updates"):
+            for node, output in update.items():
+                if node in NODES and output:
+                    self.result_cache.put(content_hash, PIPELINE_VERSION, node, output)
+            # the finished nodes are cached, a cancelled video resumes from them if it is submitted again
+            check_cancelled()
+        return self.output(self.graph.get_state(config).values)
+
+    @staticmethod
+    def output(state: dict):
+        return {key: state[key] for key in OutputState.__annotations__ if key in state}
     
     def get_state(self, cfg):
         return self.graph.get_state(cfg)
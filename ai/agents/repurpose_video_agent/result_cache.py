@@ -0,0 +1,90 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+HIT = "hit"
+PARTIAL = "partial"
+MISS = "miss"
+
+
+class VideoResultCache:
+    """Node outputs of the video to blog workflow, keyed by the sha256 of the video and the pipeline version.
+
+    Every node output is stored as soon as the node finishes, so a video that was processed before (or a job
+    that failed half way) only runs the nodes that have no stored output yet. Lookups are counted per outcome
+    in the database, so the hit ratio covers the web process and separate workers alike.
+    """
+
+    def __init__(self, db_path: str = "video_results.sqlite"):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._setup_lock = threading.Lock()
+        self._ready = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            # the database is created on first use, not when the module is imported
+            self._ensure_setup()
+        return conn
+
+    def _ensure_setup(self):
+        with self._setup_lock:
+            if not self._ready:
+                self._setup()
+                self._ready = True
+
+    def _setup(self):
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS video_results (
+                content_hash TEXT NOT NULL,
+                pipeline_version TEXT NOT NULL,
+                node TEXT NOT NULL,
+                output TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, pipeline_version, node)
+            );
+            CREATE TABLE IF NOT EXISTS video_result_lookups (
+                outcome TEXT PRIMARY KEY,
+                count INTEGER NOT NULL
+            );
+            """
+        )
+
+    def get(self, content_hash: str, pipeline_version: str) -> dict:
+        """Returns the stored outputs as {node: output}."""
+        rows = self._conn().execute(
+            "SELECT node, output FROM video_results WHERE content_hash = ? AND pipeline_version = ?",
+            (content_hash, pipeline_version)).fetchall()
+        return {node: json.loads(output) for node, output in rows}
+
+    def put(self, content_hash: str, pipeline_version: str, node: str, output: dict):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO video_results (content_hash, pipeline_version, node, output, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (content_hash, pipeline_version, node, json.dumps(output), time.time()))
+
+    def record_lookup(self, outcome: str):
+        self._conn().execute(
+            "INSERT INTO video_result_lookups (outcome, count) VALUES (?, 1) "
+            "ON CONFLICT (outcome) DO UPDATE SET count = count + 1", (outcome,))
+
+    def stats(self) -> dict:
+        counts = dict(self._conn().execute("SELECT outcome, count FROM video_result_lookups").fetchall())
+        stats = {outcome: counts.get(outcome, 0) for outcome in (HIT, PARTIAL, MISS)}
+        lookups = sum(stats.values())
+        stats["videos"] = self._conn().execute(
+            "SELECT COUNT(DISTINCT content_hash) FROM video_results").fetchone()[0]
+        stats["hit_ratio"] = stats[HIT] / lookups if lookups else 0.0
+        stats["partial_ratio"] = stats[PARTIAL] / lookups if lookups else 0.0
+        return stats
+
+
+video_result_cache = VideoResultCache(os.getenv("VIDEO_RESULT_CACHE_DB", "video_results.sqlite"))
@@ -3,6 +3,8 @@ import cv2
 import os
 import requests
 
+from ai.utils.cancellation import check_cancelled
+
 
 # Function to upload image to Imgur
 def upload_image_to_imgur(image_path):
@@ -80,6 +82,8 @@ def replace_image_placeholders(markdown_text, video_path, image_base_url="http:/
     # Function to replace each match with the image URL
     def replace_match(match):
         timestamp = match.group(1)
+        # stop between frames if the job was cancelled, the placeholders left are not replaced
+        check_cancelled()
 
         try:
             # Capture the frame at the given timestamp
@@ -1,20 +1,39 @@
+import functools
 import time
 import google.generativeai as genai
 
 from ai.agents.repurpose_video_agent.domain.state import VideoAnalyzerState
 from ai.agents.repurpose_video_agent.prompts import prompts
 from ai.agents.repurpose_video_agent.utils import replace_image_placeholders
+from ai.utils.cancellation import check_cancelled
+from ai.utils.fair_scheduler import gemini_scheduler
+
+
+@functools.lru_cache(maxsize=None)
+def configure_genai():
+    # configures the process-wide genai client, once
+    genai.configure()
 
 
 class VideoAnalyzer:
     def __init__(self):
         print("Initializing VideoAnalyzer...")
         self.gemini_adaptor = genai
-        self.gemini_adaptor.configure()
+        configure_genai()
         self.model = genai.GenerativeModel(model_name="gemini-1.5-pro-latest")
         print("VideoAnalyzer initialized successfully.")
 
     def upload_video(self, state: VideoAnalyzerState):
+        if state.get('video_file_name'):
+            # cached from an earlier run of the same video, uploaded files expire after a while
+            try:
+                video_file = self.gemini_adaptor.get_file(state['video_file_name'])
+                if video_file.state.name == "ACTIVE":
+                    print("Reusing uploaded video.")
+                    return {"video_file_name": video_file.name}
+            except Exception as e:
+                print(f"Uploaded video {state['video_file_name']} is no longer available: {e}")
+
         print("Uploading video...")
         video_file = self.gemini_adaptor.upload_file(path=state['video_file_path'])
         self.wait_for_processing(video_file)
@@ -24,6 +43,7 @@ class VideoAnalyzer:
     def wait_for_processing(self, video_file):
         # Check whether the file is ready to be used.
         while video_file.state.name == "PROCESSING":
+            check_cancelled()
             print('.', end='')
             time.sleep(10)
             video_file = self.gemini_adaptor.get_file(video_file.name)
@@ -35,9 +55,10 @@ class VideoAnalyzer:
         print("Getting summary...")
         summary_prompt = prompts.summary_prompt
         video_file = self.gemini_adaptor.get_file(state['video_file_name'])
-        summary_response = self.model.generate_content([summary_prompt, video_file],
-                                                       request_options={"timeout": 600}
-                                                       )
+        with gemini_scheduler.slot():
+            summary_response = self.model.generate_content([summary_prompt, video_file],
+                                                           request_options={"timeout": 600}
+                                                           )
         return summary_response.text
 
     def get_key_points(self, state: VideoAnalyzerState):
@@ -107,6 +128,7 @@ class VideoAnalyzer:
         return {"blog_post": blog_post}
 
     def run_llm(self, prompt, video_file):
-        response = self.model.generate_content([video_file, prompt],
-                                               request_options={"timeout": 600})
+        with gemini_scheduler.slot():
+            response = self.model.generate_content([video_file, prompt],
+                                                   request_options={"timeout": 600})
         return response.text
@@ -1,4 +1,4 @@
-from ai.agents.brand_persona.brand_persona_agent import BrandPersonaAI
+from ai.agent_registry import agent_registry, BRAND_PERSONA
 from ai.utils.scraper.web_scraper import scrape_full_seo_data
 import json
 
@@ -6,7 +6,7 @@ import json
 class BrandPersonaOrchestrator:
 
     def __init__(self):
-        self.brand_persona_agent = BrandPersonaAI()
+        self.brand_persona_agent = agent_registry.get(BRAND_PERSONA)
 
     def generate_brand_persona(self, url, **kwargs):
         print("Scraping data")
@@ -1,26 +1,30 @@
 import json
 from ai.agents.instagram_post_gen.domain.post_gen_dto import PostGenDto, convert_to_dict
-from ai.agents.instagram_post_gen.master import InstagramPostGenAgent
+from ai.agent_registry import agent_registry, INSTAGRAM_POST_GEN
+from ai.utils.checkpointer import mark_finished, thread_config
+from ai.utils.state_view import FULL, step_state
 
 
 class InstagramPostGenOrchestrator:
     def __init__(self):
-        self.agent = InstagramPostGenAgent()
+        self.agent = agent_registry.get(INSTAGRAM_POST_GEN)
 
-    def generate_response(self, resp, config):
+    def generate_response(self, resp, config, view: str = FULL, before: dict = None):
         agent_state = self.agent.get_state(config)
         next_step = agent_state.next[0] if agent_state.next else "final_draft"
-        return {"workflow_step": next_step, "state": resp}
+        if not agent_state.next:
+            mark_finished(self.agent.memory, config)
+        return {"workflow_step": next_step, "state": step_state(before or {}, resp, view)}
 
-    def run_instagram_post_gen_workflow(self, session_id: str, **kwargs):
-        agent_config = {"configurable": {"thread_id": session_id}}
+    def run_instagram_post_gen_workflow(self, session_id: str, view: str = FULL, **kwargs):
+        agent_config = thread_config(INSTAGRAM_POST_GEN, session_id)
 
         # First time flow
         post_gen_dto = kwargs.get("instagram_post_dto")
         inputs = convert_to_dict(post_gen_dto)
         resp = self.agent.run(**inputs, config=agent_config)
 
-        return self.generate_response(resp, agent_config)
+        return self.generate_response(resp, agent_config, view, inputs)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
 import json
 
-from ai.agents.blog_gen.BlogGeneratorAgent import BlogGeneratorAgent
+from ai.agent_registry import agent_registry, BLOG_GEN
 from ai.domain import BlogGeneratorDto
+from ai.utils.checkpointer import mark_finished, thread_config
+from ai.utils.state_view import DELTA, FULL, step_state
 
 
 def dict_to_blog(blog_dict):
@@ -26,34 +28,68 @@ def dict_to_blog(blog_dict):
     return blog_post
 
 
-def generate_response(resp, agent, config):
+def generate_response(resp, agent, config, view: str = FULL, before: dict = None):
+    """The step response: the next step and the state, whole or (view=delta) only what changed since `before`."""
     agent_state = agent.get_state(config)
     next_step = agent_state.next[0] if agent_state.next else "final_draft"
-    return {"workflow_step": next_step, "state": resp}
+    if not agent_state.next:
+        mark_finished(agent.memory, config)
+    return {"workflow_step": next_step, "state": step_state(before or {}, resp, view)}
 
 
-def run_blog_gen_workflow(session_id: str, **kwargs):
-    agent_config = {"configurable": {"thread_id": session_id}}
-    agent = BlogGeneratorAgent()
+def get_session_state(workflow: str, session_id: str) -> dict:
+    """The next step and the whole state of a session, for clients that received delta step responses."""
+    agent = agent_registry.get(workflow)
+    agent_state = agent.get_state(thread_config(workflow, session_id))
+    next_step = agent_state.next[0] if agent_state.next else "final_draft"
+    return {"workflow_step": next_step, "state": agent_state.values}
+
 
+def prepare_blog_gen_input(agent, agent_config, **kwargs):
+    """Applies the human input of a resumed session. Returns the graph input, None when resuming."""
     result = agent.get_state(agent_config).next
     if result:
         next_step = result[0]
         if next_step == 'title_review':
             agent.update_state(config=agent_config, state={"selected_title": kwargs.get("title")}, node_name=next_step)
-            resp = agent.continue_run(config=agent_config)
-            return generate_response(resp, agent, agent_config)
+            return None
         elif next_step == 'section_header_review':
             agent.update_state(config=agent_config, state={"sections": kwargs.get("sections")}, node_name=next_step)
-            resp = agent.continue_run(agent_config)
-            return generate_response(resp, agent, agent_config)
+            return None
 
     # First time flow
     blog_gen_dto = kwargs.get("blog_gen_dto")
-    inputs = BlogGeneratorDto.convert_to_dict(blog_gen_dto)
-    resp = agent.run(**inputs, config=agent_config)
+    return BlogGeneratorDto.convert_to_dict(blog_gen_dto)
+
+
+def run_blog_gen_workflow(session_id: str, view: str = FULL, **kwargs):
+    agent_config = thread_config(BLOG_GEN, session_id)
+    agent = agent_registry.get(BLOG_GEN)
+
+    inputs = prepare_blog_gen_input(agent, agent_config, **kwargs)
+    if inputs is None:
+        # the human input applied by prepare_blog_gen_input is part of the state the step starts from
+        before = agent.get_state(agent_config).values if view == DELTA else None
+        resp = agent.continue_run(config=agent_config)
+    else:
+        before = inputs
+        resp = agent.run(**inputs, config=agent_config)
+
+    return generate_response(resp, agent, agent_config, view, before)
+
+
+def stream_blog_gen_workflow(session_id: str, **kwargs):
+    """Same as run_blog_gen_workflow but yields ("update", {"node", "output"}) as each node finishes,
+    followed by ("final", response)."""
+    agent_config = thread_config(BLOG_GEN, session_id)
+    agent = agent_registry.get(BLOG_GEN)
+
+    inputs = prepare_blog_gen_input(agent, agent_config, **kwargs)
+    for update in agent.stream(inputs, config=agent_config):
+        for node, output in update.items():
+            yield "update", {"node": node, "output": output}
 
-    return generate_response(resp, agent, agent_config)
+    yield "final", generate_response(agent.get_state(agent_config).values, agent, agent_config)
 
 
 if __name__ == "__main__":
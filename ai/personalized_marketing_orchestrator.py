@@ -1,19 +1,22 @@
 import json
 
-from ai.agents.personalized_marketing_agent.master import MarketingAgent
+from ai.agent_registry import agent_registry, PERSONALIZED_MARKETING
+from ai.utils.checkpointer import mark_finished, thread_config
 
 
 class PersonalizedMarketingOrchestrator:
     def __init__(self):
-        self.agent = MarketingAgent()
+        self.agent = agent_registry.get(PERSONALIZED_MARKETING)
 
     def generate_response(self, resp, config):
         agent_state = self.agent.get_state(config)
         next_step = agent_state.next[0] if agent_state.next else "final_draft"
+        if not agent_state.next:
+            mark_finished(self.agent.memory, config)
         return {"workflow_step": next_step, "state": resp}
 
     def run_workflow(self, session_id: str, brand_persona, objective, details, customer_data):
-        agent_config = {"configurable": {"thread_id": session_id}}
+        agent_config = thread_config(PERSONALIZED_MARKETING, session_id)
         resp = self.agent.run(brand_persona=brand_persona, customer_data=customer_data, objective=objective,
                               details=details, config=agent_config)
 
@@ -8,9 +8,13 @@ from openai import OpenAI
 from gradio_client import Client
 import os
 import requests
+import threading
 import time
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
+from ai.utils.cancellation import Cancelled
+from ai.utils.fair_scheduler import image_scheduler
+
 class TooManyRequestsException(Exception):
     pass
 
@@ -31,24 +35,37 @@ def upload_image_to_imgur(image_path):
         raise Exception(f"Failed to upload image to Imgur: {response.status_code}, {response.text}")
 
 
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def get_openai_client():
+    """One OpenAI client (and connection pool) for every image generator, created on first use."""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                _openai_client = OpenAI()
+    return _openai_client
+
+
 class SocialMediaImageGenerator:
-    def __init__(self):
-        """
-        Initialize the image generator with your OpenAI API key.
-        """
-        self.client = OpenAI()
+    @property
+    def client(self):
+        return get_openai_client()
 
     def generate_image(self, prompt, size=None):
         """
         Generate a square image using DALL·E based on the provided prompt.
         """
-        response = self.client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1,
-        )
+        with image_scheduler.slot():
+            response = self.client.images.generate(
+                model="dall-e-3",
+                prompt=prompt,
+                size="1024x1024",
+                quality="standard",
+                n=1,
+            )
         image_url = response.data[0].url
         return image_url
 
@@ -88,12 +105,13 @@ class SocialMediaImageGenerator:
             headers = {"Authorization": f"Bearer {os.getenv('HF_TOKEN')}"}
 
             # Make the API request
-            response = requests.post(API_URL, headers=headers, json={"inputs": prompt})
+            with image_scheduler.slot():
+                response = requests.post(API_URL, headers=headers, json={"inputs": prompt})
 
-            # Handle rate limiting
-            if response.status_code == 429:
-                print(f"Rate limited. Retrying in a few seconds...")
-                raise TooManyRequestsException(response.text)
+                # Handle rate limiting, inside the slot so the scheduler counts it as throttled
+                if response.status_code == 429:
+                    print(f"Rate limited. Retrying in a few seconds...")
+                    raise TooManyRequestsException(response.text)
 
             # Check if the request was successful
             if response.status_code != 200:
@@ -115,6 +133,8 @@ class SocialMediaImageGenerator:
 
         try:
             return _generate_with_retry()
+        except Cancelled:
+            raise
         except Exception as e:
             raise Exception(f"Failed to generate image after {max_retries} attempts: {str(e)}")
 
@@ -0,0 +1,110 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+
+class Cancelled(Exception):
+    """Raised inside cancelled work at its next check, i.e. before its next LLM, image or frame call."""
+
+
+class CancellationToken:
+    """Cancellation flag of one session's work.
+
+    It is set with `cancel()` by the process that runs the work, or found set by `poll`, a callable that is asked
+    at most once every `poll_interval` seconds (e.g. whether the job was cancelled through another process).
+    """
+
+    def __init__(self, poll: Optional[Callable[[], bool]] = None, poll_interval: float = 1.0):
+        self.poll = poll
+        self.poll_interval = poll_interval
+        self._event = threading.Event()
+        self._polled_at = 0.0
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.poll is not None and time.monotonic() - self._polled_at >= self.poll_interval:
+            self._polled_at = time.monotonic()
+            try:
+                if self.poll():
+                    self._event.set()
+            except Exception as e:
+                print(f"Could not poll the cancellation state: {e}")
+        return self._event.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled("The work was cancelled")
+
+
+# the token of the work running in the current context (request thread, job worker or pool thread)
+current_token: ContextVar[Optional[CancellationToken]] = ContextVar("current_cancellation_token", default=None)
+
+
+@contextmanager
+def cancellation_scope(token: CancellationToken):
+    reset_token = current_token.set(token)
+    try:
+        yield token
+    finally:
+        current_token.reset(reset_token)
+
+
+def check_cancelled():
+    """Raises Cancelled if the work running in the current context was cancelled. A no-op outside of a scope."""
+    token = current_token.get()
+    if token is not None:
+        token.check()
+
+
+class CancellationRegistry:
+    """Tokens of the work running in this process, by session id."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+
+    def open(self, session_id: str, poll: Optional[Callable[[], bool]] = None) -> CancellationToken:
+        """A token that `cancel(session_id)` sets, until it is closed."""
+        token = CancellationToken(poll)
+        with self._lock:
+            self._tokens.setdefault(session_id, set()).add(token)
+        return token
+
+    def close(self, session_id: str, token: CancellationToken):
+        with self._lock:
+            tokens = self._tokens.get(session_id, set())
+            tokens.discard(token)
+            if not tokens:
+                self._tokens.pop(session_id, None)
+
+    @contextmanager
+    def scope(self, session_id: str, poll: Optional[Callable[[], bool]] = None):
+        """Runs the block under a token of the session."""
+        token = self.open(session_id, poll)
+        try:
+            with cancellation_scope(token):
+                yield token
+        finally:
+            self.close(session_id, token)
+
+    def cancel(self, session_id: str) -> bool:
+        """Cancels the work of the session running in this process, returns False if there is none."""
+        with self._lock:
+            tokens = list(self._tokens.get(session_id, ()))
+        for token in tokens:
+            token.cancel()
+        return bool(tokens)
+
+    def running(self) -> int:
+        with self._lock:
+            return sum(len(tokens) for tokens in self._tokens.values())
+
+
+cancellations = CancellationRegistry()
@@ -0,0 +1,276 @@
+import os
+import threading
+import time
+
+from ai.utils.checkpointer import PooledSqliteSaver, RETENTION_LOCK_ID, get_checkpointer
+
+DAY = 24 * 3600
+
+
+class CheckpointRetention:
+    """Keeps the checkpoint database from growing without bound.
+
+    - finished threads are compacted to their latest checkpoint, which is all get_state needs
+    - finished threads are deleted `ttl` seconds after they finished (per workflow overrides in `workflow_ttls`)
+    - threads nobody touched for `idle_ttl` seconds are deleted, finished or not
+    - freed pages are handed back to the file system a few at a time with incremental vacuum
+    Every pass works in small batches, so checkpoint writes of running workflows never wait long on it.
+    """
+
+    def __init__(self, saver: PooledSqliteSaver = None, ttl: float = 7 * DAY, idle_ttl: float = 30 * DAY,
+                 workflow_ttls: dict = None, interval: float = 3600, batch_size: int = 200,
+                 vacuum_pages: int = 2000):
+        self._saver = saver
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self.workflow_ttls = workflow_ttls or {}
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def saver(self) -> PooledSqliteSaver:
+        # the shared checkpointer by default, opened on first use rather than when the app is imported
+        if self._saver is None:
+            self._saver = get_checkpointer()
+        return self._saver
+
+    def _delete_threads(self, thread_ids) -> int:
+        with self.saver.cursor() as cur:
+            for table in ("writes", "checkpoints", "thread_activity"):
+                cur.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(t,) for t in thread_ids])
+        return len(thread_ids)
+
+    def _delete_batches(self, query: str, params: tuple) -> int:
+        deleted = 0
+        while True:
+            thread_ids = [row[0] for row in self.saver.conn.execute(query, (*params, self.batch_size))]
+            if not thread_ids:
+                return deleted
+            deleted += self._delete_threads(thread_ids)
+
+    def prune_expired(self) -> int:
+        """Deletes finished threads past their TTL and idle threads, returns the number of threads deleted."""
+        now = time.time()
+        deleted = 0
+        for workflow, ttl in self.workflow_ttls.items():
+            deleted += self._delete_batches(
+                "SELECT thread_id FROM thread_activity WHERE workflow = ? AND finished_at < ? LIMIT ?",
+                (workflow, now - ttl))
+        placeholders = ",".join("?" * len(self.workflow_ttls))
+        deleted += self._delete_batches(
+            "SELECT thread_id FROM thread_activity WHERE finished_at < ? "
+            f"AND workflow NOT IN ({placeholders}) LIMIT ?", (now - self.ttl, *self.workflow_ttls))
+        deleted += self._delete_batches(
+            "SELECT thread_id FROM thread_activity WHERE updated_at < ? LIMIT ?", (now - self.idle_ttl,))
+        return deleted
+
+    def compact_finished(self) -> int:
+        """Drops every checkpoint of a finished thread but its latest, returns the number of checkpoints deleted."""
+        deleted = 0
+        while True:
+            thread_ids = [row[0] for row in self.saver.conn.execute(
+                "SELECT thread_id FROM thread_activity WHERE finished_at IS NOT NULL AND compacted = 0 LIMIT ?",
+                (self.batch_size,))]
+            if not thread_ids:
+                return deleted
+            with self.saver.cursor() as cur:
+                for thread_id in thread_ids:
+                    # checkpoint ids sort by time, the latest one per namespace is what get_state reads
+                    keep = ("SELECT checkpoint_ns, MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? "
+                            "GROUP BY checkpoint_ns")
+                    cur.execute(f"DELETE FROM writes WHERE thread_id = ? AND (checkpoint_ns, checkpoint_id) NOT IN "
+                                f"({keep})", (thread_id, thread_id))
+                    cur.execute(f"DELETE FROM checkpoints WHERE thread_id = ? AND (checkpoint_ns, checkpoint_id) "
+                                f"NOT IN ({keep})", (thread_id, thread_id))
+                    deleted += cur.rowcount
+                    cur.execute("UPDATE thread_activity SET compacted = 1 WHERE thread_id = ?", (thread_id,))
+
+    def vacuum(self) -> int:
+        """Returns up to `vacuum_pages` free pages to the file system, returns the number of pages freed."""
+        conn = self.saver.conn
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # databases created before incremental vacuum was enabled need one full VACUUM (see vacuum_full)
+            return 0
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # executescript steps the pragma to completion, execute would free a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});")
+        return free_pages - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def vacuum_full(self):
+        """Rewrites the whole database and switches it to incremental vacuum. Blocks checkpoint writes while it runs."""
+        conn = self.saver.conn
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+
+    def run_once(self) -> dict:
+        start = time.perf_counter()
+        result = {"compacted_checkpoints": self.compact_finished(), "deleted_threads": self.prune_expired(),
+                  "vacuumed_pages": self.vacuum()}
+        result["seconds"] = time.perf_counter() - start
+        self.last_run = {**result, "at": time.time()}
+        return result
+
+    def stats(self) -> dict:
+        conn = self.saver.conn
+        workflows = {}
+        for workflow, threads, finished in conn.execute(
+                "SELECT workflow, COUNT(*), COUNT(finished_at) FROM thread_activity GROUP BY workflow"):
+            workflows[workflow] = {"threads": threads, "finished_threads": finished, "checkpoints": 0,
+                                   "checkpoint_bytes": 0, "writes": 0}
+        for workflow, checkpoints, size in conn.execute(
+                "SELECT a.workflow, COUNT(*), SUM(LENGTH(c.checkpoint) + LENGTH(c.metadata)) FROM checkpoints c "
+                "JOIN thread_activity a ON a.thread_id = c.thread_id GROUP BY a.workflow"):
+            workflows.setdefault(workflow, {}).update(checkpoints=checkpoints, checkpoint_bytes=size or 0)
+        for workflow, writes in conn.execute(
+                "SELECT a.workflow, COUNT(*) FROM writes w JOIN thread_activity a ON a.thread_id = w.thread_id "
+                "GROUP BY a.workflow"):
+            workflows.setdefault(workflow, {})["writes"] = writes
+
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "db_path": self.saver.db_path,
+            "file_bytes": os.path.getsize(self.saver.db_path) if os.path.exists(self.saver.db_path) else 0,
+            "allocated_bytes": conn.execute("PRAGMA page_count").fetchone()[0] * page_size,
+            "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+            "incremental_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2,
+            "workflows": workflows,
+            "serializer": self.saver.serde.stats() if hasattr(self.saver.serde, "stats") else None,
+            "last_run": self.last_run,
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="checkpoint-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                result = self.run_once()
+                print(f"Checkpoint retention: {result}")
+            except Exception as e:
+                print(f"Checkpoint retention failed: {e}")
+
+
+class SharedCheckpointRetention(CheckpointRetention):
+    """The same retention for the PostgreSQL database the replicas share (BLINX_CHECKPOINT_URL).
+
+    Every replica runs it, and a pass only does work on the replica that takes the advisory lock first; the others
+    skip theirs. PostgreSQL reuses the freed space through autovacuum, so there is no incremental vacuum step.
+    Each step takes its own connection from the checkpointer pool.
+    """
+
+    CHECKPOINT_TABLES = ("checkpoint_writes", "checkpoint_blobs", "checkpoints", "thread_activity")
+
+    def _delete_where(self, condition: str, params: tuple) -> int:
+        deleted = 0
+        with self.saver.conn.connection() as conn:
+            while True:
+                thread_ids = [row["thread_id"] for row in conn.execute(
+                    f"SELECT thread_id FROM thread_activity WHERE {condition} LIMIT %s", (*params, self.batch_size))]
+                if not thread_ids:
+                    return deleted
+                with conn.transaction():
+                    for table in self.CHECKPOINT_TABLES:
+                        conn.execute(f"DELETE FROM {table} WHERE thread_id = ANY(%s)", (thread_ids,))
+                deleted += len(thread_ids)
+
+    def prune_expired(self) -> int:
+        now = time.time()
+        deleted = 0
+        for workflow, ttl in self.workflow_ttls.items():
+            deleted += self._delete_where("workflow = %s AND finished_at < %s", (workflow, now - ttl))
+        deleted += self._delete_where("finished_at < %s AND NOT workflow = ANY(%s)",
+                                      (now - self.ttl, list(self.workflow_ttls)))
+        deleted += self._delete_where("updated_at < %s", (now - self.idle_ttl,))
+        return deleted
+
+    def compact_finished(self) -> int:
+        deleted = 0
+        with self.saver.conn.connection() as conn:
+            while True:
+                thread_ids = [row["thread_id"] for row in conn.execute(
+                    "SELECT thread_id FROM thread_activity WHERE finished_at IS NOT NULL AND NOT compacted LIMIT %s",
+                    (self.batch_size,))]
+                if not thread_ids:
+                    return deleted
+                with conn.transaction():
+                    # checkpoint ids sort by time, the latest one per namespace is what get_state reads
+                    deleted += conn.execute(
+                        "DELETE FROM checkpoints c WHERE c.thread_id = ANY(%s) AND c.checkpoint_id < ("
+                        "SELECT MAX(l.checkpoint_id) FROM checkpoints l WHERE l.thread_id = c.thread_id "
+                        "AND l.checkpoint_ns = c.checkpoint_ns)", (thread_ids,)).rowcount
+                    conn.execute(
+                        "DELETE FROM checkpoint_writes w WHERE w.thread_id = ANY(%s) AND NOT EXISTS ("
+                        "SELECT 1 FROM checkpoints c WHERE c.thread_id = w.thread_id "
+                        "AND c.checkpoint_ns = w.checkpoint_ns AND c.checkpoint_id = w.checkpoint_id)", (thread_ids,))
+                    # channel values are stored once per version, only those the kept checkpoints point to remain
+                    conn.execute(
+                        "DELETE FROM checkpoint_blobs b WHERE b.thread_id = ANY(%s) AND NOT EXISTS ("
+                        "SELECT 1 FROM checkpoints c WHERE c.thread_id = b.thread_id "
+                        "AND c.checkpoint_ns = b.checkpoint_ns "
+                        "AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version)", (thread_ids,))
+                    conn.execute("UPDATE thread_activity SET compacted = TRUE WHERE thread_id = ANY(%s)",
+                                 (thread_ids,))
+
+    def vacuum(self) -> int:
+        return 0
+
+    def vacuum_full(self):
+        """Rewrites the checkpoint tables. Blocks checkpoint reads and writes of every replica while it runs."""
+        with self.saver.conn.connection() as conn:
+            for table in self.CHECKPOINT_TABLES:
+                conn.execute(f"VACUUM FULL {table}")
+
+    def run_once(self) -> dict:
+        with self.saver.conn.connection() as conn:
+            if not conn.execute("SELECT pg_try_advisory_lock(%s) AS locked", (RETENTION_LOCK_ID,)).fetchone()["locked"]:
+                return {"skipped": "another replica is running a retention pass"}
+            try:
+                return super().run_once()
+            finally:
+                conn.execute("SELECT pg_advisory_unlock(%s)", (RETENTION_LOCK_ID,))
+
+    def stats(self) -> dict:
+        workflows = {}
+        with self.saver.conn.connection() as conn:
+            for row in conn.execute("SELECT workflow, COUNT(*) AS threads, COUNT(finished_at) AS finished "
+                                    "FROM thread_activity GROUP BY workflow"):
+                workflows[row["workflow"]] = {"threads": row["threads"], "finished_threads": row["finished"],
+                                              "checkpoints": 0, "checkpoint_bytes": 0, "writes": 0}
+            for row in conn.execute(
+                    "SELECT a.workflow, COUNT(*) AS checkpoints, "
+                    "SUM(pg_column_size(c.checkpoint) + pg_column_size(c.metadata)) AS size FROM checkpoints c "
+                    "JOIN thread_activity a ON a.thread_id = c.thread_id GROUP BY a.workflow"):
+                workflows.setdefault(row["workflow"], {}).update(checkpoints=row["checkpoints"],
+                                                                 checkpoint_bytes=row["size"] or 0)
+            for row in conn.execute(
+                    "SELECT a.workflow, SUM(pg_column_size(b.blob)) AS size FROM checkpoint_blobs b "
+                    "JOIN thread_activity a ON a.thread_id = b.thread_id GROUP BY a.workflow"):
+                workflows.setdefault(row["workflow"], {})["blob_bytes"] = row["size"] or 0
+            for row in conn.execute(
+                    "SELECT a.workflow, COUNT(*) AS writes FROM checkpoint_writes w "
+                    "JOIN thread_activity a ON a.thread_id = w.thread_id GROUP BY a.workflow"):
+                workflows.setdefault(row["workflow"], {})["writes"] = row["writes"]
+            allocated = conn.execute("SELECT SUM(pg_total_relation_size(t)) AS size FROM unnest(%s::regclass[]) t",
+                                     (list(self.CHECKPOINT_TABLES),)).fetchone()["size"]
+
+        return {
+            "database": "postgresql",
+            "allocated_bytes": int(allocated or 0),
+            "workflows": workflows,
+            "serializer": self.saver.serde.stats() if hasattr(self.saver.serde, "stats") else None,
+            "last_run": self.last_run,
+        }
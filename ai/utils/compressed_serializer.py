@@ -0,0 +1,161 @@
+import threading
+import time
+import zlib
+from typing import Any
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+ZSTD = "zstd"
+ZLIB = "zlib"
+# levels picked with the benchmark below: past these the states barely shrink but encoding gets much slower
+DEFAULT_LEVELS = {ZSTD: 3, ZLIB: 6}
+
+
+def zstd_available() -> bool:
+    try:
+        import zstandard  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class CompressedSerializer:
+    """Wraps a LangGraph serializer and compresses every payload of at least `threshold` bytes.
+
+    Compressed payloads are stored with the codec appended to their type ("msgpack+zstd"), so checkpoints written
+    before compression was enabled, or below the threshold, still load as they are. Keeps counters of the bytes
+    before and after compression and of the time spent encoding and decoding.
+    """
+
+    def __init__(self, serde=None, codec: str = None, level: int = None, threshold: int = 2048):
+        self.serde = serde or JsonPlusSerializer()
+        self.codec = codec or (ZSTD if zstd_available() else ZLIB)
+        self.level = DEFAULT_LEVELS[self.codec] if level is None else level
+        self.threshold = threshold
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"encoded": 0, "compressed": 0, "bytes_in": 0, "bytes_out": 0, "encode_seconds": 0.0,
+                       "decoded": 0, "decode_seconds": 0.0}
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == ZLIB:
+            return zlib.compress(data, self.level)
+        # zstandard compressors must not be shared between threads
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            import zstandard
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return compressor.compress(data)
+
+    def _decompress(self, codec: str, data: bytes) -> bytes:
+        if codec == ZLIB:
+            return zlib.decompress(data)
+        if codec == ZSTD:
+            decompressor = getattr(self._local, "decompressor", None)
+            if decompressor is None:
+                import zstandard
+                decompressor = self._local.decompressor = zstandard.ZstdDecompressor()
+            return decompressor.decompress(data)
+        raise NotImplementedError(f"Unknown compression codec: {codec}")
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.serde.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.serde.loads(data)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        start = time.perf_counter()
+        type_, data = self.serde.dumps_typed(obj)
+        size = len(data)
+        compressed = False
+        if size >= self.threshold:
+            packed = self._compress(data)
+            # payloads that do not compress (images, already compressed bytes) are stored as they are
+            if len(packed) < size * 0.9:
+                type_, data, compressed = f"{type_}+{self.codec}", packed, True
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._stats["encoded"] += 1
+            self._stats["compressed"] += compressed
+            self._stats["bytes_in"] += size
+            self._stats["bytes_out"] += len(data)
+            self._stats["encode_seconds"] += elapsed
+        return type_, data
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        start = time.perf_counter()
+        type_, payload = data
+        type_, _, codec = type_.partition("+")
+        if codec:
+            payload = self._decompress(codec, payload)
+        obj = self.serde.loads_typed((type_, payload))
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._stats["decoded"] += 1
+            self._stats["decode_seconds"] += elapsed
+        return obj
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["codec"] = self.codec
+        stats["level"] = self.level
+        stats["threshold"] = self.threshold
+        stats["compression_ratio"] = stats["bytes_in"] / stats["bytes_out"] if stats["bytes_out"] else 1.0
+        stats["avg_encode_ms"] = stats["encode_seconds"] / stats["encoded"] * 1000 if stats["encoded"] else 0.0
+        stats["avg_decode_ms"] = stats["decode_seconds"] / stats["decoded"] * 1000 if stats["decoded"] else 0.0
+        return stats
+
+
+if __name__ == "__main__":
+    # Benchmark on states shaped like the blog, ad, video and marketing checkpoints
+    import random
+
+    random.seed(7)
+    words = ("dog puppy training owner brand product leash treat healthy walk routine behaviour reward patient "
+             "consistent scooper clean park friendly shop online customer offer launch guide tips care food "
+             "the a and to of for with your in on is are you it this that our can will be more best").split()
+
+    def text(n_words: int) -> str:
+        sentences = []
+        while n_words > 0:
+            length = random.randint(8, 20)
+            sentences.append(" ".join(random.choice(words) for _ in range(length)).capitalize() + ".")
+            n_words -= length
+        return " ".join(sentences)
+
+    brand_persona = {key: [text(12) for _ in range(4)] for key in
+                     ("purpose", "audience", "tone", "emotions", "character", "syntax", "language")}
+    states = {
+        "blog": {"query": "How to train a puppy", "brand_persona": brand_persona, "keywords": text(60),
+                 "generated_titles": [text(10) for _ in range(5)], "selected_title": text(10),
+                 "introduction": text(250),
+                 "sections": [{"section_header": text(6), "description": text(50)} for _ in range(5)],
+                 "generated_sections": [{"section_header": text(6), "section_content": text(600)}
+                                        for _ in range(5)]},
+        "ad": {"objective": text(12), "product_or_service_details": text(20), "brand_persona": brand_persona,
+               "campaign_plan": {"strategy": text(300), "audience": text(80), "channels": [text(5)] * 4},
+               "ad_copies": [{"framework": "AIDA", "background_image_prompt": text(60),
+                              "content": {"headline": text(10), "body": text(120)}} for _ in range(4)]},
+        "video": {"summary": text(400), "key_points": text(250), "target_audience": text(80),
+                  "outline": text(300), "introduction": text(200), "blog_post": text(2500)},
+        "marketing": {"brand_persona": brand_persona, "objective": text(10), "details": text(30),
+                      "customer_data": {f"field_{i}": random.random() for i in range(60)},
+                      "email": {"subject": text(10), "body": text(200)}},
+    }
+
+    configs = [(ZLIB, 1), (ZLIB, 6), (ZLIB, 9)]
+    if zstd_available():
+        configs += [(ZSTD, 1), (ZSTD, 3), (ZSTD, 9), (ZSTD, 19)]
+    rounds = 200
+    print(f"{'state':<11}{'codec':<9}{'raw KB':>8}{'stored KB':>11}{'ratio':>8}{'encode ms':>11}{'decode ms':>11}")
+    for name, state in states.items():
+        for codec, level in configs:
+            serde = CompressedSerializer(codec=codec, level=level, threshold=0)
+            for _ in range(rounds):
+                serde.loads_typed(serde.dumps_typed(state))
+            stats = serde.stats()
+            print(f"{name:<11}{codec + ' ' + str(level):<9}{stats['bytes_in'] / rounds / 1024:>8.1f}"
+                  f"{stats['bytes_out'] / rounds / 1024:>11.1f}{stats['compression_ratio']:>8.2f}"
+                  f"{stats['avg_encode_ms']:>11.3f}{stats['avg_decode_ms']:>11.3f}")
@@ -0,0 +1,368 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from ai.utils.cancellation import check_cancelled
+
+ANONYMOUS = "anonymous"
+
+# priority classes, served strictly in this order
+INTERACTIVE = "interactive"  # a user is waiting on the response: generation requests, human-in-the-loop steps
+BACKGROUND = "background"  # queued jobs a user is waiting on less directly: video analysis
+BULK = "bulk"  # large fan-out work: personalized marketing CSV rows
+PRIORITIES = (INTERACTIVE, BACKGROUND, BULK)
+
+# the user the current request or job works for, LLM and image calls are queued under it
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default=ANONYMOUS)
+# requests are interactive unless they say otherwise, job handlers lower it
+current_priority: ContextVar[str] = ContextVar("current_priority", default=INTERACTIVE)
+
+
+def set_tenant(user_id: Optional[str]):
+    """Tags all LLM work started from the current context (request task, or thread) with `user_id`."""
+    current_tenant.set(str(user_id) if user_id else ANONYMOUS)
+
+
+@contextmanager
+def tenant_scope(user_id: Optional[str], priority: str = None):
+    """Same as set_tenant (and sets the priority class), for threads that are reused by other work afterwards
+    (job workers, pools)."""
+    tenant_token = current_tenant.set(str(user_id) if user_id else ANONYMOUS)
+    priority_token = current_priority.set(priority or current_priority.get())
+    try:
+        yield
+    finally:
+        current_priority.reset(priority_token)
+        current_tenant.reset(tenant_token)
+
+
+class _Waiter:
+    def __init__(self, cost: float):
+        self.cost = cost
+        self.queued_at = time.monotonic()
+        self.granted = threading.Event()
+
+
+class _PriorityClass:
+    """The tenants waiting in one priority class and their deficit round robin state."""
+
+    def __init__(self):
+        self.queues = {}
+        self.round = deque()
+        self.deficits = {}
+        self.in_use = 0
+
+
+class FairScheduler:
+    """Shares `capacity` concurrent calls to a provider fairly between tenants (users), by priority class.
+
+    Calls that find a free slot and nobody waiting run right away. Otherwise they queue per priority class and
+    tenant. Freed slots go to the highest priority class with waiting calls, and within a class round robin over
+    the waiting tenants with deficit round robin: on its turn a tenant earns `quantum` times its weight and runs
+    queued calls as long as it has earned their cost. A tenant with a thousand queued calls thus gets the same
+    share as one with a single call, and never more than `tenant_limit` slots at once.
+
+    A call in flight is never interrupted, but a workflow gives its slot back after every LLM call, i.e. at every
+    node boundary, and queues again for the next one behind any interactive call (or stops there if it was
+    cancelled). `reserved` slots are kept for
+    interactive calls only, so those don't wait for a long background call to finish either.
+    """
+
+    def __init__(self, name: str, capacity: int, tenant_limit: int = None, quantum: float = 1.0,
+                 weights: dict = None, reserved: int = None, recent_waits: int = 1000, throttle_window: float = 60):
+        self.name = name
+        self.capacity = capacity
+        self.tenant_limit = tenant_limit or capacity
+        self.quantum = quantum
+        self.weights = weights or {}
+        self.reserved = capacity // 4 if reserved is None else min(reserved, capacity - 1)
+        self.recent_waits = recent_waits
+        self._lock = threading.Lock()
+        self._classes = {priority: _PriorityClass() for priority in PRIORITIES}
+        self._running = {}
+        self._in_use = 0
+        self._tenants = {}
+        self._priority_waits = {priority: deque(maxlen=recent_waits) for priority in PRIORITIES}
+        self.throttle_window = throttle_window
+        # (finished_at, throttled) of the calls of the last throttle_window seconds
+        self._outcomes = deque()
+        self._call_seconds = None
+
+    @contextmanager
+    def slot(self, tenant: str = None, cost: float = 1.0, priority: str = None) -> Iterator[None]:
+        """Holds one of the provider slots for the duration of the block.
+
+        Cancelled work (see ai.utils.cancellation) raises Cancelled here instead of taking, or keeping, the slot.
+        """
+        tenant = tenant or current_tenant.get()
+        priority = priority or current_priority.get()
+        check_cancelled()
+        self._acquire(tenant, cost, priority)
+        start = time.monotonic()
+        throttled = False
+        try:
+            # the work may have been cancelled while it was queued
+            check_cancelled()
+            yield
+        except Exception as e:
+            throttled = is_throttled(e)
+            raise
+        finally:
+            self._release(tenant, priority)
+            self._record_call(time.monotonic() - start, throttled)
+
+    def _limit(self, priority: str) -> int:
+        return self.capacity if priority == INTERACTIVE else self.capacity - self.reserved
+
+    def _in_use_up_to(self, priority: str) -> int:
+        # slots counted against the limit of `priority`: interactive may use all, the others share the rest
+        if priority == INTERACTIVE:
+            return self._in_use
+        return self._in_use - self._classes[INTERACTIVE].in_use
+
+    def _can_run(self, tenant: str, priority: str) -> bool:
+        return (self._in_use < self.capacity and self._in_use_up_to(priority) < self._limit(priority)
+                and self._running.get(tenant, 0) < self.tenant_limit)
+
+    def _acquire(self, tenant: str, cost: float, priority: str):
+        waiter = _Waiter(cost)
+        with self._lock:
+            queued = any(priority_class.round for priority_class in self._classes.values())
+            if not queued and self._can_run(tenant, priority):
+                self._grant(tenant, priority, waiter)
+            else:
+                priority_class = self._classes[priority]
+                queue = priority_class.queues.get(tenant)
+                if queue is None:
+                    queue = priority_class.queues[tenant] = deque()
+                    priority_class.round.append(tenant)
+                    priority_class.deficits[tenant] = 0.0
+                queue.append(waiter)
+                self._dispatch()
+        waiter.granted.wait()
+
+    def _release(self, tenant: str, priority: str):
+        with self._lock:
+            self._in_use -= 1
+            self._classes[priority].in_use -= 1
+            self._running[tenant] -= 1
+            if not self._running[tenant]:
+                del self._running[tenant]
+            self._dispatch()
+
+    def _grant(self, tenant: str, priority: str, waiter: _Waiter):
+        self._in_use += 1
+        self._classes[priority].in_use += 1
+        self._running[tenant] = self._running.get(tenant, 0) + 1
+        self._record_wait(tenant, priority, time.monotonic() - waiter.queued_at)
+        waiter.granted.set()
+
+    def _dispatch(self):
+        """Hands free slots to queued calls, highest priority class first."""
+        for priority in PRIORITIES:
+            self._dispatch_class(priority)
+            if self._in_use >= self.capacity:
+                return
+
+    def _dispatch_class(self, priority: str):
+        """Deficit round robin over the tenants waiting in one priority class."""
+        priority_class = self._classes[priority]
+        queues, round_, deficits = priority_class.queues, priority_class.round, priority_class.deficits
+        while round_ and self._in_use_up_to(priority) < self._limit(priority) and self._in_use < self.capacity:
+            progressed = False
+            for _ in range(len(round_)):
+                tenant = round_[0]
+                queue = queues[tenant]
+                if not self._can_run(tenant, priority):
+                    round_.rotate(-1)
+                    continue
+                progressed = True
+                if deficits[tenant] < queue[0].cost:
+                    deficits[tenant] += self.quantum * self.weights.get(tenant, 1.0)
+                while queue and deficits[tenant] >= queue[0].cost and self._can_run(tenant, priority):
+                    waiter = queue.popleft()
+                    deficits[tenant] -= waiter.cost
+                    self._grant(tenant, priority, waiter)
+                if not queue:
+                    # a tenant that has nothing queued does not save up credit
+                    round_.popleft()
+                    del queues[tenant]
+                    del deficits[tenant]
+                elif self._in_use_up_to(priority) < self._limit(priority) and self._in_use < self.capacity:
+                    round_.rotate(-1)
+                else:
+                    # out of slots mid-turn: the tenant keeps its place and what is left of its deficit
+                    return
+            if not progressed:
+                # every waiting tenant is at its concurrency cap
+                return
+
+    def _record_call(self, seconds: float, throttled: bool):
+        with self._lock:
+            now = time.monotonic()
+            self._outcomes.append((now, throttled))
+            while self._outcomes and self._outcomes[0][0] < now - self.throttle_window:
+                self._outcomes.popleft()
+            # moving average of how long a call holds its slot
+            self._call_seconds = seconds if self._call_seconds is None else 0.9 * self._call_seconds + 0.1 * seconds
+
+    def throttle_rate(self) -> float:
+        """Share of the calls of the last `throttle_window` seconds that the provider rejected with a rate limit."""
+        with self._lock:
+            outcomes = [throttled for finished_at, throttled in self._outcomes
+                        if finished_at >= time.monotonic() - self.throttle_window]
+        return sum(outcomes) / len(outcomes) if outcomes else 0.0
+
+    def estimated_wait(self, priority: str = INTERACTIVE) -> float:
+        """Seconds a call of `priority` made now would wait for a slot: the calls queued ahead of it (same or higher
+        priority) drained by the slots it may use, at the recent call duration."""
+        with self._lock:
+            ahead = 0
+            for class_priority in PRIORITIES[:PRIORITIES.index(priority) + 1]:
+                ahead += sum(len(queue) for queue in self._classes[class_priority].queues.values())
+            if not ahead and self._in_use_up_to(priority) < self._limit(priority):
+                return 0.0
+            return (ahead + 1) * (self._call_seconds or 0.0) / self._limit(priority)
+
+    def _record_wait(self, tenant: str, priority: str, wait: float):
+        stats = self._tenants.get(tenant)
+        if stats is None:
+            stats = self._tenants[tenant] = {"calls": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+                                             "recent": deque(maxlen=self.recent_waits)}
+        stats["calls"] += 1
+        stats["wait_seconds"] += wait
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], wait)
+        stats["recent"].append(wait)
+        self._priority_waits[priority].append(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            tenants = {}
+            for tenant, stats in self._tenants.items():
+                tenants[tenant] = {
+                    "running": self._running.get(tenant, 0),
+                    "queued": sum(len(c.queues.get(tenant, ())) for c in self._classes.values()),
+                    "calls": stats["calls"],
+                    "avg_wait_ms": stats["wait_seconds"] / stats["calls"] * 1000,
+                    "p95_wait_ms": _p95(stats["recent"]) * 1000,
+                    "max_wait_ms": stats["max_wait_seconds"] * 1000,
+                }
+            priorities = {priority: {"running": c.in_use, "queued": sum(len(q) for q in c.queues.values()),
+                                     "p95_wait_ms": _p95(self._priority_waits[priority]) * 1000}
+                          for priority, c in self._classes.items()}
+            stats = {"capacity": self.capacity, "tenant_limit": self.tenant_limit, "reserved": self.reserved,
+                     "in_use": self._in_use, "avg_call_ms": (self._call_seconds or 0.0) * 1000,
+                     "priorities": priorities, "tenants": tenants}
+        stats["throttle_rate"] = self.throttle_rate()
+        return stats
+
+
+def _p95(waits) -> float:
+    waits = sorted(waits)
+    return waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+
+
+# rate limit errors of the OpenAI (RateLimitError), Gemini (ResourceExhausted) and Hugging Face image clients
+THROTTLE_ERRORS = {"RateLimitError", "ResourceExhausted", "TooManyRequests", "TooManyRequestsException"}
+
+
+def is_throttled(error: Exception) -> bool:
+    """Whether a provider call failed because the provider is rate limiting us (HTTP 429)."""
+    if type(error).__name__ in THROTTLE_ERRORS:
+        return True
+    return getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == 429
+
+
+class ScheduledModel(Runnable):
+    """Chat model wrapper that takes a slot of `scheduler` for every call, so it can be used in chains as is."""
+
+    def __init__(self, model: Runnable, scheduler: FairScheduler):
+        self.model = model
+        self.scheduler = scheduler
+
+    def invoke(self, input, config: Optional[RunnableConfig] = None, **kwargs):
+        with self.scheduler.slot():
+            return self.model.invoke(input, config, **kwargs)
+
+    def stream(self, input, config: Optional[RunnableConfig] = None, **kwargs):
+        with self.scheduler.slot():
+            yield from self.model.stream(input, config, **kwargs)
+
+    def __getattr__(self, name):
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+
+def scheduler_from_env(name: str, capacity: int, tenant_limit: int) -> FairScheduler:
+    """<NAME>_CONCURRENCY and <NAME>_TENANT_CONCURRENCY override the defaults."""
+    prefix = name.upper()
+    return FairScheduler(name, capacity=int(os.getenv(f"{prefix}_CONCURRENCY", str(capacity))),
+                         tenant_limit=int(os.getenv(f"{prefix}_TENANT_CONCURRENCY", str(tenant_limit))))
+
+
+# one scheduler per provider quota
+openai_scheduler = scheduler_from_env("openai", capacity=32, tenant_limit=8)
+gemini_scheduler = scheduler_from_env("gemini", capacity=8, tenant_limit=2)
+image_scheduler = scheduler_from_env("image_gen", capacity=4, tenant_limit=2)
+schedulers = {scheduler.name: scheduler for scheduler in (openai_scheduler, gemini_scheduler, image_scheduler)}
+
+
+if __name__ == "__main__":
+    # p95 latency of interactive steps (three LLM calls in a row, like resuming a blog after title review) while
+    # two CSV jobs run their rows and two video analyses run, with every call in one queue, shared fairly
+    # between users, and with priority classes
+    import statistics
+    from concurrent.futures import ThreadPoolExecutor
+
+    call_seconds = 0.02
+    video_call_seconds = 0.1
+
+    def workload(scheduler: FairScheduler, tenants: bool, priorities: bool) -> list:
+        stop = threading.Event()
+
+        def call(tenant: str, priority: str, seconds: float = call_seconds):
+            with scheduler.slot(tenant if tenants else ANONYMOUS, priority=priority if priorities else INTERACTIVE):
+                time.sleep(seconds)
+
+        def csv_rows(user: str):
+            while not stop.is_set():
+                call(user, BULK)
+
+        def video_analysis(user: str):
+            while not stop.is_set():
+                call(user, BACKGROUND, video_call_seconds)
+
+        def interactive_step(user: str) -> float:
+            start = time.perf_counter()
+            for _ in range(3):
+                call(user, INTERACTIVE)
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=64) as pool:
+            # 5 row threads per CSV job, as process_df runs them
+            load = [pool.submit(csv_rows, f"csv-user-{i % 2}") for i in range(10)]
+            load += [pool.submit(video_analysis, f"video-user-{i}") for i in range(2)]
+            time.sleep(0.2)
+            steps = []
+            for i in range(100):
+                steps.append(pool.submit(interactive_step, f"user-{i % 10}"))
+                time.sleep(call_seconds)
+            latencies = [step.result() for step in steps]
+            stop.set()
+            for future in load:
+                future.result()
+        return latencies
+
+    print(f"{'scheduling':<18}{'p50 step (ms)':>15}{'p95 step (ms)':>15}")
+    for name, tenants, priorities in (("single queue", False, False), ("fair share", True, False),
+                                      ("priority classes", True, True)):
+        latencies = workload(FairScheduler("benchmark", capacity=8, tenant_limit=5), tenants, priorities)
+        p95 = statistics.quantiles(latencies, n=20)[-1] * 1000
+        print(f"{name:<18}{statistics.median(latencies) * 1000:>15.1f}{p95:>15.1f}")
@@ -3,19 +3,22 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
 
+from ai.utils.fair_scheduler import ScheduledModel, gemini_scheduler, openai_scheduler
+
 _ = load_dotenv()
 
-model_gemini = ChatGoogleGenerativeAI(
+# every call waits for a slot of its provider's scheduler, queued fairly per user (see fair_scheduler.py)
+model_gemini = ScheduledModel(ChatGoogleGenerativeAI(
     model="gemini-1.5-pro",
     temperature=0.7,
     max_tokens=None,
     timeout=None,
     max_retries=2,
     # other params...
-)
+), gemini_scheduler)
 
 # model_gemini = ChatOpenAI(model="gpt-4o", temperature=0)
 
-model_openai = ChatOpenAI(model="gpt-4o", temperature=0.7)
+model_openai = ScheduledModel(ChatOpenAI(model="gpt-4o", temperature=0.7), openai_scheduler)
 
 # text_to_image_model = DallEAPIWrapper(model_name='dall-e-3')
@@ -0,0 +1,151 @@
+import time
+
+from langgraph.checkpoint.postgres import PostgresSaver
+
+from ai.utils.checkpointer import SETUP_LOCK_ID, workflow_of
+
+
+class SharedPostgresSaver(PostgresSaver):
+    """PostgresSaver for the checkpoint database every replica writes to (BLINX_CHECKPOINT_URL).
+
+    Replicas that start together run the migrations one at a time, under an advisory lock. Like PooledSqliteSaver
+    it records the last write and the end of every thread in thread_activity, which SharedCheckpointRetention
+    works from.
+    """
+
+    def setup(self) -> None:
+        with self.conn.connection() as conn:
+            conn.execute("SELECT pg_advisory_lock(%s)", (SETUP_LOCK_ID,))
+            try:
+                # on the connection that holds the lock, the pool may have no second one to spare
+                PostgresSaver(conn).setup()
+                existed = conn.execute("SELECT to_regclass('thread_activity') IS NOT NULL AS existed").fetchone()
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS thread_activity (
+                        thread_id TEXT PRIMARY KEY,
+                        workflow TEXT NOT NULL,
+                        updated_at DOUBLE PRECISION NOT NULL,
+                        finished_at DOUBLE PRECISION,
+                        compacted BOOLEAN NOT NULL DEFAULT FALSE
+                    )
+                    """)
+                conn.execute("CREATE INDEX IF NOT EXISTS thread_activity_updated ON thread_activity (updated_at)")
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS thread_activity_finished ON thread_activity (finished_at, compacted)")
+                if not existed["existed"]:
+                    # threads checkpointed before activity was tracked count as active from now on
+                    conn.execute(
+                        "INSERT INTO thread_activity (thread_id, workflow, updated_at) "
+                        "SELECT thread_id, CASE WHEN strpos(thread_id, ':') > 0 "
+                        "THEN split_part(thread_id, ':', 1) ELSE '' END, %s "
+                        "FROM checkpoints GROUP BY thread_id ON CONFLICT DO NOTHING", (time.time(),))
+            finally:
+                conn.execute("SELECT pg_advisory_unlock(%s)", (SETUP_LOCK_ID,))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = str(config["configurable"]["thread_id"])
+        with self._cursor() as cur:
+            cur.execute(
+                "INSERT INTO thread_activity (thread_id, workflow, updated_at) VALUES (%s, %s, %s) "
+                "ON CONFLICT (thread_id) DO UPDATE SET updated_at = excluded.updated_at, finished_at = NULL, "
+                "compacted = FALSE", (thread_id, workflow_of(thread_id), time.time()))
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def mark_finished(self, config: dict):
+        """Marks the thread of `config` as finished, so retention can compact it and later delete it."""
+        with self._cursor() as cur:
+            cur.execute("UPDATE thread_activity SET finished_at = %s WHERE thread_id = %s",
+                        (time.time(), str(config["configurable"]["thread_id"])))
+
+
+if __name__ == "__main__":
+    # Check against a real PostgreSQL server, in a schema of its own that is dropped afterwards:
+    #   python -m ai.utils.postgres_checkpointer [URL]    (default BLINX_CHECKPOINT_URL, e.g. the compose postgres)
+    # replicas starting on an empty database together, then compaction and pruning of the retention pass.
+    # Skipped (exit status 0) when no database is configured or reachable.
+    import sys
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+
+    from ai.utils.checkpoint_retention import SharedCheckpointRetention
+    from ai.utils.checkpointer import (CHECKPOINT_URL, RETENTION_LOCK_ID, mark_finished, open_postgres_checkpointer,
+                                       thread_config)
+    from backend.utils.replica_check import build_review_graph, run_step
+
+    url = sys.argv[1] if len(sys.argv) > 1 else CHECKPOINT_URL
+    if not url:
+        print("SKIP: no database, pass a URL or set BLINX_CHECKPOINT_URL")
+        sys.exit(0)
+    schema = f"blinx_check_{uuid.uuid4().hex[:8]}"
+    try:
+        admin = psycopg.connect(url, autocommit=True, connect_timeout=5)
+    except psycopg.OperationalError as e:
+        print(f"SKIP: database not reachable: {e}")
+        sys.exit(0)
+    admin.execute(f"CREATE SCHEMA {schema}")
+    schema_url = make_conninfo(url, options=f"-c search_path={schema}")
+
+    failures = []
+
+    def expect(name: str, ok: bool, detail=""):
+        print(f"{name:<52} {'ok' if ok else 'FAIL'} {detail}")
+        if not ok:
+            failures.append(name)
+
+    savers = []
+    try:
+        # replicas starting together on an empty database
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            savers = list(pool.map(lambda _: open_postgres_checkpointer(schema_url, pool_size=3), range(4)))
+        expect("setup on 4 replicas at once", True)
+        saver = savers[0]
+        graph = build_review_graph(saver)
+        finished, active = thread_config("blog_gen", "finished"), thread_config("blog_gen", "active")
+        for config in (finished, active):
+            run_step(graph, config, "start", "Training a puppy")
+            run_step(graph, config, "select_title", "Training a puppy, part 1")
+        run_step(graph, finished, "final_review", ["Part 1", "Part 2"])
+        mark_finished(saver, finished)
+
+        retention = SharedCheckpointRetention(saver, ttl=3600, idle_ttl=3600, workflow_ttls={}, interval=3600)
+        before = retention.stats()["workflows"]["blog_gen"]
+        expect("activity of both threads recorded", before["threads"] == 2 and before["finished_threads"] == 1,
+               before)
+        with saver.conn.connection() as conn:
+            conn.execute("SELECT pg_advisory_lock(%s)", (RETENTION_LOCK_ID,))
+            other_replica = SharedCheckpointRetention(savers[1], ttl=3600, idle_ttl=3600, workflow_ttls={},
+                                                      interval=3600)
+            skipped = other_replica.run_once()
+            conn.execute("SELECT pg_advisory_unlock(%s)", (RETENTION_LOCK_ID,))
+        expect("pass skipped while another replica holds the lock", "skipped" in skipped, skipped)
+
+        result = retention.run_once()
+        expect("finished thread compacted", result["compacted_checkpoints"] > 0, result)
+        state = graph.get_state(finished)
+        expect("compacted thread keeps its final state", state.values.get("draft") == "Part 1\nPart 2"
+               and len(list(graph.get_state_history(finished))) == 1)
+        expect("active thread keeps its history", len(list(graph.get_state_history(active))) > 1)
+        expect("active thread resumes after the pass",
+               run_step(graph, active, "final_review", ["Part 1"]) == "Part 1")
+
+        retention.ttl = 0
+        result = retention.run_once()
+        expect("finished thread deleted after its TTL", result["deleted_threads"] == 1
+               and not graph.get_state(finished).values, result)
+        retention.idle_ttl = 0
+        result = retention.run_once()
+        expect("idle thread deleted after CHECKPOINT_IDLE_TTL", result["deleted_threads"] == 1
+               and not graph.get_state(active).values, result)
+        expect("no rows left", retention.stats()["workflows"] == {})
+    finally:
+        for saver in savers:
+            saver.conn.close()
+        admin.execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+    print("FAIL" if failures else "PASS")
+    sys.exit(1 if failures else 0)
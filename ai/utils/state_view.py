@@ -0,0 +1,49 @@
+FULL = "full"  # the whole graph state, what step responses always returned
+DELTA = "delta"  # only the fields the step added or changed
+VIEWS = (FULL, DELTA)
+
+
+def state_delta(before: dict, after: dict) -> dict:
+    """The fields of `after` that are new or changed since `before` (the graph input, or the state the step
+    resumed from)."""
+    return {key: value for key, value in after.items() if key not in before or before[key] != value}
+
+
+def step_state(before: dict, after: dict, view: str) -> dict:
+    return state_delta(before, after) if view == DELTA else after
+
+
+if __name__ == "__main__":
+    # Payload size and serialization time of the /resumeBlogGeneration response after title selection (the step
+    # writes the introduction and the section plan), full state against delta, with the stdlib json module
+    # (JSONResponse) and orjson (ORJSONResponse)
+    import json
+    import time
+
+    import orjson
+
+    def text(n_words: int) -> str:
+        return " ".join(f"word{i % 97}" for i in range(n_words))
+
+    brand_persona = {key: [text(30) for _ in range(4)]
+                     for key in ("purpose", "audience", "tone", "emotions", "character", "syntax", "language")}
+    before = {"query": "How to train a puppy", "brand_persona": json.dumps(brand_persona),
+              "max_title_suggestions": 5, "max_sections": 6, "max_images": 2, "include_images": True,
+              "keywords": json.dumps([text(3) for _ in range(30)]), "generated_titles": [text(10) for _ in range(5)],
+              "selected_title": text(10)}
+    after = {**before, "introduction": text(150),
+             "sections": [{"section_header": text(6), "description": text(40)} for _ in range(6)]}
+
+    def timed(dumps, payload, n: int = 2000) -> float:
+        start = time.perf_counter()
+        for _ in range(n):
+            dumps(payload)
+        return (time.perf_counter() - start) / n * 1000
+
+    print(f"{'view':<8}{'bytes':>10}{'json (ms)':>12}{'orjson (ms)':>13}")
+    for view in VIEWS:
+        payload = {"session_id": "s", "step_output": {"workflow_step": "section_header_review",
+                                                      "state": step_state(before, after, view)}}
+        size = len(orjson.dumps(payload))
+        print(f"{view:<8}{size:>10}{timed(lambda p: json.dumps(p).encode(), payload):>12.3f}"
+              f"{timed(orjson.dumps, payload):>13.3f}")
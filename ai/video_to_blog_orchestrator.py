@@ -1,18 +1,21 @@
-from ai.agents.repurpose_video_agent.master import VideoToBlogPostAgent
+from ai.agent_registry import agent_registry, VIDEO_TO_BLOG
+from ai.utils.checkpointer import mark_finished, thread_config
 
 
 class VideoToBlogOrchestrator:
     def __init__(self):
-        self.agent = VideoToBlogPostAgent()
+        self.agent = agent_registry.get(VIDEO_TO_BLOG)
 
     def generate_response(self, resp, config):
         agent_state = self.agent.get_state(config)
         next_step = agent_state.next[0] if agent_state.next else "final_draft"
+        if not agent_state.next:
+            mark_finished(self.agent.memory, config)
         return {"workflow_step": next_step, "state": resp}
     
-    def run(self, video_file_path: str, session_id: str):
-        agent_config = {"configurable": {"thread_id": session_id}}
-        resp = self.agent.run(video_file_path, agent_config)
+    def run(self, video_file_path: str, session_id: str, content_hash: str = None):
+        agent_config = thread_config(VIDEO_TO_BLOG, session_id)
+        resp = self.agent.run(video_file_path, agent_config, content_hash)
         return self.generate_response(resp, agent_config)
     
 
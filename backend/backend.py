@@ -1,27 +1,41 @@
+import asyncio
+import contextvars
+import functools
 import json
+import math
 import os
 import shutil
 import uuid
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Literal, Optional
 
-import firebase_admin
-import pandas as pd
+import anyio
 import requests
-from fastapi import FastAPI, Body, HTTPException, BackgroundTasks, UploadFile, File, Form
+from fastapi import FastAPI, Body, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Request, \
+    Response, Header
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.params import Query
-from fastapi.responses import JSONResponse
-from firebase_admin import firestore, credentials
-from firebase_admin import storage
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 from ai.ad_gen_orchestrator import AdGenOrchestrator
+from ai.agent_registry import agent_registry, AD_GEN, BLOG_GEN, INSTAGRAM_POST_GEN, PERSONALIZED_MARKETING
 from ai.agents.facebook_ad_gen.domain.ad_gen_dto import AdGenDto
 from ai.agents.instagram_post_gen.domain.post_gen_dto import PostGenDto
+from ai.agents.repurpose_video_agent.result_cache import video_result_cache
 from ai.brand_persona_orchestrator import BrandPersonaOrchestrator
 from ai.domain.BlogGeneratorDto import BlogGeneratorDto
 from ai.instagram_post_gen_orchestrator import InstagramPostGenOrchestrator
-from ai.orchestrator import run_blog_gen_workflow
+from ai.orchestrator import get_session_state, run_blog_gen_workflow, stream_blog_gen_workflow
 from ai.personalized_marketing_orchestrator import PersonalizedMarketingOrchestrator
+from ai.utils.cancellation import Cancelled, cancellation_scope, cancellations, check_cancelled
+from ai.utils.checkpoint_retention import CheckpointRetention, SharedCheckpointRetention
+from ai.utils.checkpointer import get_checkpointer, is_shared_checkpointer
+from ai.utils.fair_scheduler import BACKGROUND, BULK, gemini_scheduler, openai_scheduler, schedulers, set_tenant, \
+    tenant_scope
+from ai.utils.state_view import FULL
 from ai.video_to_blog_orchestrator import VideoToBlogOrchestrator
 from backend.domain.ad_generation_request_args import AdGenerationRequestArgs, InstagramPostRequestArgs, \
     MarketingPostRequestArgs
@@ -34,8 +48,26 @@ from backend.domain.enums.blog_generation_steps import BlogGenerationSteps
 from backend.domain.enums.operations import Operations
 from backend.domain.session_context import SessionContext
 from backend.domain.user import User
-
-app = FastAPI()
+from backend.domain.video_upload_request_args import VideoUploadRequestArgs
+from backend.firebase import LazyClient, get_bucket, get_firestore_client
+from backend.jobs.job_queue import CANCELLED, QUEUED, RUNNING, JobQueue
+from backend.jobs.worker_pool import JobHandler, WorkerPool
+from backend.utils.admission import AdmissionController, Overloaded
+from backend.utils.cache import TTLCache
+from backend.utils.csv_ingest import CsvIngestError, UPLOAD_CHUNK_SIZE, ingest_csv, strip_compression_suffix
+from backend.utils.firestore_writer import FirestoreWriter
+from backend.utils.idempotency import IdempotencyConflict, IdempotencyKeyReused, IdempotencyStore
+from backend.utils.readiness import Readiness
+from backend.utils.session_cancellation import SessionCancellations
+from backend.utils.session_registry import SessionRegistry
+from backend.utils.single_flight import SingleFlight, fingerprint, normalize_text, normalize_url
+from backend.utils.state_response import StateResponse
+from backend.utils.status_broker import StatusBroker, TERMINAL_STATUSES
+from backend.utils.task_status_store import TaskStatusStore, etag_matches, status_etag
+from backend.utils.upload_spool import UploadConflict, UploadNotFound, UploadSpool, copy_and_hash, hash_file
+
+# step responses carry large graph states, orjson serializes them several times faster than json
+app = FastAPI(default_response_class=StateResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,18 +77,130 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-firestore_credentials_string = os.environ["FIRESTORE_CREDENTIALS"]
-# Path to your JSON key file (make sure it's the absolute path)
-firestore_credentials = json.loads(firestore_credentials_string)
-cred = credentials.Certificate(firestore_credentials)
-
-# Initialize Firebase Admin SDK *first*
-firebase_admin.initialize_app(cred, {"storageBucket": "blinx-63185.appspot.com"})
-
-# Now create the Firestore client
-client = firestore.client()
-executor = ThreadPoolExecutor(max_workers=5)
-bucket = storage.bucket('blinx-63185.appspot.com')
+# Firebase is initialized on first use (or by the startup warm-up below), not when the app is imported
+client = LazyClient(get_firestore_client)
+bucket = LazyClient(get_bucket)
+
+# The LangGraph workflows and the Firestore SDK are synchronous. The async endpoints hand them to the
+# threadpool so a long generation never blocks the event loop; every in-flight workflow holds one thread.
+max_inflight_workflows = int(os.getenv("MAX_INFLIGHT_WORKFLOWS", "200"))
+
+
+# Video and CSV jobs go through a durable queue and run on a separate, bounded pool of workers. Set JOB_WORKERS=0
+# to only enqueue from the API and run the workers as their own process (python -m backend.worker).
+job_queue = JobQueue(db_path=os.getenv("JOB_QUEUE_DB", "jobs.sqlite"),
+                     max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+                     lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60")))
+job_workers = int(os.getenv("JOB_WORKERS", "2"))
+
+VIDEO_STATUS_COLLECTION = "video-processor-status"
+CSV_STATUS_COLLECTION = "csv-processor-status"
+# /personalized_marketing only reads the first rows of the uploaded CSV
+CSV_PREVIEW_CHUNK_SIZE = 256 * 1024
+# uploads, queued videos and CSV files; with several replicas mount it on a volume they all share, so a job or an
+# upload chunk can be handled by any of them
+SPOOL_DIR = os.getenv("BLINX_SPOOL_DIR", "temp")
+VIDEO_DIR = os.path.join(SPOOL_DIR, "videos")
+CSV_DIR = os.path.join(SPOOL_DIR, "files")
+upload_spool = UploadSpool(os.getenv("UPLOAD_SPOOL_DIR", os.path.join(SPOOL_DIR, "uploads")),
+                            expire_after=float(os.getenv("UPLOAD_EXPIRE_AFTER", str(24 * 3600))))
+# Status, session and brand persona writes are grouped into batch commits. Progress updates and new sessions are
+# written behind (durable within FIRESTORE_FLUSH_INTERVAL seconds), terminal statuses and personas wait for theirs.
+firestore_writer = FirestoreWriter(client, max_batch=int(os.getenv("FIRESTORE_MAX_BATCH", "500")),
+                                   flush_interval=float(os.getenv("FIRESTORE_FLUSH_INTERVAL", "0.2")))
+task_status_store = TaskStatusStore(client, ttl=float(os.getenv("TASK_STATUS_CACHE_TTL", "5")),
+                                    writer=firestore_writer)
+status_broker = StatusBroker(client, on_publish=task_status_store.remember, lookup=task_status_store.get,
+                             linger=float(os.getenv("STATUS_WATCH_LINGER", "60")))
+
+# Brand personas only change through /createBrandPersona, which invalidates the entry of that user.
+brand_persona_cache = TTLCache(maxsize=int(os.getenv("BRAND_PERSONA_CACHE_SIZE", "1024")),
+                               ttl=float(os.getenv("BRAND_PERSONA_CACHE_TTL", "300")))
+
+# Users are never deleted, so known ids can be kept for a long time. Unknown ids are cached briefly so that
+# requests with a bad user_id don't all reach Firestore.
+user_cache = TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+                      ttl=float(os.getenv("USER_CACHE_TTL", "3600")))
+user_negative_cache_ttl = float(os.getenv("USER_NEGATIVE_CACHE_TTL", "30"))
+
+# Concurrent identical requests (double clicks, two team members onboarding the same site) share one run
+brand_persona_flight = SingleFlight("brand_persona")
+instagram_post_flight = SingleFlight("instagram_post")
+
+# Responses of requests sent with an Idempotency-Key, so client retries don't start the workflow again
+idempotency_store = IdempotencyStore(client, ttl=float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600))),
+                                     writer=firestore_writer)
+
+# Generation requests that would wait longer than the SLO for the chat models are rejected with a 429 up front
+admission = AdmissionController([openai_scheduler, gemini_scheduler],
+                                slo_seconds=float(os.getenv("ADMISSION_SLO_SECONDS", "30")),
+                                max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32")),
+                                enabled=os.getenv("ADMISSION_CONTROL", "1") == "1")
+
+session_registry = SessionRegistry(client, maxsize=int(os.getenv("SESSION_CACHE_SIZE", "10000")),
+                                   ttl=float(os.getenv("SESSION_CACHE_TTL", "3600")), writer=firestore_writer)
+# /cancel on one replica stops a generation step running on another
+session_cancellations = SessionCancellations(client, writer=firestore_writer)
+
+
+# with a shared checkpoint database every replica runs retention, one pass at a time
+checkpoint_retention = (SharedCheckpointRetention if is_shared_checkpointer() else CheckpointRetention)(
+    ttl=float(os.getenv("CHECKPOINT_TTL", str(7 * 24 * 3600))),
+    idle_ttl=float(os.getenv("CHECKPOINT_IDLE_TTL", str(30 * 24 * 3600))),
+    # every customer row of a CSV job is its own thread, nobody reads it once the job wrote its result
+    workflow_ttls={PERSONALIZED_MARKETING: float(os.getenv("MARKETING_CHECKPOINT_TTL", str(24 * 3600)))},
+    interval=float(os.getenv("CHECKPOINT_RETENTION_INTERVAL", "3600")))
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = max_inflight_workflows
+
+
+readiness = Readiness()
+warm_up_tasks = set()
+
+
+@app.on_event("startup")
+async def warm_up():
+    # opens the clients and compiles every workflow graph in the background and in parallel, so the server
+    # starts listening right away and /ready tells the load balancer when the first requests will be fast
+    components = {"firestore": get_firestore_client, "storage": get_bucket, "checkpointer": get_checkpointer}
+    if os.getenv("WARM_UP_AGENTS", "1") == "1":
+        for name in agent_registry.names():
+            components[f"agent:{name}"] = functools.partial(agent_registry.warm_up, [name])
+    task = asyncio.create_task(readiness.run_all(components))
+    warm_up_tasks.add(task)
+    task.add_done_callback(warm_up_tasks.discard)
+
+
+@app.get("/ready")
+async def ready():
+    report = readiness.report()
+    return JSONResponse(content=report, status_code=200 if report["ready"] else 503)
+
+
+@app.on_event("startup")
+async def remove_expired_uploads():
+    removed = await run_in_threadpool(upload_spool.remove_expired)
+    if removed:
+        print(f"Removed {removed} expired video uploads")
+
+
+def remember_user(user_id: str, exists: bool):
+    # unknown ids are only remembered briefly, so a user created on another replica is picked up quickly
+    user_cache.set(user_id, exists, ttl=None if exists else user_negative_cache_ttl)
+
+
+async def ensure_user_exists(user_id: str):
+    exists = user_cache.get(user_id)
+    if exists is None:
+        user_doc = await run_in_threadpool(client.collection('users').document(user_id).get)
+        exists = user_doc.exists
+        remember_user(user_id, exists)
+
+    if not exists:
+        raise HTTPException(status_code=401, detail="No user found.")
 
 
 @app.post("/uploadCSV")
@@ -75,35 +219,41 @@ async def upload_csv(
     """
 
     # 1. Check if user exists (Implement your own validation)
-    user_ref = client.collection('users').document(user_id)
-    user_doc = user_ref.get()
-
-    if not user_doc.exists:
-        raise HTTPException(status_code=401, detail="No user found.")
+    await ensure_user_exists(user_id)
 
     # 2. Get the bucket and generate a filename
-    file_name = f"{user_id}_{file.filename}_{uuid.uuid4()}.csv"  # Use user ID for organization
+    # Use user ID for organization; gzip / zstd uploads are stored decompressed
+    file_name = f"{user_id}_{strip_compression_suffix(file.filename)}_{uuid.uuid4()}.csv"
 
     # 3. Check if a file already exists for this user
     existing_blob = bucket.blob(file_name)
-    if existing_blob.exists():
+    if await run_in_threadpool(existing_blob.exists):
         # Delete the existing file
-        existing_blob.delete()
+        await run_in_threadpool(existing_blob.delete)
 
-    # 4. Read the contents of the CSV file
-    file_contents = await file.read()
-
-    # 5. Upload the file to Firebase Storage
+    # 4. Stream the file to Firebase Storage, validating and profiling it on the way
     blob = bucket.blob(file_name)
-    blob.upload_from_string(file_contents)
-    blob.make_public()
+    try:
+        profile = await run_in_threadpool(upload_csv_stream, blob, file.file)
+    except CsvIngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     print(blob.public_url)
     return JSONResponse(
-        content={"message": "CSV file uploaded successfully."},
+        content={"message": "CSV file uploaded successfully.", "file_name": file_name, "profile": profile},
         status_code=200
     )
 
 
+def upload_csv_stream(blob, fileobj) -> dict:
+    # a resumable upload in UPLOAD_CHUNK_SIZE parts; it is aborted if the CSV turns out to be invalid
+    with blob.open("wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type="text/csv") as writer:
+        profile = ingest_csv(fileobj, writer)
+    blob.metadata = {"row_count": str(profile["row_count"]), "columns": json.dumps(profile["columns"])}
+    blob.patch()
+    blob.make_public()
+    return profile
+
+
 @app.get("/getCSVFiles")
 async def get_csv_files(
         user_id: str = Query(...)
@@ -117,19 +267,10 @@ async def get_csv_files(
         JSONResponse: A JSON response containing a list of URLs for the user's CSV files.
     """
 
-    user_ref = client.collection('users').document(user_id)
-    user_doc = user_ref.get()
-
-    if not user_doc.exists:
-        raise HTTPException(status_code=401, detail="No user found.")
-
-    # 3. Fetch all files with the user ID prefix
-    blobs = bucket.list_blobs(prefix=f"{user_id}")
+    await ensure_user_exists(user_id)
 
-    # 4. Build a list of public URLs
-    file_objects = [
-        {"file_url": blob.public_url, "file_name": blob.name} for blob in blobs
-    ]
+    # 3. Fetch all files with the user ID prefix and 4. build a list of public URLs
+    file_objects = await run_in_threadpool(list_csv_files, user_id)
 
     return JSONResponse(
         content={"message": "CSV files retrieved successfully.", "files": file_objects},
@@ -137,6 +278,11 @@ async def get_csv_files(
     )
 
 
+def list_csv_files(user_id: str):
+    blobs = bucket.list_blobs(prefix=f"{user_id}")
+    return [{"file_url": blob.public_url, "file_name": blob.name} for blob in blobs]
+
+
 @app.post("/createUser")
 async def create_user(user: User):
     """
@@ -148,7 +294,8 @@ async def create_user(user: User):
 
     # Create user in Firestore (using user_id as document ID)
     user.user_id = user_id  # Get the generated ID
-    user_ref = client.collection('users').document(user_id).set(user.dict())
+    await run_in_threadpool(client.collection('users').document(user_id).set, user.dict())
+    remember_user(user_id, True)
 
     return {"message": "User created successfully", "user": user}
 
@@ -156,7 +303,8 @@ async def create_user(user: User):
 @app.get("/users/{user_id}")
 async def get_user(user_id: str):
     user_ref = client.collection('users').document(user_id)
-    user_doc = user_ref.get()
+    user_doc = await run_in_threadpool(user_ref.get)
+    remember_user(user_id, user_doc.exists)
 
     if not user_doc.exists:
         raise HTTPException(status_code=404, detail="No user found.")
@@ -169,15 +317,17 @@ async def get_user(user_id: str):
 @app.post("/createBrandPersona")
 async def create_brand_persona(brand_persona_request: BrandPersonaRequestArgs = Body(...)):
     # Check if user exists in Firestore
-    user_ref = client.collection('users').document(brand_persona_request.user_id)
-    user_doc = user_ref.get()
-
-    if not user_doc.exists:
-        raise HTTPException(status_code=401, detail="No user found.")
-
-    # 2. Generate Brand Persona
-    brand_persona_orchestrator = BrandPersonaOrchestrator()
-    created_brand_persona = brand_persona_orchestrator.generate_brand_persona(brand_persona_request.brand_url)
+    await ensure_user_exists(brand_persona_request.user_id)
+    set_tenant(brand_persona_request.user_id)
+
+    # 2. Generate Brand Persona, once per site for all concurrent requests
+    # the first use builds the agent graph, which must not happen on the event loop
+    brand_persona_orchestrator = await run_in_threadpool(BrandPersonaOrchestrator)
+    with admission.admitted("createBrandPersona"):
+        created_brand_persona = await brand_persona_flight.run(normalize_url(brand_persona_request.brand_url),
+                                                               run_in_threadpool,
+                                                               brand_persona_orchestrator.generate_brand_persona,
+                                                               brand_persona_request.brand_url)
 
     # 3. Map to BrandPersona Class
     brand_persona = BrandPersona(
@@ -192,24 +342,60 @@ async def create_brand_persona(brand_persona_request: BrandPersonaRequestArgs =
         user_id=brand_persona_request.user_id
     )
 
+    await run_in_threadpool(save_brand_persona, brand_persona)
+
+    return {"brand_persona": brand_persona}
+
+
+def save_brand_persona(brand_persona: BrandPersona):
     # Check if a brand persona already exists for the user
-    brand_persona_query = client.collection('brand-persona').where('user_id', '==', brand_persona_request.user_id).get()
+    brand_persona_query = client.collection('brand-persona').where('user_id', '==', brand_persona.user_id).get()
 
+    # waits for the commit: the next generation request may read the persona on another replica
     if brand_persona_query:
         # If the brand persona exists, update the existing document
-        doc_ref = brand_persona_query[0].reference
-        doc_ref.update(brand_persona.dict())
+        firestore_writer.update('brand-persona', brand_persona_query[0].id, brand_persona.dict(), wait=True)
     else:
         # If no brand persona exists, create a new document
         doc_ref = client.collection('brand-persona').document()
-        doc_ref.set(brand_persona.dict())
+        firestore_writer.set('brand-persona', doc_ref.id, brand_persona.dict(), wait=True)
 
-    return {"brand_persona": brand_persona}
+    brand_persona_cache.invalidate(brand_persona.user_id)
+
+
+async def idempotent(idempotency_key: Optional[str], endpoint: str, user_id: Optional[str], request, resolve, fn,
+                     *args) -> dict:
+    """Runs `fn(*args)`, or returns the response of the earlier request with the same Idempotency-Key. `request`
+    holds the body and parameters of the request, a key reused with different ones is rejected with a 422.
+    `resolve(session_id)` rebuilds the response when the earlier request ran on another replica."""
+    if not idempotency_key:
+        return await fn(*args)
+    try:
+        return await idempotency_store.run(fingerprint(endpoint, user_id, idempotency_key), fingerprint(request),
+                                           resolve, fn, *args)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "1"})
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def session_response(workflow: str, output_field: str):
+    """Resolver of the idempotent generation endpoints: the first step response of a session, from its checkpoint
+    (in the full view, whatever view the first request asked for)."""
+    return lambda session_id: {"session_id": session_id, output_field: get_session_state(workflow, session_id)}
 
 
 @app.post("/generateBlog")
-async def generate_blog(blog_post_request_args: BlogPostRequestArgs = Body(...)):
-    brand_persona = get_brand_persona_from_firestore(blog_post_request_args.user_id)
+async def generate_blog(blog_post_request_args: BlogPostRequestArgs = Body(...),
+                        idempotency_key: Optional[str] = Header(None), view: Literal["full", "delta"] = FULL):
+    return StateResponse(await idempotent(idempotency_key, "generateBlog", blog_post_request_args.user_id,
+                                          (blog_post_request_args.dict(), view), session_response(BLOG_GEN, "message"),
+                                          run_generate_blog, blog_post_request_args, view))
+
+
+async def run_generate_blog(blog_post_request_args: BlogPostRequestArgs, view: str = FULL) -> dict:
+    set_tenant(blog_post_request_args.user_id)
+    brand_persona = await run_in_threadpool(get_brand_persona_from_firestore, blog_post_request_args.user_id)
     session_id = uuid.uuid4().__str__()
 
     # Placeholder logic for blog post generation
@@ -222,130 +408,347 @@ async def generate_blog(blog_post_request_args: BlogPostRequestArgs = Body(...))
         include_images=blog_post_request_args.include_images
     )
 
-    generated_content = run_blog_gen_workflow(session_id=session_id, blog_gen_dto=blog_data)
+    with admission.admitted("generateBlog"):
+        generated_content = await run_in_threadpool(run_blog_gen_workflow, session_id=session_id,
+                                                    blog_gen_dto=blog_data, view=view)
     save_session(Operations.BLOG_GENERATION, blog_post_request_args.user_id, session_id)
 
-    return JSONResponse({"session_id": session_id, "message": generated_content})
+    return {"session_id": session_id, "message": generated_content}
 
 
 @app.post("/resumeBlogGeneration")
-async def resume_blog_generation(blog_post_continue_request_args: BlogPostContinueStepsRequestArgs = Body(...)):
+async def resume_blog_generation(blog_post_continue_request_args: BlogPostContinueStepsRequestArgs = Body(...),
+                                 view: Literal["full", "delta"] = FULL):
     # check for active session
-    validate_session(blog_post_continue_request_args.session_id, Operations.BLOG_GENERATION)
+    session_context = await run_in_threadpool(validate_session, blog_post_continue_request_args.session_id,
+                                              Operations.BLOG_GENERATION)
+    set_tenant(session_context.user_id)
 
     return_item = None
-    if blog_post_continue_request_args.blog_generation_step == BlogGenerationSteps.SECTIONS.value:
-        return_item = run_blog_gen_workflow(session_id=blog_post_continue_request_args.session_id,
-                                            title=blog_post_continue_request_args.user_prompt)
-
-    if blog_post_continue_request_args.blog_generation_step == BlogGenerationSteps.FINAL_REVIEW.value:
-        sections = json.loads(blog_post_continue_request_args.user_prompt)
-        print(sections)
-        return_item = run_blog_gen_workflow(session_id=blog_post_continue_request_args.session_id, sections=sections)
+    with admission.admitted("resumeBlogGeneration"), generation_scope(blog_post_continue_request_args.session_id):
+        if blog_post_continue_request_args.blog_generation_step == BlogGenerationSteps.SECTIONS.value:
+            return_item = await run_in_threadpool(run_blog_gen_workflow,
+                                                  session_id=blog_post_continue_request_args.session_id,
+                                                  title=blog_post_continue_request_args.user_prompt, view=view)
+
+        if blog_post_continue_request_args.blog_generation_step == BlogGenerationSteps.FINAL_REVIEW.value:
+            sections = json.loads(blog_post_continue_request_args.user_prompt)
+            print(sections)
+            return_item = await run_in_threadpool(run_blog_gen_workflow,
+                                                  session_id=blog_post_continue_request_args.session_id,
+                                                  sections=sections, view=view)
 
     print(return_item)
-    return JSONResponse({"session_id": blog_post_continue_request_args.session_id, "step_output": return_item})
+    return StateResponse({"session_id": blog_post_continue_request_args.session_id, "step_output": return_item})
 
 
 @app.post("/generateAd")
-async def generate_ad(ad_gen_request_args: AdGenerationRequestArgs = Body(...)):
+async def generate_ad(ad_gen_request_args: AdGenerationRequestArgs = Body(...),
+                      idempotency_key: Optional[str] = Header(None), view: Literal["full", "delta"] = FULL):
+    if ad_gen_request_args.ad_gen_step != AdGenerationSteps.REQUEST:
+        # a REVIEW step resumes an existing session, running it twice is what the workflow already guards against
+        idempotency_key = None
+    return StateResponse(await idempotent(idempotency_key, "generateAd", ad_gen_request_args.user_id,
+                                          (ad_gen_request_args.dict(), view), session_response(AD_GEN, "step_output"),
+                                          run_generate_ad, ad_gen_request_args, view))
+
+
+async def run_generate_ad(ad_gen_request_args: AdGenerationRequestArgs, view: str = FULL) -> dict:
     session_id = None
-    brand_persona = get_brand_persona_from_firestore(ad_gen_request_args.user_id)
+    set_tenant(ad_gen_request_args.user_id)
+    brand_persona = await run_in_threadpool(get_brand_persona_from_firestore, ad_gen_request_args.user_id)
     return_item = None
-    orchestrator = AdGenOrchestrator()
+    orchestrator = await run_in_threadpool(AdGenOrchestrator)
     if ad_gen_request_args.ad_gen_step == AdGenerationSteps.REQUEST:
         session_id = uuid.uuid4().__str__()
         ad_data = AdGenDto(objective=ad_gen_request_args.ad_objective,
                            details=ad_gen_request_args.ad_details,
                            brand_persona=brand_persona.to_dict())
-        return_item = orchestrator.run_ad_gen_workflow(session_id=session_id, ad_gen_dto=ad_data)
+        with admission.admitted("generateAd"):
+            return_item = await run_in_threadpool(orchestrator.run_ad_gen_workflow, session_id=session_id,
+                                                  ad_gen_dto=ad_data, view=view)
         save_session(Operations.AD_GENERATION, ad_gen_request_args.user_id, session_id)
     elif ad_gen_request_args.ad_gen_step == AdGenerationSteps.REVIEW:
         # check for active session
-        validate_session(ad_gen_request_args.session_id, Operations.AD_GENERATION)
+        await run_in_threadpool(validate_session, ad_gen_request_args.session_id, Operations.AD_GENERATION)
         session_id = ad_gen_request_args.session_id
         no_feedback = "no feedback"
-        if ad_gen_request_args.human_feedback == no_feedback:
-            return_item = orchestrator.run_ad_gen_workflow(session_id=ad_gen_request_args.session_id,
-                                                           human_feedback=None)
-        else:
-            return_item = orchestrator.run_ad_gen_workflow(session_id=ad_gen_request_args.session_id,
-                                                           human_feedback=ad_gen_request_args.human_feedback)
+        with admission.admitted("generateAd"), generation_scope(session_id):
+            if ad_gen_request_args.human_feedback == no_feedback:
+                return_item = await run_in_threadpool(orchestrator.run_ad_gen_workflow,
+                                                      session_id=ad_gen_request_args.session_id,
+                                                      human_feedback=None, view=view)
+            else:
+                return_item = await run_in_threadpool(orchestrator.run_ad_gen_workflow,
+                                                      session_id=ad_gen_request_args.session_id,
+                                                      human_feedback=ad_gen_request_args.human_feedback, view=view)
+
+    return {"session_id": session_id, "step_output": return_item}
+
+
+# the workflow whose checkpoints hold the state of a session, by session operation
+SESSION_WORKFLOWS = {Operations.BLOG_GENERATION.value: BLOG_GEN, Operations.AD_GENERATION.value: AD_GEN,
+                     Operations.INSTAGRAM_POST_GENERATION.value: INSTAGRAM_POST_GEN}
+
+
+@app.get("/sessionState/{session_id}")
+async def session_state(session_id: str, fields: str = None):
+    """The whole state of a generation session, as view=full step responses carry it, or only the comma separated
+    `fields`. Clients that request view=delta steps read the rest of the state here when they need it."""
+    session_context = await run_in_threadpool(session_registry.get, session_id)
+    if session_context is None or session_context.operation not in SESSION_WORKFLOWS:
+        raise HTTPException(status_code=404, detail="No active session.")
+    response = await run_in_threadpool(get_session_state, SESSION_WORKFLOWS[session_context.operation], session_id)
+    if fields:
+        wanted = set(fields.split(","))
+        response["state"] = {key: value for key, value in response["state"].items() if key in wanted}
+    return StateResponse({"session_id": session_id, **response})
+
+
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@contextmanager
+def generation_scope(session_id: str):
+    """cancellations.scope of a generation step, which /cancel on any replica stops (session_cancellations)."""
+    watch = session_cancellations.watch(session_id)
+    try:
+        with cancellations.scope(session_id, poll=watch) as token:
+            yield token
+    finally:
+        watch.close()
+
+
+def workflow_events(session_id: str, workflow_stream, ticket=None):
+    """Turns an orchestrator stream into Server-Sent Events: one `session` event, an `update` event per
+    finished node, then `final` (or `error`, or `cancelled` once /cancel/{session_id} stopped it). The admission
+    `ticket` of the request is done once the stream ends, also when the client drops it at any point."""
+    # every step of the stream runs in a new threadpool context, so the token is entered for each of them
+    watch = session_cancellations.watch(session_id)
+    token = cancellations.open(session_id, poll=watch)
+    ok = False
+    try:
+        yield format_sse("session", {"session_id": session_id})
+        while True:
+            with cancellation_scope(token):
+                item = next(workflow_stream, None)
+            if item is None:
+                break
+            yield format_sse(*item)
+        ok = True
+    except Cancelled:
+        yield format_sse("cancelled", {"session_id": session_id})
+    except Exception as e:
+        yield format_sse("error", {"session_id": session_id, "detail": str(e)})
+    finally:
+        cancellations.close(session_id, token)
+        watch.close()
+        if ticket is not None:
+            ticket.done(ok)
+
+
+def event_stream_response(events, ticket=None) -> StreamingResponse:
+    # releases the admission ticket if the events were never iterated (client gone before the body started); after
+    # a stream that ran, workflow_events already did and this is a no-op
+    background = BackgroundTask(ticket.done, False) if ticket is not None else None
+    return StreamingResponse(events, media_type="text/event-stream", background=background,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/generateBlogStream")
+async def generate_blog_stream(blog_post_request_args: BlogPostRequestArgs = Body(...)):
+    """Streaming variant of /generateBlog, pushes keywords and titles as soon as each node finishes."""
+    set_tenant(blog_post_request_args.user_id)
+    brand_persona = await run_in_threadpool(get_brand_persona_from_firestore, blog_post_request_args.user_id)
+    session_id = uuid.uuid4().__str__()
+
+    blog_data = BlogGeneratorDto(
+        query=blog_post_request_args.user_prompt,
+        brand_persona=brand_persona.to_dict(),
+        max_suggestions=blog_post_request_args.max_suggestions,
+        max_sections=blog_post_request_args.max_sections,
+        max_images=blog_post_request_args.max_images,
+        include_images=blog_post_request_args.include_images
+    )
+    ticket = admission.admit("generateBlogStream")
+    try:
+        # the session is saved up front so the blog can be resumed even if the client drops the stream
+        save_session(Operations.BLOG_GENERATION, blog_post_request_args.user_id, session_id)
+    except BaseException:
+        ticket.done(False)
+        raise
+
+    return event_stream_response(workflow_events(
+        session_id, stream_blog_gen_workflow(session_id=session_id, blog_gen_dto=blog_data), ticket), ticket)
+
+
+@app.post("/resumeBlogGenerationStream")
+async def resume_blog_generation_stream(
+        blog_post_continue_request_args: BlogPostContinueStepsRequestArgs = Body(...)):
+    """Streaming variant of /resumeBlogGeneration, pushes the intro, section plan and sections as they are written."""
+    session_id = blog_post_continue_request_args.session_id
+    session_context = await run_in_threadpool(validate_session, session_id, Operations.BLOG_GENERATION)
+    set_tenant(session_context.user_id)
+
+    if blog_post_continue_request_args.blog_generation_step == BlogGenerationSteps.SECTIONS.value:
+        workflow_stream = stream_blog_gen_workflow(session_id=session_id,
+                                                   title=blog_post_continue_request_args.user_prompt)
+    elif blog_post_continue_request_args.blog_generation_step == BlogGenerationSteps.FINAL_REVIEW.value:
+        sections = json.loads(blog_post_continue_request_args.user_prompt)
+        workflow_stream = stream_blog_gen_workflow(session_id=session_id, sections=sections)
+    else:
+        raise HTTPException(status_code=400, detail="Unknown blog generation step.")
+
+    ticket = admission.admit("resumeBlogGenerationStream")
+    return event_stream_response(workflow_events(session_id, workflow_stream, ticket), ticket)
+
+
+@app.post("/generateAdStream")
+async def generate_ad_stream(ad_gen_request_args: AdGenerationRequestArgs = Body(...)):
+    """Streaming variant of /generateAd, pushes the campaign plan and each ad copy as soon as they are ready."""
+    set_tenant(ad_gen_request_args.user_id)
+    orchestrator = await run_in_threadpool(AdGenOrchestrator)
+    if ad_gen_request_args.ad_gen_step == AdGenerationSteps.REQUEST:
+        brand_persona = await run_in_threadpool(get_brand_persona_from_firestore, ad_gen_request_args.user_id)
+        session_id = uuid.uuid4().__str__()
+        ad_data = AdGenDto(objective=ad_gen_request_args.ad_objective,
+                           details=ad_gen_request_args.ad_details,
+                           brand_persona=brand_persona.to_dict())
+        ticket = admission.admit("generateAdStream")
+        try:
+            save_session(Operations.AD_GENERATION, ad_gen_request_args.user_id, session_id)
+        except BaseException:
+            ticket.done(False)
+            raise
+        workflow_stream = orchestrator.stream_ad_gen_workflow(session_id=session_id, ad_gen_dto=ad_data)
+    else:
+        session_id = ad_gen_request_args.session_id
+        await run_in_threadpool(validate_session, session_id, Operations.AD_GENERATION)
+        ticket = admission.admit("generateAdStream")
+        human_feedback = None if ad_gen_request_args.human_feedback == "no feedback" \
+            else ad_gen_request_args.human_feedback
+        workflow_stream = orchestrator.stream_ad_gen_workflow(session_id=session_id, human_feedback=human_feedback)
 
-    return JSONResponse({"session_id": session_id, "step_output": return_item})
+    return event_stream_response(workflow_events(session_id, workflow_stream, ticket), ticket)
 
 
 @app.post("/generateInstagramPost")
-async def generate_instagram_post(instagram_post_request_args: InstagramPostRequestArgs = Body(...)):
+async def generate_instagram_post(instagram_post_request_args: InstagramPostRequestArgs = Body(...),
+                                  idempotency_key: Optional[str] = Header(None),
+                                  view: Literal["full", "delta"] = FULL):
+    set_tenant(instagram_post_request_args.user_id)
+    # identical submissions of a user get the session and posts of the one already running
+    key = fingerprint(instagram_post_request_args.user_id, normalize_text(instagram_post_request_args.objective),
+                      instagram_post_request_args.max_posts, instagram_post_request_args.include_images, view)
+    return StateResponse(await idempotent(idempotency_key, "generateInstagramPost",
+                                          instagram_post_request_args.user_id,
+                                          (instagram_post_request_args.dict(), view),
+                                          session_response(INSTAGRAM_POST_GEN, "step_output"),
+                                          instagram_post_flight.run, key, run_instagram_post,
+                                          instagram_post_request_args, view))
+
+
+async def run_instagram_post(instagram_post_request_args: InstagramPostRequestArgs, view: str = FULL):
     session_id = uuid.uuid4().__str__()
-    orchestrator = InstagramPostGenOrchestrator()
-    brand_persona = get_brand_persona_from_firestore(instagram_post_request_args.user_id)
+    orchestrator = await run_in_threadpool(InstagramPostGenOrchestrator)
+    brand_persona = await run_in_threadpool(get_brand_persona_from_firestore, instagram_post_request_args.user_id)
     instagram_post_data = PostGenDto(objective=instagram_post_request_args.objective,
                                      brand_persona=brand_persona.to_dict(),
                                      max_posts=instagram_post_request_args.max_posts,
                                      include_images=instagram_post_request_args.include_images)
-    return_item = orchestrator.run_instagram_post_gen_workflow(session_id=session_id,
-                                                               instagram_post_dto=instagram_post_data)
+    with admission.admitted("generateInstagramPost"):
+        return_item = await run_in_threadpool(orchestrator.run_instagram_post_gen_workflow, session_id=session_id,
+                                              instagram_post_dto=instagram_post_data, view=view)
     save_session(Operations.INSTAGRAM_POST_GENERATION, instagram_post_request_args.user_id, session_id)
-    return JSONResponse({"session_id": session_id, "step_output": return_item})
+    return {"session_id": session_id, "step_output": return_item}
 
 
-tasks_status = {}
+def set_task_status(collection: str, session_id: str, status: dict):
+    status = task_status_store.set(collection, session_id, status)
+    # wake up clients waiting on this task in this process
+    status_broker.publish(collection, session_id, status)
 
 
-def process_video_background(video_path: str, session_id: str):
-    try:
+def process_video_background(video_path: str, session_id: str, content_hash: str = None):
+    # Process the video (placeholder for your actual processing code)
+    # videos have no user, their LLM calls yield to interactive requests
+    with tenant_scope(None, BACKGROUND):
+        analysis_result = process_video(video_path, session_id, content_hash)
 
-        # Process the video (placeholder for your actual processing code)
-        analysis_result = process_video(video_path, session_id)
+    # Update the status to "completed" and store the result
+    set_task_status(VIDEO_STATUS_COLLECTION, session_id,
+                    {"session_id": session_id, "status": "completed", "result": analysis_result})
 
-        # Update the status to "completed" and store the result
-        video_ref = client.collection('video-processor-status').document(session_id).set(
-            {"session_id": session_id, "status": "completed", "result": analysis_result})
+    # Remove the video after processing
+    os.remove(video_path)
 
-        # Remove the video after processing
-        os.remove(video_path)
 
-    except Exception as e:
-        # Handle any errors and update the status
-        video_ref = client.collection('video-processor-status').document(session_id).set(
-            {"session_id": session_id, "status": "failed", "error": str(e)})
+def on_video_job_cancelled(job):
+    session_id = job["payload"]["session_id"]
+    set_task_status(VIDEO_STATUS_COLLECTION, session_id, {"session_id": session_id, "status": "cancelled"})
+    remove_file(job["payload"]["video_path"])
+
 
+def on_video_job_failed(job, error):
+    # Handle any errors and update the status, called once the job has no retries left
+    session_id = job["payload"]["session_id"]
+    set_task_status(VIDEO_STATUS_COLLECTION, session_id,
+                    {"session_id": session_id, "status": "failed", "error": str(error)})
 
-def process_video(video_path, session_id):
+
+def process_video(video_path, session_id, content_hash=None):
     """
     This function will contain your video processing logic.
     Replace this with your actual implementation.
     """
     # Your video processing code here
     orchestrator = VideoToBlogOrchestrator()
-    resp = orchestrator.run(video_path, session_id)
+    resp = orchestrator.run(video_path, session_id, content_hash)
 
     return resp
 
 
+def enqueue_job(job_type: str, session_id: str, **payload):
+    job_queue.enqueue(job_type, {"session_id": session_id, **payload}, job_id=session_id)
+    return job_response(session_id)
+
+
+def job_response(session_id: str) -> dict:
+    """What the endpoints that queue a job answer, also the resolver of their idempotent replays."""
+    return {"session_id": session_id, "status": "processing",
+            "queue_position": job_queue.position(session_id),
+            "eta_seconds": job_queue.estimate_wait(session_id, max(job_workers, 1))}
+
+
 @app.post("/analyseVideo")
-def analyse_video(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def analyse_video(file: UploadFile = File(...), idempotency_key: Optional[str] = Header(None)):
+    # the endpoint has no user, so the upload is identified by its content; only hashed when a key is sent
+    request = None
+    if idempotency_key:
+        request = {"filename": file.filename, "content_hash": await run_in_threadpool(hash_file, file.file)}
+    return JSONResponse(content=await idempotent(idempotency_key, "analyseVideo", None, request, job_response,
+                                                 run_analyse_video, file))
+
+
+async def run_analyse_video(file: UploadFile) -> dict:
     session_id = uuid.uuid4().__str__()
-    video_ref = client.collection('video-processor-status').document(session_id).set(
-        {"session_id": session_id, "status": "processing", "result": None})
+    set_task_status(VIDEO_STATUS_COLLECTION, session_id,
+                    {"session_id": session_id, "status": "processing", "result": None})
     try:
         # video_path = download_video(video_url)
-        if not os.path.exists("temp/videos"):
-            os.makedirs("temp/videos")
+        if not os.path.exists(VIDEO_DIR):
+            os.makedirs(VIDEO_DIR)
 
-        video_path = f"temp/videos/{session_id}_{file.filename}"
+        video_path = os.path.join(VIDEO_DIR, f"{session_id}_{os.path.basename(file.filename)}")
 
-        # Save the uploaded file to the temporary path
-        with open(video_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Save the uploaded file to the temporary path, hashing it on the way
+        content_hash = await run_in_threadpool(copy_and_hash, file.file, video_path)
 
         print("Video Path : " + video_path)
 
-        # Add the video processing task to the background
-        background_tasks.add_task(process_video_background, video_path, session_id)
-
-        return JSONResponse(content={"session_id": session_id, "status": "processing"})
+        # Queue the video processing job for the workers
+        return enqueue_job("process_video", session_id, video_path=video_path, content_hash=content_hash)
 
     except requests.exceptions.RequestException as e:
         raise HTTPException(status_code=500, detail=f"Error downloading video: {e}")
@@ -353,14 +756,129 @@ def analyse_video(background_tasks: BackgroundTasks, file: UploadFile = File(...
         raise HTTPException(status_code=500, detail=f"Error processing video: {e}")
 
 
+@app.post("/videoUploads")
+def create_video_upload(upload_args: VideoUploadRequestArgs = Body(...)):
+    """Starts a resumable video upload. Send the file in chunks with PUT /videoUploads/{upload_id}, then finalize."""
+    return JSONResponse(content=upload_spool.create(upload_args.filename, upload_args.size), status_code=201)
+
+
+@app.get("/videoUploads/{upload_id}")
+def get_video_upload(upload_id: str):
+    # a client resuming after a dropped connection continues from `offset`
+    try:
+        return JSONResponse(content=upload_spool.status(upload_id))
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+
+@app.put("/videoUploads/{upload_id}")
+async def append_video_upload(upload_id: str, request: Request):
+    """Appends the request body at the `Upload-Offset` header, which must match the current offset of the upload."""
+    try:
+        offset = int(request.headers.get("upload-offset", ""))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Offset header is required")
+
+    try:
+        append = await run_in_threadpool(upload_spool.open_append, upload_id, offset)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadConflict as e:
+        return JSONResponse(content={"detail": str(e), "offset": e.offset}, status_code=409,
+                            headers={"Upload-Offset": str(e.offset)})
+
+    try:
+        # the body goes straight to the spool file, whatever arrived before a disconnect is kept
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(append.write, chunk)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        offset = await run_in_threadpool(append.close)
+    return JSONResponse(content={"upload_id": upload_id, "offset": offset}, headers={"Upload-Offset": str(offset)})
+
+
+@app.post("/videoUploads/{upload_id}/finalize")
+def finalize_video_upload(upload_id: str, sha256: str = Query(None)):
+    """Completes the upload and queues the video to blog workflow for it."""
+    session_id = uuid.uuid4().__str__()
+    try:
+        upload = upload_spool.status(upload_id)
+        video_path = os.path.join(VIDEO_DIR, f"{session_id}_{upload['filename']}")
+        upload = upload_spool.finalize(upload_id, video_path, expected_sha256=sha256)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadConflict as e:
+        return JSONResponse(content={"detail": str(e), "offset": e.offset}, status_code=409)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    set_task_status(VIDEO_STATUS_COLLECTION, session_id,
+                    {"session_id": session_id, "status": "processing", "result": None})
+    response = enqueue_job("process_video", session_id, video_path=video_path, content_hash=upload["content_hash"])
+    return JSONResponse(content={**response, "content_hash": upload["content_hash"]})
+
+
+def task_status_response(collection: str, session_id: str, request: Request):
+    status = task_status_store.get(collection, session_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    etag = status_etag(status)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(content=status, headers={"ETag": etag})
+
+
 @app.get("/taskStatus/{session_id}")
-def check_task_status(session_id: str):
-    docs = client.collection("video-processor-status").where("session_id", "==", session_id).stream()
-    video_processor_status = next(docs, None)
-    if video_processor_status is None:
+def check_task_status(session_id: str, request: Request):
+    return task_status_response(VIDEO_STATUS_COLLECTION, session_id, request)
+
+
+async def wait_for_task_status(collection: str, session_id: str, last_status: str, timeout: float):
+    status = await status_broker.wait_for_change(collection, session_id, last_status, min(timeout, 60))
+    if status == {}:
         raise HTTPException(status_code=404, detail="Task not found")
+    if status is None:
+        # nothing read before the timeout, the client should simply call again
+        return JSONResponse(content={"session_id": session_id, "status": last_status})
+    return JSONResponse(content=status)
+
 
-    return JSONResponse(content=video_processor_status.to_dict())
+@app.get("/taskStatus/{session_id}/wait")
+async def wait_task_status(session_id: str, last_status: str = None, timeout: float = 30):
+    """Long-poll variant of /taskStatus: returns as soon as the status differs from last_status, or after timeout."""
+    return await wait_for_task_status(VIDEO_STATUS_COLLECTION, session_id, last_status, timeout)
+
+
+@app.get("/poll-csv/{session_id}/wait")
+async def wait_csv_result(session_id: str, last_status: str = None, timeout: float = 30):
+    """Long-poll variant of /poll-csv: returns as soon as the status differs from last_status, or after timeout."""
+    return await wait_for_task_status(CSV_STATUS_COLLECTION, session_id, last_status, timeout)
+
+
+@app.websocket("/ws/taskStatus/{session_id}")
+async def task_status_socket(websocket: WebSocket, session_id: str, task_type: str = "video"):
+    """Sends every status change of a video (task_type=video) or CSV (task_type=csv) task, closes once it is done."""
+    collection = CSV_STATUS_COLLECTION if task_type == "csv" else VIDEO_STATUS_COLLECTION
+    await websocket.accept()
+    last_status = None
+    try:
+        while True:
+            status = await status_broker.wait_for_change(collection, session_id, last_status)
+            if status == {}:
+                await websocket.send_json({"session_id": session_id, "error": "Task not found"})
+                break
+            if status is None or status.get("status") == last_status:
+                continue
+            await websocket.send_json(status)
+            last_status = status.get("status")
+            if last_status in TERMINAL_STATUSES:
+                break
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
 
 
 @app.get("/getBrandPersona")
@@ -368,6 +886,35 @@ def get_brand_persona(user_id: str):
     return get_brand_persona_from_firestore(user_id).to_dict()
 
 
+@app.get("/admin/checkpoints")
+def get_checkpoint_stats():
+    """Size of the checkpoint database and thread / checkpoint / write counts per workflow."""
+    return JSONResponse(content=checkpoint_retention.stats())
+
+
+@app.post("/admin/checkpoints/prune")
+def prune_checkpoints(full_vacuum: bool = Query(False)):
+    """Runs a retention pass now. full_vacuum rewrites the whole database, which blocks workflows while it runs."""
+    if full_vacuum:
+        checkpoint_retention.vacuum_full()
+    return JSONResponse(content=checkpoint_retention.run_once())
+
+
+@app.get("/metrics")
+def get_metrics():
+    return JSONResponse(content={"brand_persona_cache": brand_persona_cache.stats(),
+                                 "user_cache": user_cache.stats(),
+                                 "session_cache": session_registry.sessions.stats(),
+                                 "video_result_cache": video_result_cache.stats(),
+                                 "agent_build_seconds": agent_registry.build_seconds,
+                                 "firestore_writer": firestore_writer.stats(),
+                                 "single_flight": {flight.name: flight.stats()
+                                                   for flight in (brand_persona_flight, instagram_post_flight)},
+                                 "idempotency": idempotency_store.stats(),
+                                 "admission": admission.stats(),
+                                 "llm_schedulers": {name: scheduler.stats() for name, scheduler in schedulers.items()}})
+
+
 @app.get("/hello")
 async def root():
     return {"message": "Welcome to your FastAPI Dockerized backend!"}
@@ -376,24 +923,30 @@ async def root():
 def process_chunk(chunk, session_id, brand_persona, marketing_post_request_args):
     orchestrator = PersonalizedMarketingOrchestrator()
     responses = []
-    for _, row in chunk.iterrows():
-        # Convert each row to a dictionary for easier processing
-        row_dict = row.to_dict()
-        # Run the personalized marketing workflow for each customer data row
-        orchestrator_session = uuid.uuid4().__str__()
-        response = orchestrator.run_workflow(
-            session_id=orchestrator_session,
-            brand_persona=brand_persona,
-            objective=marketing_post_request_args.objective,
-            details=marketing_post_request_args.details,
-            customer_data=row_dict
-        )
-        # Append the response to the list of responses
-        responses.append(response)
+    # the LLM calls of every row are queued under the user that uploaded the CSV, behind interactive requests
+    with tenant_scope(marketing_post_request_args.user_id, BULK):
+        for _, row in chunk.iterrows():
+            # a cancelled job stops before its next row
+            check_cancelled()
+            # Convert each row to a dictionary for easier processing
+            row_dict = row.to_dict()
+            # Run the personalized marketing workflow for each customer data row
+            orchestrator_session = uuid.uuid4().__str__()
+            response = orchestrator.run_workflow(
+                session_id=orchestrator_session,
+                brand_persona=brand_persona,
+                objective=marketing_post_request_args.objective,
+                details=marketing_post_request_args.details,
+                customer_data=row_dict
+            )
+            # Append the response to the list of responses
+            responses.append(response)
     return responses
 
 
 def process_df(session_id, marketing_post_request_args: MarketingPostRequestArgs, path_to_csv):
+    import pandas as pd
+
     brand_persona = get_brand_persona_from_firestore(marketing_post_request_args.user_id).to_dict()
     futures = []
     responses = []
@@ -401,13 +954,18 @@ def process_df(session_id, marketing_post_request_args: MarketingPostRequestArgs
     # Read the CSV file in chunks to handle large datasets without using too much memory
     with ThreadPoolExecutor(max_workers=5) as exec1:
         for chunk in pd.read_csv(path_to_csv, chunksize=2):
-            # Submit each chunk for parallel processing
-            futures.append(
-                exec1.submit(process_chunk, chunk, session_id, brand_persona, marketing_post_request_args))
+            # Submit each chunk for parallel processing, in the context of the job (its cancellation token)
+            futures.append(exec1.submit(contextvars.copy_context().run, process_chunk, chunk, session_id,
+                                        brand_persona, marketing_post_request_args))
 
         # Collect the results as they complete
-        for future in as_completed(futures):
-            responses.extend(future.result())
+        try:
+            for future in as_completed(futures):
+                responses.extend(future.result())
+        except Cancelled:
+            # chunks that have not started yet are dropped, the running ones stop at their next row
+            exec1.shutdown(cancel_futures=True)
+            raise
 
     result_list = []
     # Extracting data
@@ -445,9 +1003,9 @@ def process_df(session_id, marketing_post_request_args: MarketingPostRequestArgs
         result_list += [data]
 
     result_df = pd.DataFrame(result_list)
-    result_csv_path = f'temp/files/result_{session_id}.csv'
+    result_csv_path = os.path.join(CSV_DIR, f'result_{session_id}.csv')
     result_df.to_csv(result_csv_path, index=False)
-    bucket = storage.bucket()
+    bucket = get_bucket()
     result_blob = bucket.blob(f'results/result_{session_id}.csv')
     result_blob.upload_from_filename(result_csv_path)
 
@@ -477,85 +1035,187 @@ def process_df(session_id, marketing_post_request_args: MarketingPostRequestArgs
 #     return responses
 
 
-def process_df_background(session_id, path_to_csv, marketing_post_request_args: MarketingPostRequestArgs):
-    try:
-        analysis_result = process_df(session_id, marketing_post_request_args, path_to_csv)
+def process_df_background(session_id, path_to_csv, marketing_post_request_args: dict):
+    analysis_result = process_df(session_id, MarketingPostRequestArgs(**marketing_post_request_args), path_to_csv)
 
-        # Update the status to "completed" and store the result
-        csv_ref = client.collection('csv-processor-status').document(session_id).set(
-            {"session_id": session_id, "status": "completed", "result": analysis_result})
+    # Update the status to "completed" and store the result
+    set_task_status(CSV_STATUS_COLLECTION, session_id,
+                    {"session_id": session_id, "status": "completed", "result": analysis_result})
 
-        # Remove the video after processing
-        os.remove(path_to_csv)
+    # Remove the video after processing
+    os.remove(path_to_csv)
 
-    except Exception as e:
-        print(e)
-        # Handle any errors and update the status
-        video_ref = client.collection('csv-processor-status').document(session_id).set(
-            {"session_id": session_id, "status": "failed", "error": str(e)})
+
+def on_csv_job_cancelled(job):
+    session_id = job["payload"]["session_id"]
+    set_task_status(CSV_STATUS_COLLECTION, session_id, {"session_id": session_id, "status": "cancelled"})
+    remove_file(job["payload"]["path_to_csv"])
+
+
+def remove_file(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def on_csv_job_failed(job, error):
+    print(error)
+    # Handle any errors and update the status, called once the job has no retries left
+    session_id = job["payload"]["session_id"]
+    set_task_status(CSV_STATUS_COLLECTION, session_id,
+                    {"session_id": session_id, "status": "failed", "error": str(error)})
 
 
 @app.post("/personalized_marketing")
-def analyze_customers(background_tasks: BackgroundTasks,
-                      marketing_post_request_args: MarketingPostRequestArgs = Body(...)):
+async def analyze_customers(marketing_post_request_args: MarketingPostRequestArgs = Body(...),
+                            idempotency_key: Optional[str] = Header(None)):
+    return JSONResponse(content=await idempotent(idempotency_key, "personalized_marketing",
+                                                 marketing_post_request_args.user_id,
+                                                 marketing_post_request_args.dict(), job_response,
+                                                 run_in_threadpool, start_csv_job, marketing_post_request_args))
+
+
+def start_csv_job(marketing_post_request_args: MarketingPostRequestArgs) -> dict:
     session_id = uuid.uuid4().__str__()
-    csv_ref = client.collection('csv-processor-status').document(session_id).set(
-        {"session_id": session_id, "status": "processing", "result": None})
+    set_task_status(CSV_STATUS_COLLECTION, session_id,
+                    {"session_id": session_id, "status": "processing", "result": None})
+
+    import pandas as pd
 
     # file_location='user_attribures.csv'
-    bucket = storage.bucket()
+    bucket = get_bucket()
     blob = bucket.blob(marketing_post_request_args.file_name)
 
     unique_id = str(uuid.uuid4())
-    if not os.path.exists("temp/files"):
-        os.makedirs("temp/files")
-    path_to_csv = f'temp/files/test_{unique_id}.csv'
-    blob.download_to_filename(path_to_csv)
+    if not os.path.exists(CSV_DIR):
+        os.makedirs(CSV_DIR)
+    path_to_csv = os.path.join(CSV_DIR, f'test_{unique_id}.csv')
     try:
-        df = pd.read_csv(path_to_csv)
-        df_size_5 = df.head(5)
+        # only the first rows are used, so stream the blob instead of downloading all of it
+        with blob.open("rb", chunk_size=CSV_PREVIEW_CHUNK_SIZE) as f:
+            df_size_5 = pd.read_csv(f, nrows=5)
 
         df_size_5.to_csv(path_to_csv)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error reading CSV file: {e}")
 
-    background_tasks.add_task(process_df_background, session_id, path_to_csv, marketing_post_request_args)
-    return JSONResponse(content={"session_id": session_id, "status": "processing"})
+    return enqueue_job("process_csv", session_id, path_to_csv=path_to_csv,
+                       marketing_post_request_args=marketing_post_request_args.dict())
 
 
-@app.get("/poll-csv/{session_id}")
-def get_csv_result(session_id: str):
-    docs = client.collection("csv-processor-status").where("session_id", "==", session_id).stream()
-    csv_processor_status = next(docs, None)
-    if csv_processor_status is None:
-        raise HTTPException(status_code=404, detail="Task not found")
+@app.get("/jobs/{session_id}")
+def get_job(session_id: str):
+    job = job_queue.get(session_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return JSONResponse(content={"session_id": session_id, "job_type": job["job_type"], "status": job["status"],
+                                 "attempts": job["attempts"], "last_error": job["last_error"],
+                                 "queue_position": job_queue.position(session_id),
+                                 "eta_seconds": job_queue.estimate_wait(session_id, max(job_workers, 1))})
+
+
+@app.post("/cancel/{session_id}")
+def cancel_session(session_id: str):
+    """Stops the work of a session. A queued video or CSV job never starts; a running job, or a generation
+    step running on any replica, stops at its next node boundary (LLM, image or frame call) and frees its slot."""
+    running_here = cancellations.cancel(session_id)
+    job = job_queue.get(session_id)
+    if job is None:
+        if not running_here:
+            if session_registry.get(session_id) is None:
+                raise HTTPException(status_code=404, detail="Nothing to cancel for this session.")
+            # a step of the session may be running on another replica, it picks the request up from Firestore
+            session_cancellations.request(session_id)
+        return JSONResponse(content={"session_id": session_id, "status": "cancelling"})
+
+    status = job_queue.cancel(session_id)
+    if status == CANCELLED and job["status"] == QUEUED:
+        # no worker will pick it up, so nobody else reports it
+        job_handlers[job["job_type"]].on_cancel(job)
+    elif status not in (CANCELLED, RUNNING):
+        raise HTTPException(status_code=409, detail=f"The job is already {status}.")
+    return JSONResponse(content={"session_id": session_id,
+                                 "status": "cancelled" if status == CANCELLED else "cancelling"})
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=429, content={"detail": str(exc), "predicted_wait_seconds": exc.predicted_wait},
+                        headers={"Retry-After": str(math.ceil(exc.retry_after))})
 
-    return JSONResponse(content=csv_processor_status.to_dict())
+
+@app.exception_handler(Cancelled)
+async def cancelled_handler(request: Request, exc: Cancelled):
+    return JSONResponse(status_code=409, content={"detail": "The session was cancelled."})
+
+
+@app.get("/jobQueue")
+def get_job_queue_stats():
+    return JSONResponse(content={**job_queue.stats(), "workers": job_workers})
+
+
+@app.get("/poll-csv/{session_id}")
+def get_csv_result(session_id: str, request: Request):
+    return task_status_response(CSV_STATUS_COLLECTION, session_id, request)
 
 
 def get_brand_persona_from_firestore(user_id: str):
+    brand_persona = brand_persona_cache.get(user_id)
+    if brand_persona is not None:
+        return brand_persona
+
     docs = client.collection("brand-persona").where("user_id", "==", user_id).stream()
     brand_persona = next(docs, None)
     if brand_persona is None:
         raise HTTPException(status_code=404, detail="No brand persona found for this user.")
 
+    brand_persona_cache.set(user_id, brand_persona)
     return brand_persona
 
 
 def save_session(operation: Operations, user_id: str, session_id: str):
-    session_context_ref = client.collection("session-context").document()
-    session_context = SessionContext(
-        user_id=user_id,
-        session_id=session_id,
-        operation=operation.value
-    )
-    session_context_ref.set(session_context.dict())
+    session_registry.save(operation, user_id, session_id)
 
 
-def validate_session(session_id: str, operation: Operations):
-    docs = client.collection("session-context").where("session_id", "==",
-                                                      session_id).stream()
-    session_context = next(docs, None)
+def validate_session(session_id: str, operation: Operations) -> SessionContext:
+    session_context = session_registry.get(session_id)
     if session_context is None:
         raise HTTPException(status_code=404, detail="No active session.")
-    # TODO: add validation on operation as well
+    if session_context.operation != operation.value:
+        raise HTTPException(status_code=400, detail="Session does not belong to this operation.")
+    return session_context
+
+
+job_handlers = {
+    "process_video": JobHandler(process_video_background, on_video_job_failed, on_video_job_cancelled),
+    "process_csv": JobHandler(process_df_background, on_csv_job_failed, on_csv_job_cancelled),
+}
+worker_pool = WorkerPool(job_queue, job_handlers, size=job_workers)
+
+
+@app.on_event("startup")
+def start_job_workers():
+    if job_workers > 0:
+        worker_pool.start()
+
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    worker_pool.stop(timeout=5)
+
+
+@app.on_event("startup")
+def start_checkpoint_retention():
+    if os.getenv("CHECKPOINT_RETENTION", "1") == "1":
+        checkpoint_retention.start()
+
+
+@app.on_event("shutdown")
+def stop_checkpoint_retention():
+    checkpoint_retention.stop()
+
+
+@app.on_event("shutdown")
+def flush_firestore_writes():
+    # after the job workers stopped, so the statuses they wrote last are committed too
+    firestore_writer.close(timeout=10)
@@ -0,0 +1,9 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class VideoUploadRequestArgs(BaseModel):
+    filename: str
+    # total size in bytes, when known the upload can only be finalized once all of it arrived
+    size: Optional[int] = None
@@ -0,0 +1,49 @@
+import json
+import os
+import threading
+
+STORAGE_BUCKET = os.getenv("FIREBASE_STORAGE_BUCKET", "blinx-63185.appspot.com")
+
+_lock = threading.RLock()
+_app = None
+_firestore_client = None
+
+
+def get_app():
+    """Initializes the Firebase Admin SDK on first use instead of at import."""
+    global _app
+    if _app is None:
+        with _lock:
+            if _app is None:
+                import firebase_admin
+                from firebase_admin import credentials
+
+                firestore_credentials = json.loads(os.environ["FIRESTORE_CREDENTIALS"])
+                cred = credentials.Certificate(firestore_credentials)
+                _app = firebase_admin.initialize_app(cred, {"storageBucket": STORAGE_BUCKET})
+    return _app
+
+
+def get_firestore_client():
+    global _firestore_client
+    if _firestore_client is None:
+        with _lock:
+            if _firestore_client is None:
+                from firebase_admin import firestore
+                _firestore_client = firestore.client(get_app())
+    return _firestore_client
+
+
+def get_bucket(name: str = None):
+    from firebase_admin import storage
+    return storage.bucket(name or STORAGE_BUCKET, app=get_app())
+
+
+class LazyClient:
+    """Stands in for a client that is only created when it is first used."""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
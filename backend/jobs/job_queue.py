@@ -0,0 +1,244 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobQueue:
+    """Durable FIFO job queue stored in SQLite.
+
+    Jobs survive restarts of the web process: a job is only removed from the queue once a worker marks it
+    completed or it runs out of attempts. The worker of a running job renews its lease every few seconds; jobs
+    left `running` by a crashed worker are handed out again once their lease expires, or fail if that was their
+    last attempt. Only the worker holding the current attempt can complete a job. A queued job can be cancelled
+    before it starts; a running one is flagged, and its worker stops at its next cancellation check.
+    """
+
+    def __init__(self, db_path: str = "jobs.sqlite", max_attempts: int = 3, retry_backoff: float = 30,
+                 lease_seconds: float = 60):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._setup_lock = threading.Lock()
+        self._ready = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit mode, transactions are opened explicitly where they are needed
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            # the database is created on first use, not when the queue is constructed (e.g. at import)
+            self._ensure_setup()
+        return conn
+
+    def _ensure_setup(self):
+        with self._setup_lock:
+            if not self._ready:
+                self._setup()
+                self._ready = True
+
+    def _setup(self):
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                job_type TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                available_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                lease_until REAL,
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status_available ON jobs (status, available_at, created_at);
+            """
+        )
+        columns = {row["name"] for row in self._conn().execute("PRAGMA table_info(jobs)")}
+        if "cancel_requested" not in columns:
+            # queues created before jobs could be cancelled
+            self._conn().execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+
+    def enqueue(self, job_type: str, payload: dict, job_id: str = None, max_attempts: int = None) -> str:
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, job_type, payload, status, max_attempts, available_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, job_type, json.dumps(payload), QUEUED, max_attempts or self.max_attempts, now, now))
+        return job_id
+
+    def claim(self):
+        """Atomically takes the oldest runnable job and marks it running. Returns None when the queue is empty."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND available_at <= ? ORDER BY created_at LIMIT 1",
+                (QUEUED, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, lease_until = ? WHERE id = ?",
+                (RUNNING, now, now + self.lease_seconds, row["id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job = self._to_job(row)
+        job["attempts"] += 1
+        job["status"] = RUNNING
+        return job
+
+    def renew(self, job_id: str, attempt: int) -> bool:
+        """Extends the lease of a running job by `lease_seconds`. Returns False if the job is no longer running this
+        attempt (its lease expired and it was handed out again, or it was finished elsewhere)."""
+        cur = self._conn().execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND attempts = ?",
+                                   (time.time() + self.lease_seconds, job_id, RUNNING, attempt))
+        return cur.rowcount > 0
+
+    def complete(self, job_id: str, attempt: int) -> bool:
+        """Marks the job completed. Returns False if it is no longer running this attempt, a stale worker finishing
+        after its lease expired must not complete the job another worker holds now."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status = ? AND attempts = ?", (COMPLETED, time.time(), job_id, RUNNING, attempt))
+        return cur.rowcount > 0
+
+    def fail(self, job_id: str, error: str, retry: bool = True) -> bool:
+        """Records a failed attempt. Returns True if the job was rescheduled, False if it is now failed for good."""
+        job = self.get(job_id)
+        now = time.time()
+        if retry and job["attempts"] < job["max_attempts"]:
+            # exponential backoff: 30s, 60s, 120s, ...
+            delay = self.retry_backoff * 2 ** (job["attempts"] - 1)
+            self._conn().execute(
+                "UPDATE jobs SET status = ?, available_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+                (QUEUED, now + delay, error, job_id))
+            return True
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+            (FAILED, now, error, job_id))
+        return False
+
+    def cancel(self, job_id: str):
+        """Cancels a queued job right away and asks the worker of a running one to stop.
+
+        Returns the status of the job afterwards (`cancelled`, or `running` until the worker stops), None if
+        there is no such job.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, cancel_requested = 1 WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED))
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING))
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row["status"] if row else None
+
+    def cancel_requested(self, job_id: str) -> bool:
+        row = self._conn().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def cancelled(self, job_id: str):
+        """Records that the worker stopped a cancelled job."""
+        self._conn().execute("UPDATE jobs SET status = ?, finished_at = ?, lease_until = NULL WHERE id = ?",
+                             (CANCELLED, time.time(), job_id))
+
+    def requeue_expired(self) -> list:
+        """Puts jobs whose worker died (lease expired) back in the queue.
+
+        A job whose expired attempt was its last fails instead, so a job that crashes its worker every time is not
+        retried forever. Returns the jobs that failed, for their failure handlers.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = [self._to_job(row) for row in conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND lease_until < ?", (RUNNING, now))]
+            failed = [job for job in expired if job["attempts"] >= job["max_attempts"]]
+            for job in expired:
+                if job in failed:
+                    job.update(status=FAILED, finished_at=now, last_error="The worker stopped before finishing the job")
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, finished_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+                        (FAILED, now, job["last_error"], job["id"]))
+                else:
+                    conn.execute("UPDATE jobs SET status = ?, lease_until = NULL WHERE id = ?", (QUEUED, job["id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return failed
+
+    def get(self, job_id: str):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def position(self, job_id: str):
+        """Number of queued jobs that will be picked up before this one (0 = next), None if it is not queued."""
+        job = self.get(job_id)
+        if job is None or job["status"] != QUEUED:
+            return None
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?",
+                                    (QUEUED, job["created_at"])).fetchone()[0]
+
+    def average_duration(self, job_type: str = None, sample: int = 50) -> float:
+        query = "SELECT AVG(finished_at - started_at) FROM (SELECT finished_at, started_at FROM jobs WHERE status = ?"
+        args = [COMPLETED]
+        if job_type:
+            query += " AND job_type = ?"
+            args.append(job_type)
+        query += " ORDER BY finished_at DESC LIMIT ?)"
+        args.append(sample)
+        return self._conn().execute(query, args).fetchone()[0] or 0.0
+
+    def estimate_wait(self, job_id: str, workers: int):
+        """Rough ETA in seconds until the job starts, based on the recent average job duration."""
+        position = self.position(job_id)
+        if position is None:
+            return None
+        running = self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (RUNNING,)).fetchone()[0]
+        return (position + running) * self.average_duration() / max(workers, 1)
+
+    def stats(self) -> dict:
+        counts = {row["status"]: row["n"] for row in
+                  self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+        return {
+            "queued": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "completed": counts.get(COMPLETED, 0),
+            "failed": counts.get(FAILED, 0),
+            "cancelled": counts.get(CANCELLED, 0),
+            "average_duration_seconds": self.average_duration(),
+        }
+
+    @staticmethod
+    def _to_job(row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
@@ -0,0 +1,125 @@
+import threading
+import traceback
+from typing import Callable, NamedTuple, Optional
+
+from ai.utils.cancellation import Cancelled, cancellations
+from backend.jobs.job_queue import JobQueue
+
+
+class JobHandler(NamedTuple):
+    # called with the job payload as keyword arguments
+    run: Callable
+    # called with (job, error) once a job has used up all of its attempts
+    on_failure: Optional[Callable] = None
+    # called with the job once it stopped because it was cancelled
+    on_cancel: Optional[Callable] = None
+
+
+class WorkerPool:
+    """Fixed-size pool of threads that pull jobs from a JobQueue and run the registered handler.
+
+    Handlers run under a cancellation token that follows `JobQueue.cancel`, so cancelling a job from any process
+    stops it at its next check (ai.utils.cancellation), without a retry. While a job runs, a heartbeat thread
+    renews its lease every third of `JobQueue.lease_seconds`, so long jobs are not handed to a second worker.
+    """
+
+    def __init__(self, queue: JobQueue, handlers: dict, size: int = 2, poll_interval: float = 1.0):
+        self.queue = queue
+        self.handlers = handlers
+        self.size = size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.requeue_expired()
+        for i in range(self.size):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Started {self.size} job workers")
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim()
+            except Exception as e:
+                print(f"Could not claim a job: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                self.requeue_expired()
+                continue
+            self.run_job(job)
+
+    def requeue_expired(self):
+        """Hands the jobs of dead workers out again, and reports those that ran out of attempts to their handler."""
+        try:
+            failed = self.queue.requeue_expired()
+        except Exception as e:
+            print(f"Could not requeue expired jobs: {e}")
+            return
+        for job in failed:
+            print(f"Job {job['id']} failed: {job['last_error']}")
+            handler = self.handlers.get(job["job_type"])
+            if handler is not None and handler.on_failure:
+                try:
+                    handler.on_failure(job, RuntimeError(job["last_error"]))
+                except Exception:
+                    traceback.print_exc()
+
+    def run_job(self, job: dict):
+        handler = self.handlers.get(job["job_type"])
+        if handler is None:
+            self.queue.fail(job["id"], f"No handler registered for job type {job['job_type']}", retry=False)
+            return
+        done = threading.Event()
+        lease_lost = threading.Event()
+        try:
+            # cancellations.cancel(job id) stops it right away in this process, JobQueue.cancel from any process
+            with cancellations.scope(job["id"], poll=lambda: self.queue.cancel_requested(job["id"])) as token:
+                threading.Thread(target=self._heartbeat, args=(job, token, done, lease_lost),
+                                 name=f"job-heartbeat-{job['id']}", daemon=True).start()
+                handler.run(**job["payload"])
+            # once the lease is lost the job belongs to the worker that claimed it again
+            if not lease_lost.is_set() and not self.queue.complete(job["id"], job["attempts"]):
+                print(f"Job {job['id']} finished after it lost its lease, another worker runs it now")
+        except Cancelled:
+            if lease_lost.is_set():
+                # the job was handed to another worker, which reports it
+                return
+            print(f"Job {job['id']} was cancelled")
+            self.queue.cancelled(job["id"])
+            if handler.on_cancel:
+                handler.on_cancel(job)
+        except Exception as e:
+            traceback.print_exc()
+            if lease_lost.is_set():
+                return
+            # a job that was being cancelled is not retried
+            retrying = self.queue.fail(job["id"], str(e), retry=not self.queue.cancel_requested(job["id"]))
+            if not retrying and handler.on_failure:
+                handler.on_failure(job, e)
+        finally:
+            done.set()
+
+    def _heartbeat(self, job: dict, token, done: threading.Event, lease_lost: threading.Event):
+        """Renews the lease of the running job until it is done. If the lease was lost anyway (the worker stalled
+        longer than the lease and the job went back to the queue), the job is stopped at its next check."""
+        while not done.wait(self.queue.lease_seconds / 3):
+            try:
+                renewed = self.queue.renew(job["id"], job["attempts"])
+            except Exception as e:
+                print(f"Could not renew the lease of job {job['id']}: {e}")
+                continue
+            if not renewed:
+                print(f"Job {job['id']} lost its lease, stopping it")
+                lease_lost.set()
+                token.cancel()
+                return
@@ -0,0 +1,157 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """The request would not finish within the latency SLO, it should be retried after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float, predicted_wait: float):
+        super().__init__(f"Server is overloaded, retry in {math.ceil(retry_after)}s")
+        self.retry_after = retry_after
+        self.predicted_wait = predicted_wait
+
+
+class _Ticket:
+    def __init__(self, controller, name: str):
+        self.controller = controller
+        self.name = name
+        self.started_at = time.monotonic()
+        self._done = False
+
+    def done(self, ok: bool = True):
+        """Releases the ticket; only the first call counts (a stream may end in a worker thread and the request)."""
+        with self.controller._lock:
+            if self._done:
+                return
+            self._done = True
+        self.controller._finish(self, ok)
+
+
+class AdmissionController:
+    """Rejects generation requests up front, with a 429 and Retry-After, when they would wait longer than
+    `slo_seconds` before getting to run, instead of accepting them and timing out deep inside an LLM call.
+
+    The predicted wait of a new request is the wait for a slot of the busiest LLM scheduler (calls queued ahead of
+    an interactive call) plus, once more than `max_in_flight` workflows run, the time for the excess to drain at
+    the recent workflow duration. Both are stretched by the recent rate of provider 429s, which shrinks the
+    capacity that is actually available. Admitted requests run as before, so goodput stays at capacity during
+    overload instead of collapsing into timeouts.
+    """
+
+    def __init__(self, schedulers: list, slo_seconds: float = 30, max_in_flight: int = 32, enabled: bool = True):
+        self.schedulers = schedulers
+        self.slo_seconds = slo_seconds
+        self.max_in_flight = max_in_flight
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._durations = {}
+        self._stats = {"admitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+    def admit(self, name: str) -> _Ticket:
+        """Takes a ticket for a `name` request, which must be `done()` once it finished. Raises Overloaded."""
+        predicted_wait = self.predicted_wait()
+        with self._lock:
+            if self.enabled and predicted_wait > self.slo_seconds:
+                self._stats["rejected"] += 1
+                # about the time it takes for the backlog to drain below the SLO
+                raise Overloaded(max(1.0, predicted_wait - self.slo_seconds), predicted_wait)
+            self._stats["admitted"] += 1
+            self._in_flight[name] = self._in_flight.get(name, 0) + 1
+        return _Ticket(self, name)
+
+    @contextmanager
+    def admitted(self, name: str):
+        """Runs the block as an admitted `name` request. Raises Overloaded."""
+        ticket = self.admit(name)
+        ok = False
+        try:
+            yield ticket
+            ok = True
+        finally:
+            ticket.done(ok)
+
+    def _finish(self, ticket: _Ticket, ok: bool):
+        duration = time.monotonic() - ticket.started_at
+        with self._lock:
+            self._in_flight[ticket.name] -= 1
+            self._stats["completed" if ok else "failed"] += 1
+            if ok:
+                average = self._durations.get(ticket.name)
+                self._durations[ticket.name] = duration if average is None else 0.9 * average + 0.1 * duration
+
+    def throttle_rate(self) -> float:
+        return max((scheduler.throttle_rate() for scheduler in self.schedulers), default=0.0)
+
+    def predicted_wait(self) -> float:
+        """Seconds a generation request admitted now would wait before it gets to run."""
+        queue_wait = max((scheduler.estimated_wait() for scheduler in self.schedulers), default=0.0)
+        with self._lock:
+            in_flight = sum(self._in_flight.values())
+            durations = list(self._durations.values())
+        excess = in_flight + 1 - self.max_in_flight
+        drain_wait = excess * (sum(durations) / len(durations)) / self.max_in_flight if excess > 0 and durations \
+            else 0.0
+        # with a share of the calls rejected by the provider, only the rest of the capacity does useful work
+        return (queue_wait + drain_wait) / max(1.0 - self.throttle_rate(), 0.1)
+
+    def stats(self) -> dict:
+        predicted_wait = self.predicted_wait()
+        throttle_rate = self.throttle_rate()
+        with self._lock:
+            return {**self._stats, "enabled": self.enabled, "slo_seconds": self.slo_seconds,
+                    "max_in_flight": self.max_in_flight, "in_flight": dict(self._in_flight),
+                    "avg_duration_seconds": dict(self._durations), "predicted_wait_seconds": predicted_wait,
+                    "throttle_rate": throttle_rate}
+
+
+if __name__ == "__main__":
+    # Goodput (requests answered within the SLO, per second) of generation requests arriving at twice the LLM
+    # capacity, with and without admission control. Requests that take longer than the SLO count as timed out.
+    from concurrent.futures import ThreadPoolExecutor
+
+    from ai.utils.fair_scheduler import FairScheduler
+
+    CAPACITY = 4
+    CALLS = 3
+    CALL_SECONDS = 0.05
+    SLO = 1.0
+    DURATION = 6.0
+    # each request holds a slot CALLS * CALL_SECONDS, so the scheduler serves CAPACITY / 0.15 requests a second
+    ARRIVAL_RATE = 2 * CAPACITY / (CALLS * CALL_SECONDS)
+
+    def run(admission: bool):
+        scheduler = FairScheduler("benchmark", capacity=CAPACITY, reserved=0)
+        controller = AdmissionController([scheduler], slo_seconds=SLO / 2, max_in_flight=CAPACITY,
+                                         enabled=admission)
+        results = []
+
+        def request():
+            start = time.monotonic()
+            try:
+                ticket = controller.admit("generate")
+            except Overloaded:
+                results.append("rejected")
+                return
+            for _ in range(CALLS):
+                with scheduler.slot():
+                    time.sleep(CALL_SECONDS)
+            ticket.done()
+            results.append("ok" if time.monotonic() - start <= SLO else "timed out")
+
+        with ThreadPoolExecutor(max_workers=512) as pool:
+            start = time.monotonic()
+            sent = 0
+            while time.monotonic() - start < DURATION:
+                pool.submit(request)
+                sent += 1
+                time.sleep(1 / ARRIVAL_RATE)
+        return {outcome: results.count(outcome) for outcome in ("ok", "timed out", "rejected")}, sent
+
+    print(f"{'admission':<11}{'sent':>6}{'ok':>6}{'timed out':>11}{'rejected':>10}{'goodput/s':>11}")
+    for admission in (False, True):
+        outcomes, sent = run(admission)
+        print(f"{'on' if admission else 'off':<11}{sent:>6}{outcomes['ok']:>6}{outcomes['timed out']:>11}"
+              f"{outcomes['rejected']:>10}{outcomes['ok'] / DURATION:>11.1f}")
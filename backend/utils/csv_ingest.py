@@ -0,0 +1,118 @@
+import codecs
+import csv
+import re
+import zlib
+
+CHUNK_SIZE = 1024 * 1024
+# resumable uploads need a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# a line with its ending; only \n, \r\n and \r end a CSV line, unlike str.splitlines which also splits on \x0b,
+# \x0c, \x1c-\x1e, \x85, \u2028 and \u2029 (data in a CSV field)
+LINE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)")
+
+
+class CsvIngestError(ValueError):
+    pass
+
+
+def strip_compression_suffix(filename: str) -> str:
+    for suffix in (".gz", ".gzip", ".zst", ".zstd"):
+        if filename.lower().endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def _decompressor(first_chunk: bytes):
+    if first_chunk.startswith(GZIP_MAGIC):
+        # 16 + MAX_WBITS: expect a gzip header
+        return "gzip", zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if first_chunk.startswith(ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            raise CsvIngestError("zstd compressed uploads need the zstandard package.")
+        return "zstd", zstandard.ZstdDecompressor().decompressobj()
+    return None, None
+
+
+def _decompressed_chunks(fileobj, profile: dict):
+    chunk = fileobj.read(CHUNK_SIZE)
+    profile["compression"], decompressor = _decompressor(chunk)
+    while chunk:
+        profile["bytes_received"] += len(chunk)
+        data = decompressor.decompress(chunk) if decompressor else chunk
+        if data:
+            yield data
+        chunk = fileobj.read(CHUNK_SIZE)
+    if decompressor is not None:
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+def _lines(chunks, sink, profile: dict):
+    """Decodes the CSV bytes into lines, copying the raw bytes to `sink` on the way."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    for chunk in chunks:
+        sink.write(chunk)
+        profile["bytes_stored"] += len(chunk)
+        try:
+            pending += decoder.decode(chunk)
+        except UnicodeDecodeError as e:
+            raise CsvIngestError(f"CSV file is not valid UTF-8: {e}")
+        end = 0
+        for line in LINE.finditer(pending):
+            # a \r at the very end may be the first half of a \r\n in the next chunk
+            if line.end() == len(pending) and pending.endswith("\r"):
+                break
+            yield line.group()
+            end = line.end()
+        # the last line may continue in the next chunk
+        pending = pending[end:]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def ingest_csv(fileobj, sink) -> dict:
+    """Streams a (optionally gzip / zstd compressed) CSV upload from `fileobj` into `sink` as plain CSV.
+
+    The header and every row are validated as they pass, memory use does not depend on the file size.
+    Returns a profile of the file: columns, row count and the number of empty cells per column.
+    """
+    profile = {"bytes_received": 0, "bytes_stored": 0, "row_count": 0}
+    reader = csv.reader(_lines(_decompressed_chunks(fileobj, profile), sink, profile))
+
+    header = next(reader, None)
+    if not header or not any(column.strip() for column in header):
+        raise CsvIngestError("CSV file has no header row.")
+    columns = [column.strip() for column in header]
+    if "" in columns:
+        raise CsvIngestError("CSV header has an empty column name.")
+    if len(set(columns)) != len(columns):
+        raise CsvIngestError("CSV header has duplicate column names.")
+
+    empty_cells = [0] * len(columns)
+    try:
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(columns):
+                raise CsvIngestError(f"Row {reader.line_num} has {len(row)} fields, expected {len(columns)}.")
+            for i, value in enumerate(row):
+                if not value.strip():
+                    empty_cells[i] += 1
+            profile["row_count"] += 1
+    except csv.Error as e:
+        raise CsvIngestError(f"Malformed CSV near line {reader.line_num}: {e}")
+
+    if profile["row_count"] == 0:
+        raise CsvIngestError("CSV file has no data rows.")
+
+    profile["columns"] = columns
+    profile["empty_cells"] = dict(zip(columns, empty_cells))
+    return profile
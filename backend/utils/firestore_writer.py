@@ -0,0 +1,291 @@
+import threading
+import time
+from typing import Optional
+
+# Firestore rejects batches with more writes than this
+MAX_BATCH_SIZE = 500
+# 4xx statuses that are about the backend (timeout, contention, quota) rather than about a write
+RETRYABLE_STATUSES = (408, 409, 429)
+
+
+def rejected(error: Exception) -> bool:
+    """Whether Firestore refused a write of the batch (missing document, too large, invalid value). Retrying the
+    same write can't succeed, unlike after an error of the backend or the connection."""
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and 400 <= code < 500 and code not in RETRYABLE_STATUSES
+
+
+class _Write:
+    def __init__(self, collection: str, document_id: str, op: str, data: dict, merge: bool, wait: bool):
+        self.key = (collection, document_id)
+        self.op = op
+        self.data = data
+        self.merge = merge
+        self.wait = wait
+        self.attempts = 0
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+        # writes replaced by this one before they were committed, they complete together with it
+        self.replaced = []
+
+    def finish(self, error: Exception = None):
+        for write in (self, *self.replaced):
+            write.error = error
+            write.done.set()
+
+
+class FirestoreWriter:
+    """Groups document writes into WriteBatch commits made by a background thread.
+
+    A batch is committed once `max_batch` writes are pending, `flush_interval` seconds after its first write, or
+    right away when a caller waits on one of its writes. Writers that don't wait (write-behind) return as soon as
+    the write is queued; a full `set` of a document replaces a pending write of the same document, so a status
+    that changes several times within one interval costs one write.
+
+    A batch commits atomically, so a batch Firestore rejects is split in halves and committed again until only the
+    rejected writes are left; they fail right away and the other writes of the batch go through. Batches that fail
+    for another reason are retried up to `max_attempts` times. A write-behind write that fails has nobody to raise
+    to, it is logged and counted in `lost_writes`. `close()` commits everything still pending.
+    """
+
+    def __init__(self, client, max_batch: int = MAX_BATCH_SIZE, flush_interval: float = 0.2, max_attempts: int = 3):
+        self.client = client
+        self.max_batch = min(max_batch, MAX_BATCH_SIZE)
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._pending = []
+        self._latest = {}
+        self._first_pending_at = None
+        self._urgent = False
+        self._committing = 0
+        self._closed = False
+        self._thread = None
+        self._stats = {"writes": 0, "replaced": 0, "batches": 0, "committed": 0, "failed_batches": 0,
+                       "split_batches": 0, "failed_writes": 0, "lost_writes": 0, "commit_seconds": 0.0}
+
+    def set(self, collection: str, document_id: str, data: dict, merge: bool = False, wait: bool = False):
+        self._submit(_Write(collection, document_id, "set", data, merge, wait), wait)
+
+    def update(self, collection: str, document_id: str, data: dict, wait: bool = False):
+        self._submit(_Write(collection, document_id, "update", data, False, wait), wait)
+
+    def _submit(self, write: _Write, wait: bool):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("FirestoreWriter is closed")
+            self._stats["writes"] += 1
+            previous = self._latest.get(write.key)
+            if previous is not None and write.op == "set" and not write.merge:
+                # the new document overwrites whatever the pending write would have left
+                self._pending.remove(previous)
+                write.replaced += [previous, *previous.replaced]
+                previous.replaced = []
+                self._stats["replaced"] += 1
+            self._pending.append(write)
+            self._latest[write.key] = write
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            self._urgent = self._urgent or wait
+            self._start()
+            self._cond.notify_all()
+        if wait:
+            write.done.wait()
+            if write.error is not None:
+                raise write.error
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="firestore-writer", daemon=True)
+            self._thread.start()
+
+    def _take_batch(self) -> list:
+        """Waits until a batch is due and takes it off the queue, an empty list once closed and drained."""
+        with self._cond:
+            while True:
+                if self._pending:
+                    due_in = self._first_pending_at + self.flush_interval - time.monotonic()
+                    if self._urgent or self._closed or len(self._pending) >= self.max_batch or due_in <= 0:
+                        break
+                    self._cond.wait(due_in)
+                elif self._closed:
+                    return []
+                else:
+                    self._cond.wait()
+
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            for write in batch:
+                if self._latest.get(write.key) is write:
+                    del self._latest[write.key]
+            self._first_pending_at = time.monotonic() if self._pending else None
+            self._urgent = self._urgent and bool(self._pending)
+            self._committing += 1
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            for write in batch:
+                write.attempts += 1
+            uncommitted = self._commit_isolating(batch)
+            retry, failed = [], []
+            with self._cond:
+                self._committing -= 1
+                for write, error in uncommitted:
+                    newer = self._latest.get(write.key)
+                    if newer is not None and newer.op == "set" and not newer.merge:
+                        # a newer full write of the document is pending, it completes this one too
+                        newer.replaced += [write, *write.replaced]
+                        write.replaced = []
+                    elif not rejected(error) and write.attempts < self.max_attempts:
+                        retry.append(write)
+                        self._latest.setdefault(write.key, write)
+                    else:
+                        failed.append((write, error))
+                # retried writes go first, so writes of the same document keep their order
+                self._pending[:0] = retry
+                if self._pending and self._first_pending_at is None:
+                    self._first_pending_at = time.monotonic()
+                self._stats["failed_writes"] += len(failed)
+                self._stats["lost_writes"] += sum(not w.wait for write, _ in failed for w in (write, *write.replaced))
+                self._cond.notify_all()
+            committed = {id(write) for write, _ in uncommitted}
+            for write in batch:
+                if id(write) not in committed:
+                    write.finish()
+            for write, error in failed:
+                if not any(w.wait for w in (write, *write.replaced)):
+                    print(f"Firestore write-behind to {'/'.join(write.key)} lost after {write.attempts} attempts: "
+                          f"{error}")
+                write.finish(error)
+            if retry:
+                print(f"Firestore commit of {len(retry)} writes failed, retrying: {uncommitted[-1][1]}")
+                # back off before the retry instead of hammering a failing backend
+                time.sleep(self.flush_interval)
+
+    def _commit_isolating(self, batch: list) -> list:
+        """Commits `batch`, returns (write, error) for the writes that were not committed.
+
+        When Firestore rejects the batch it is split in halves that are committed on their own, so only the
+        rejected writes are returned. Any other error stops the commit: the writes not committed by then are
+        returned with it, in order, to be retried.
+        """
+        error = self._commit(batch)
+        if error is None:
+            return []
+        if len(batch) == 1 or not rejected(error):
+            return [(write, error) for write in batch]
+        with self._cond:
+            self._stats["split_batches"] += 1
+        middle = len(batch) // 2
+        uncommitted = self._commit_isolating(batch[:middle])
+        if uncommitted and not rejected(uncommitted[-1][1]):
+            return uncommitted + [(write, uncommitted[-1][1]) for write in batch[middle:]]
+        return uncommitted + self._commit_isolating(batch[middle:])
+
+    def _commit(self, batch: list) -> Optional[Exception]:
+        start = time.perf_counter()
+        try:
+            write_batch = self.client.batch()
+            for write in batch:
+                ref = self.client.collection(write.key[0]).document(write.key[1])
+                if write.op == "set":
+                    write_batch.set(ref, write.data, merge=write.merge)
+                else:
+                    write_batch.update(ref, write.data)
+            write_batch.commit()
+        except Exception as e:
+            with self._cond:
+                self._stats["failed_batches"] += 1
+            return e
+        with self._cond:
+            self._stats["batches"] += 1
+            self._stats["committed"] += len(batch)
+            self._stats["commit_seconds"] += time.perf_counter() - start
+        return None
+
+    def flush(self, timeout: float = None) -> bool:
+        """Commits every pending write now, returns False if they were not all committed within `timeout`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._urgent = bool(self._pending)
+            self._cond.notify_all()
+            while self._pending or self._committing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = None):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        stats["avg_batch_size"] = stats["committed"] / stats["batches"] if stats["batches"] else 0.0
+        stats["avg_commit_ms"] = stats["commit_seconds"] / stats["batches"] * 1000 if stats["batches"] else 0.0
+        return stats
+
+
+if __name__ == "__main__":
+    # Latency of a status update as seen by the request, direct set() against the writer, on a client that
+    # takes ROUND_TRIP seconds per commit like Firestore from Cloud Run
+    import statistics
+    from concurrent.futures import ThreadPoolExecutor
+
+    ROUND_TRIP = 0.03
+
+    class SlowRef:
+        def set(self, data, merge=False):
+            time.sleep(ROUND_TRIP)
+
+    class SlowBatch:
+        def set(self, ref, data, merge=False):
+            pass
+
+        def update(self, ref, data):
+            pass
+
+        def commit(self):
+            time.sleep(ROUND_TRIP)
+
+    class SlowClient:
+        def collection(self, name):
+            return self
+
+        def document(self, document_id):
+            return SlowRef()
+
+        def batch(self):
+            return SlowBatch()
+
+    def timed(write, n: int):
+        start = time.perf_counter()
+        write(n)
+        return time.perf_counter() - start
+
+    client = SlowClient()
+    print(f"{'mode':<14}{'writes':>8}{'p50 (ms)':>10}{'p95 (ms)':>10}{'commits':>9}")
+    for mode in ("direct", "write-behind", "batched wait"):
+        writer = FirestoreWriter(client)
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            if mode == "direct":
+                latencies = list(pool.map(lambda n: timed(lambda i: client.document(i).set({}), n), range(500)))
+            else:
+                wait = mode == "batched wait"
+                latencies = list(pool.map(
+                    lambda n: timed(lambda i: writer.set("status", str(i % 100), {"n": i}, wait=wait), n),
+                    range(500)))
+        writer.close()
+        commits = 500 if mode == "direct" else writer.stats()["batches"]
+        p95 = statistics.quantiles(latencies, n=20)[-1] * 1000
+        print(f"{mode:<14}{500:>8}{statistics.median(latencies) * 1000:>10.2f}{p95:>10.2f}{commits:>9}")
@@ -0,0 +1,123 @@
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from backend.utils.cache import TTLCache
+from backend.utils.single_flight import SingleFlight
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+
+class IdempotencyConflict(Exception):
+    """A request with the same key is still running on another replica."""
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body."""
+
+
+class IdempotencyStore:
+    """Responses of requests sent with an Idempotency-Key, kept for `ttl` seconds.
+
+    A retry gets the stored response of the first request instead of running it again. While the first request
+    runs, a retry reaching the same replica waits for it and gets its response; one reaching another replica
+    finds the key claimed in Firestore and gets an IdempotencyConflict. The fingerprint of the request body is
+    stored with the key: a request that reuses the key with another body gets an IdempotencyKeyReused instead of
+    the response of the first one. A request that fails releases its key, so it can be retried. Expired documents
+    are ignored (and can be removed with a Firestore TTL policy on `expires_at`).
+
+    The response itself is only kept in the memory of the replica that ran the request. The Firestore document
+    records the session_id of the response, and a retry reaching another replica gets the response `resolve`
+    rebuilds from it, so workflow states of any size stay out of the document.
+    """
+
+    def __init__(self, client, collection: str = "idempotency-keys", ttl: float = 24 * 3600, writer=None,
+                 maxsize: int = 10000):
+        self.client = client
+        self.collection = collection
+        self.ttl = ttl
+        self.writer = writer
+        self.responses = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.flight = SingleFlight("idempotency")
+        self.replayed = 0
+
+    async def run(self, key: str, request: str, resolve, fn, *args) -> dict:
+        """The response of `fn(*args)`, a coroutine function returning a JSON-serializable dict with the session_id
+        of the request, run once per key. `request` is the fingerprint of the request body, `resolve(session_id)`
+        (run in the threadpool) rebuilds the response on another replica."""
+        stored = self.responses.get(key)
+        if stored is not None:
+            return self._replay(stored, request)
+        # a request with another body does not wait for the running one, its claim fails instead
+        return await self.flight.run(f"{key}:{request}", self._run_once, key, request, resolve, fn, *args)
+
+    def _replay(self, stored: dict, request: str) -> dict:
+        # keys stored before the request fingerprint was kept have none
+        if stored.get("request", request) != request:
+            raise IdempotencyKeyReused("This Idempotency-Key was already used for a different request")
+        self.replayed += 1
+        return stored["response"]
+
+    async def _run_once(self, key: str, request: str, resolve, fn, *args) -> dict:
+        stored = await run_in_threadpool(self._claim, key, request)
+        if stored is not None:
+            if stored.get("request", request) != request:
+                return self._replay(stored, request)
+            if "response" not in stored:
+                # the document references the session of the response (older documents hold the response itself)
+                stored = {**stored, "response": await run_in_threadpool(resolve, stored["session_id"])}
+            self.responses.set(key, stored)
+            return self._replay(stored, request)
+        try:
+            response = await fn(*args)
+        except BaseException:
+            await run_in_threadpool(self._release, key)
+            raise
+        self.responses.set(key, {"request": request, "response": response})
+        document = {"status": COMPLETED, "request": request, "session_id": response.get("session_id"),
+                    "expires_at": time.time() + self.ttl}
+        # waited for, a retry on another replica must not find the key still claimed once the response is out
+        try:
+            if self.writer is not None:
+                await run_in_threadpool(self.writer.set, self.collection, key, document, wait=True)
+            else:
+                await run_in_threadpool(self.client.collection(self.collection).document(key).set, document)
+        except Exception as e:
+            # the request succeeded; without its record other replicas would answer 409 until the claim expires
+            print(f"Could not record idempotency key {key}: {e}")
+            await run_in_threadpool(self._release, key)
+        return response
+
+    def _claim(self, key: str, request: str):
+        """Claims the key for this request. Returns the stored document if a request with the key completed."""
+        from google.api_core.exceptions import AlreadyExists
+
+        doc_ref = self.client.collection(self.collection).document(key)
+        claim = {"status": IN_PROGRESS, "request": request, "expires_at": time.time() + self.ttl}
+        try:
+            doc_ref.create(claim)
+            return None
+        except AlreadyExists:
+            pass
+
+        doc = doc_ref.get()
+        stored = doc.to_dict() if doc.exists else None
+        if stored is not None and stored.get("expires_at", 0) > time.time():
+            if stored.get("status") == COMPLETED:
+                return stored
+            if stored.get("request", request) != request:
+                raise IdempotencyKeyReused("This Idempotency-Key is in use for a different request")
+            raise IdempotencyConflict("A request with this Idempotency-Key is still in progress")
+        # expired, or released between create and get
+        doc_ref.set(claim)
+        return None
+
+    def _release(self, key: str):
+        try:
+            self.client.collection(self.collection).document(key).delete()
+        except Exception as e:
+            print(f"Could not release idempotency key {key}: {e}")
+
+    def stats(self) -> dict:
+        return {"replayed": self.replayed, **self.flight.stats(), "cache": self.responses.stats()}
@@ -0,0 +1,66 @@
+"""Import time budget for the API process.
+
+    python -m backend.utils.import_profile [module]
+
+Imports `module` (backend.backend by default) in a fresh interpreter with `-X importtime`, prints the slowest
+imports and exits with status 1 when the import takes longer than IMPORT_TIME_BUDGET_MS or pulls in one of
+the heavy modules that are only meant to load with the workflow that needs them. Run it in CI and before
+adding a top-level import to the backend.
+"""
+import os
+import subprocess
+import sys
+
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+
+# loaded by the agents (through the agent registry) or inside the endpoints that use them
+LAZY_MODULES = (
+    "pandas",
+    "cv2",
+    "PIL",
+    "google.generativeai",
+    "gradio_client",
+    "langchain_openai",
+    "langchain_google_genai",
+    "firebase_admin",
+)
+
+
+def profile_imports(module: str) -> list:
+    """(cumulative_us, self_us, module) of every module imported by `module`, in import order."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative_us), int(self_us), name.strip()))
+    return imports
+
+
+def check(module: str = "backend.backend", budget_ms: float = IMPORT_TIME_BUDGET_MS, top: int = 15) -> bool:
+    imports = profile_imports(module)
+    total_ms = next(cumulative for cumulative, _, name in imports if name == module) / 1000
+
+    print(f"{'cumulative (ms)':>16}{'self (ms)':>12}  module")
+    for cumulative, self_us, name in sorted(imports, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>16.1f}{self_us / 1000:>12.1f}  {name}")
+
+    ok = True
+    print(f"\nimport {module}: {total_ms:.0f} ms (budget {budget_ms:.0f} ms)")
+    if total_ms > budget_ms:
+        print(f"FAIL: over the import time budget by {total_ms - budget_ms:.0f} ms")
+        ok = False
+    loaded = {name for _, _, name in imports}
+    for lazy_module in LAZY_MODULES:
+        if lazy_module in loaded:
+            print(f"FAIL: {lazy_module} is imported eagerly, import it where it is used")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check(*sys.argv[1:2]) else 1)
@@ -0,0 +1,114 @@
+"""Event loop latency under load: /hello stays fast while generations are in flight.
+
+    python -m backend.utils.loop_latency_check [--generations 50] [--seconds 5]
+    python -m backend.utils.loop_latency_check --api http://localhost:8000 --user-id <user id>
+
+It times /hello with the server idle, then again while `--generations` /generateBlog requests are held open, and
+exits with status 1 when the p99 under load is above max(LOOP_LATENCY_BUDGET_MS, 5 x the idle p99), i.e. when a
+generation blocks the event loop instead of running in the threadpool.
+
+Without --api it drives the app in this process through httpx's ASGI transport. The blog workflow, the brand
+persona lookup and the session write are replaced by blocking sleeps of `--seconds`, which is what a synchronous
+LLM call does to the thread that runs it, so it needs no credentials. With --api it runs real generations against
+a running server, the user needs a brand persona.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+LOOP_LATENCY_BUDGET_MS = float(os.getenv("LOOP_LATENCY_BUDGET_MS", "100"))
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def time_hello(client, samples: int, interval: float = 0.01) -> list:
+    """Latency in ms of `samples` sequential /hello requests, sent `interval` seconds apart. The pause is counted
+    too (less `interval`): in process the request itself never yields, a blocked loop only shows in the wake-up."""
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        response = await client.get("/hello")
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start - interval) * 1000)
+    return latencies
+
+
+async def measure(client, body: dict, generations: int, samples: int) -> bool:
+    idle = await time_hello(client, samples)
+    pending = [asyncio.create_task(client.post("/generateBlog", json=body, timeout=None)) for _ in range(generations)]
+    # timed from the moment the generations are sent, so a request that holds the loop shows up in the latencies
+    loaded = await time_hello(client, samples)
+    in_flight = sum(not task.done() for task in pending)
+    responses = await asyncio.gather(*pending, return_exceptions=True)
+    failed = [response for response in responses if isinstance(response, Exception) or response.status_code != 200]
+
+    print(f"{'/hello':<26}{'p50 (ms)':>10}{'p99 (ms)':>10}{'max (ms)':>10}")
+    for name, latencies in (("idle", idle), (f"{in_flight} generations in flight", loaded)):
+        print(f"{name:<26}{percentile(latencies, 0.5):>10.1f}{percentile(latencies, 0.99):>10.1f}"
+              f"{max(latencies):>10.1f}")
+
+    ok = True
+    budget = max(LOOP_LATENCY_BUDGET_MS, 5 * percentile(idle, 0.99))
+    if percentile(loaded, 0.99) > budget:
+        print(f"FAIL: /hello p99 under load is over {budget:.0f} ms, something blocks the event loop")
+        ok = False
+    if in_flight < generations:
+        print(f"FAIL: only {in_flight} of {generations} generations were in flight while /hello was timed")
+        ok = False
+    if failed:
+        print(f"FAIL: {len(failed)} generations failed, e.g. {failed[0]!r}")
+        ok = False
+    return ok
+
+
+def in_process_app(seconds: float):
+    # the check is about the event loop, not about shedding load
+    os.environ["ADMISSION_CONTROL"] = "0"
+    from backend import backend
+
+    def slow_workflow(**kwargs):
+        time.sleep(seconds)
+        return {"workflow_step": "title_review", "state": {}}
+
+    backend.run_blog_gen_workflow = slow_workflow
+    backend.get_brand_persona_from_firestore = lambda user_id: SimpleNamespace(to_dict=dict)
+    backend.save_session = lambda *args: None
+    return backend
+
+
+async def check(api: str, user_id: str, generations: int, seconds: float, samples: int) -> bool:
+    import httpx
+
+    body = {"user_id": user_id, "user_prompt": "Training a puppy", "max_suggestions": 3, "max_sections": 3,
+            "max_images": 0, "include_images": False}
+    limits = httpx.Limits(max_connections=generations + 1)
+    if api:
+        async with httpx.AsyncClient(base_url=api, limits=limits) as client:
+            return await measure(client, body, generations, samples)
+
+    backend = in_process_app(seconds)
+    # what the startup hook of the server does
+    await backend.configure_threadpool()
+    transport = httpx.ASGITransport(app=backend.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://backend", limits=limits) as client:
+        return await measure(client, body, generations, samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", metavar="URL", help="base URL of a running API")
+    parser.add_argument("--user-id", default="loop-latency-check", help="user with a brand persona, for --api")
+    parser.add_argument("--generations", type=int, default=50, help="generations held open while /hello is timed")
+    parser.add_argument("--seconds", type=float, default=5, help="duration of an in-process generation")
+    parser.add_argument("--samples", type=int, default=100, help="/hello requests per measurement")
+    args = parser.parse_args()
+    passed = asyncio.run(check(args.api, args.user_id, args.generations, args.seconds, args.samples))
+    print("PASS" if passed else "FAIL")
+    sys.exit(0 if passed else 1)
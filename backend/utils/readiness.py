@@ -0,0 +1,50 @@
+import asyncio
+import time
+import traceback
+
+from fastapi.concurrency import run_in_threadpool
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+
+class Readiness:
+    """Tracks the components the app initializes in the background after startup.
+
+    Each component is a blocking function (opening a client, building an agent) run in the threadpool, so
+    several of them initialize in parallel and the server accepts requests while they do.
+    """
+
+    def __init__(self):
+        self.components = {}
+        self.started_at = time.time()
+
+    def expect(self, *names: str):
+        for name in names:
+            self.components.setdefault(name, {"status": PENDING})
+
+    async def run(self, name: str, fn, *args):
+        self.expect(name)
+        start = time.perf_counter()
+        try:
+            await run_in_threadpool(fn, *args)
+        except Exception as e:
+            traceback.print_exc()
+            self.components[name] = {"status": FAILED, "error": str(e)}
+        else:
+            self.components[name] = {"status": READY, "seconds": round(time.perf_counter() - start, 3)}
+
+    async def run_all(self, components: dict):
+        """Initializes every `name: fn` of `components` concurrently."""
+        self.expect(*components)
+        await asyncio.gather(*(self.run(name, fn) for name, fn in components.items()))
+        print(f"Startup warm-up done in {time.time() - self.started_at:.1f}s: {self.components}")
+
+    @property
+    def ready(self) -> bool:
+        return all(component["status"] == READY for component in self.components.values())
+
+    def report(self) -> dict:
+        return {"ready": self.ready, "uptime": round(time.time() - self.started_at, 3),
+                "components": self.components}
@@ -0,0 +1,67 @@
+import threading
+import time
+
+
+class CancellationWatch:
+    """`poll` of the CancellationToken of a generation step: whether /cancel asked any replica to stop it.
+
+    The listener on the session's cancellation document is started by the first poll, i.e. in the thread that runs
+    the step and only for steps that reach a cancellation check, and stays open until `close()`. Polls after that
+    only read the flag the listener sets. Requests made before the step started are ignored.
+    """
+
+    def __init__(self, client, collection: str, session_id: str, started_at: float):
+        self.client = client
+        self.collection = collection
+        self.session_id = session_id
+        self.started_at = started_at
+        self.requested = False
+        self._lock = threading.Lock()
+        self._watch = None
+        self._closed = False
+
+    def __call__(self) -> bool:
+        with self._lock:
+            if self._watch is None and not self._closed:
+                doc_ref = self.client.collection(self.collection).document(self.session_id)
+                self._watch = doc_ref.on_snapshot(self._on_snapshot)
+        return self.requested
+
+    def _on_snapshot(self, snapshots, changes, read_time):
+        snapshot = snapshots[0] if snapshots else None
+        if snapshot is not None and snapshot.exists and snapshot.to_dict().get("requested_at", 0) >= self.started_at:
+            self.requested = True
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            watch, self._watch = self._watch, None
+        if watch is not None:
+            watch.unsubscribe()
+
+
+class SessionCancellations:
+    """Cancellation requests of generation steps, shared by the replicas through Firestore.
+
+    The registry of ai.utils.cancellation only reaches the steps running in its own process. `request()` records
+    a request in `collection`/{session_id}, which the replica running a step of the session picks up through the
+    CancellationWatch of that step. Documents can be removed with a Firestore TTL policy on `expires_at`.
+    """
+
+    def __init__(self, client, collection: str = "session-cancellations", ttl: float = 3600, writer=None):
+        self.client = client
+        self.collection = collection
+        self.ttl = ttl
+        self.writer = writer
+
+    def request(self, session_id: str):
+        now = time.time()
+        document = {"session_id": session_id, "requested_at": now, "expires_at": now + self.ttl}
+        # waited for, the caller answers `cancelling` once the running step can see it
+        if self.writer is not None:
+            self.writer.set(self.collection, session_id, document, wait=True)
+        else:
+            self.client.collection(self.collection).document(session_id).set(document)
+
+    def watch(self, session_id: str) -> CancellationWatch:
+        return CancellationWatch(self.client, self.collection, session_id, time.time())
@@ -0,0 +1,52 @@
+from typing import Optional
+
+from backend.domain.enums.operations import Operations
+from backend.domain.session_context import SessionContext
+from backend.utils.cache import TTLCache
+
+
+class SessionRegistry:
+    """Session contexts stored in Firestore under their session_id, with an in-process index of active sessions.
+
+    Validating a session is a memory hit on the replica that started it and a single document get elsewhere.
+    With a `writer`, sessions are written behind: other replicas see a new session once its batch is committed.
+    """
+
+    def __init__(self, client, collection: str = "session-context", maxsize: int = 10000, ttl: float = 3600,
+                 writer=None):
+        self.client = client
+        self.writer = writer
+        self.collection = collection
+        self.sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def save(self, operation: Operations, user_id: str, session_id: str) -> SessionContext:
+        session_context = SessionContext(
+            user_id=user_id,
+            session_id=session_id,
+            operation=operation.value
+        )
+        self.sessions.set(session_id, session_context)
+        if self.writer is not None:
+            self.writer.set(self.collection, session_id, session_context.dict())
+        else:
+            self.client.collection(self.collection).document(session_id).set(session_context.dict())
+        return session_context
+
+    def get(self, session_id: str) -> Optional[SessionContext]:
+        session_context = self.sessions.get(session_id)
+        if session_context is not None:
+            return session_context
+
+        doc = self.client.collection(self.collection).document(session_id).get()
+        if doc.exists:
+            session_context = SessionContext(**doc.to_dict())
+        else:
+            # sessions saved before they were keyed by session_id live in auto-id documents
+            docs = self.client.collection(self.collection).where("session_id", "==", session_id).stream()
+            legacy_doc = next(docs, None)
+            if legacy_doc is None:
+                return None
+            session_context = SessionContext(**legacy_doc.to_dict())
+
+        self.sessions.set(session_id, session_context)
+        return session_context
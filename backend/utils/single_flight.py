@@ -0,0 +1,64 @@
+import asyncio
+import hashlib
+import json
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+
+class SingleFlight:
+    """Runs one computation per key at a time: callers that arrive while it runs wait for it and share its result
+    (or its exception) instead of starting their own.
+
+    The computation runs as its own task, so a caller that disconnects does not cancel it for the others.
+    Coalescing is per process (per event loop), duplicates that reach different replicas still run twice.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+
+    async def run(self, key: str, fn, *args, **kwargs):
+        """Awaits `fn(*args, **kwargs)`, a coroutine function, or the in-flight call with the same key."""
+        task = self._in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
+
+
+def fingerprint(*parts) -> str:
+    """Stable key for request values: dicts hash the same whatever their key order."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalize_url(url: str) -> str:
+    """Same key for the spellings of one site: scheme and host case, "www.", default ports, trailing slash and
+    fragment are ignored."""
+    url = url.strip()
+    if "://" not in url:
+        url = f"https://{url}"
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme == "http":
+        scheme = "https"
+    host = (parts.hostname or "").lower().removeprefix("www.")
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    return urlunsplit((scheme, host, parts.path.rstrip("/"), parts.query, ""))
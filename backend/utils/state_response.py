@@ -0,0 +1,70 @@
+from typing import Any
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+
+
+class StateResponse(ORJSONResponse):
+    """ORJSONResponse for payloads that carry graph states.
+
+    orjson only knows the JSON types, dataclasses, datetimes and numpy arrays. Anything else a state can hold (LangChain
+    messages, pydantic models, sets) goes through jsonable_encoder, the encoder these responses used before orjson,
+    so only those values pay for it.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=jsonable_encoder,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+if __name__ == "__main__":
+    # Check over a real state payload: a graph state read back from a checkpoint must render like the
+    # jsonable_encoder + JSONResponse path the step endpoints used before
+    import json
+    import sys
+    from datetime import datetime
+    from typing import TypedDict
+
+    from langchain_core.messages import AIMessage, HumanMessage
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.graph import END, StateGraph
+    from pydantic import BaseModel
+
+    from ai.utils.checkpointer import checkpoint_serde, thread_config
+
+    class Section(BaseModel):
+        section_header: str
+        description: str
+
+    class State(TypedDict, total=False):
+        query: str
+        messages: list
+        sections: list
+        keywords: set
+        created_at: datetime
+
+    def plan(state: State) -> dict:
+        return {"messages": [HumanMessage(content=state["query"]), AIMessage(content="Three sections")],
+                "sections": [Section(section_header=f"Part {i}", description="...") for i in range(3)],
+                "keywords": {"puppy"}, "created_at": datetime(2024, 1, 1)}
+
+    workflow = StateGraph(State)
+    workflow.add_node("plan", plan)
+    workflow.set_entry_point("plan")
+    workflow.add_edge("plan", END)
+    graph = workflow.compile(checkpointer=MemorySaver(serde=checkpoint_serde()))
+    config = thread_config("state_response", "check")
+    graph.invoke({"query": "How to train a puppy"}, config)
+
+    payload = {"session_id": "check", "step_output": {"workflow_step": "final_draft",
+                                                      "state": graph.get_state(config).values}}
+    try:
+        ORJSONResponse(payload)
+        print("ORJSONResponse: rendered")
+    except TypeError as e:
+        print(f"ORJSONResponse: {e}")
+    expected = json.loads(json.dumps(jsonable_encoder(payload)))
+    rendered = json.loads(StateResponse(payload).body)
+    print("StateResponse:", "same as jsonable_encoder" if rendered == expected else "DIFFERENT")
+    sys.exit(0 if rendered == expected else 1)
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+TERMINAL_STATUSES = {"completed", "failed", "cancelled"}
+
+
+class StatusBroker:
+    """Pushes task status changes to long-poll and WebSocket clients.
+
+    Writers in this process publish their updates directly. Jobs that run in a separate worker process are
+    picked up through a Firestore snapshot listener on the status document, which is shared by every client
+    waiting on that task, so a state change costs one document read instead of one query per poll.
+
+    A wait first looks at the last known status (`lookup`, e.g. the TaskStatusStore cache), so a status that
+    already changed or a task that doesn't exist is answered without a listener. The listener outlives its last
+    waiter by `linger` seconds, so a client polling again right away doesn't pay the initial read of a new one.
+    """
+
+    def __init__(self, client, on_publish=None, lookup=None, linger: float = 60):
+        self.client = client
+        # called with (collection, session_id, status) for every update, e.g. to refresh a status cache
+        self.on_publish = on_publish
+        # called with (collection, session_id), returns the last known status or None if the task doesn't exist
+        self.lookup = lookup
+        self.linger = linger
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._waiters = {}
+        self._watches = {}
+        self._idle_since = {}
+
+    def publish(self, collection: str, session_id: str, status: dict):
+        key = (collection, session_id)
+        if self.on_publish is not None:
+            self.on_publish(collection, session_id, status)
+        with self._lock:
+            # only tasks somebody is waiting on are kept in memory
+            if key not in self._waiters and key not in self._watches:
+                return
+            self._latest[key] = status
+            waiters = list(self._waiters.get(key, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def latest(self, collection: str, session_id: str):
+        with self._lock:
+            return self._latest.get((collection, session_id))
+
+    async def wait_for_change(self, collection: str, session_id: str, last_status: str = None,
+                              timeout: float = 30.0):
+        """Returns the task status as soon as its `status` differs from last_status, or whatever is known when
+        the timeout expires. An empty dict means the task does not exist (answered right away when `lookup` knows
+        it), None that nothing was read yet."""
+        key = (collection, session_id)
+        status = self.latest(collection, session_id)
+        if status is None and self.lookup is not None:
+            status = await run_in_threadpool(self.lookup, collection, session_id)
+            if status is None:
+                return {}
+        if status is not None and status.get("status") != last_status:
+            return status
+
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._lock:
+            self._waiters.setdefault(key, set()).add((loop, event))
+            self._idle_since.pop(key, None)
+        try:
+            # starting a listener is a blocking call (and the first one initializes the Firebase client)
+            await run_in_threadpool(self._watch, key)
+            deadline = loop.time() + timeout
+            while True:
+                # clear before reading so a publish in between is not lost
+                event.clear()
+                latest = self.latest(collection, session_id)
+                if latest is not None:
+                    status = latest
+                if status is not None and status.get("status") != last_status:
+                    return status
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return status
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._remove_waiter(key, (loop, event))
+
+    def _watch(self, key):
+        with self._lock:
+            if key in self._watches:
+                return
+            self._watches[key] = None
+
+        collection, session_id = key
+
+        def on_snapshot(snapshots, changes, read_time):
+            snapshot = snapshots[0] if snapshots else None
+            status = snapshot.to_dict() if snapshot is not None and snapshot.exists else {}
+            self.publish(collection, session_id, status)
+
+        watch = self.client.collection(collection).document(session_id).on_snapshot(on_snapshot)
+        with self._lock:
+            if key in self._watches:
+                self._watches[key] = watch
+                return
+        # every waiter left while the listener was starting
+        watch.unsubscribe()
+
+    def _remove_waiter(self, key, waiter):
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if waiters:
+                    return
+                del self._waiters[key]
+            status = self._latest.get(key) or {}
+            if self.linger > 0 and key in self._watches and status.get("status") not in TERMINAL_STATUSES:
+                # kept for the next poll of the client, a finished task won't change anymore
+                since = self._idle_since[key] = time.monotonic()
+                timer = threading.Timer(self.linger, self._unwatch, (key, since))
+                timer.daemon = True
+                timer.start()
+                return
+        self._unwatch(key)
+
+    def _unwatch(self, key, idle_since: float = None):
+        with self._lock:
+            if key in self._waiters or (idle_since is not None and self._idle_since.get(key) != idle_since):
+                # a waiter came back in the meantime
+                return
+            self._idle_since.pop(key, None)
+            watch = self._watches.pop(key, None)
+            self._latest.pop(key, None)
+        if watch is not None:
+            watch.unsubscribe()
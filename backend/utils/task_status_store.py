@@ -0,0 +1,78 @@
+import hashlib
+import json
+import re
+import time
+from typing import Optional
+
+from backend.utils.cache import TTLCache
+from backend.utils.status_broker import TERMINAL_STATUSES
+
+
+class TaskStatusStore:
+    """Video / CSV task status documents, read and written directly under their session_id.
+
+    Every write carries a `version`, which the poll endpoints return as the ETag. The last known status is kept
+    in memory: writers in this process keep it current, terminal statuses never change, and anything else
+    written by another process is re-read from Firestore at most once every `ttl` seconds.
+
+    With a `writer`, progress updates are written behind and only terminal statuses wait for their commit, as the
+    job that wrote them is acknowledged right after.
+    """
+
+    def __init__(self, client, maxsize: int = 10000, ttl: float = 5, terminal_ttl: float = 3600, writer=None):
+        self.client = client
+        self.writer = writer
+        self.ttl = ttl
+        self.terminal_ttl = terminal_ttl
+        self.statuses = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def set(self, collection: str, session_id: str, status: dict) -> dict:
+        status = {**status, "version": time.time_ns()}
+        # remembered first, so polls in this process see it while a write-behind is pending
+        self.remember(collection, session_id, status)
+        if self.writer is not None:
+            self.writer.set(collection, session_id, status, wait=status.get("status") in TERMINAL_STATUSES)
+        else:
+            self.client.collection(collection).document(session_id).set(status)
+        return status
+
+    def get(self, collection: str, session_id: str) -> Optional[dict]:
+        status = self.statuses.get((collection, session_id))
+        if status is not None:
+            return status
+
+        doc = self.client.collection(collection).document(session_id).get()
+        if not doc.exists:
+            return None
+        status = doc.to_dict()
+        self.remember(collection, session_id, status)
+        return status
+
+    def remember(self, collection: str, session_id: str, status: dict):
+        if not status:
+            return
+        ttl = self.terminal_ttl if status.get("status") in TERMINAL_STATUSES else self.ttl
+        self.statuses.set((collection, session_id), status, ttl=ttl)
+
+
+def status_etag(status: dict) -> str:
+    version = status.get("version")
+    if version is None:
+        # documents written before statuses were versioned
+        version = hashlib.sha1(json.dumps(status, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{version}"'
+
+
+# an entity tag in a header value, weak (W/"...") or strong; the quotes may enclose commas
+ENTITY_TAG = re.compile(r'(?:W/)?"[^"]*"')
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches `etag`, with the weak comparison of RFC 9110: `*`, or any of the
+    comma separated tags once their W/ prefix is dropped."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.removeprefix("W/") == opaque_tag for tag in ENTITY_TAG.findall(if_none_match))
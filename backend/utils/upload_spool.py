@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Optional
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadNotFound(KeyError):
+    pass
+
+
+class UploadConflict(ValueError):
+    """The chunk does not start at the current end of the upload, or another chunk is still being written."""
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+
+class UploadSpool:
+    """Resumable uploads, spooled chunk by chunk to a local file while their sha256 is computed.
+
+    Every upload is a `<upload_id>.part` data file plus a `<upload_id>.json` sidecar. The size of the data file is
+    the upload offset, so a client that lost its connection asks for the offset and continues from there. The
+    running hash is kept in memory; after a restart it is rebuilt from the bytes already on disk.
+    """
+
+    def __init__(self, directory: str = "temp/uploads", expire_after: float = 24 * 3600):
+        self.directory = directory
+        self.expire_after = expire_after
+        self._lock = threading.Lock()
+        self._writing = set()
+        # upload_id -> (offset, sha256 of the first `offset` bytes)
+        self._hashers = {}
+
+    def _paths(self, upload_id: str):
+        try:
+            upload_id = uuid.UUID(upload_id).hex
+        except ValueError:
+            raise UploadNotFound(upload_id)
+        base = os.path.join(self.directory, upload_id)
+        return f"{base}.part", f"{base}.json"
+
+    def create(self, filename: str, size: Optional[int] = None) -> dict:
+        upload_id = uuid.uuid4().hex
+        data_path, meta_path = self._paths(upload_id)
+        upload = {"upload_id": upload_id, "filename": os.path.basename(filename), "size": size,
+                  "created_at": time.time()}
+        # created with the first upload, not when the spool is constructed
+        os.makedirs(self.directory, exist_ok=True)
+        open(data_path, "wb").close()
+        with open(meta_path, "w") as f:
+            json.dump(upload, f)
+        return {**upload, "offset": 0}
+
+    def status(self, upload_id: str) -> dict:
+        data_path, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                upload = json.load(f)
+            return {**upload, "offset": os.path.getsize(data_path)}
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+
+    def open_append(self, upload_id: str, offset: int) -> "UploadAppend":
+        """Starts writing a chunk at `offset`, which must be the current end of the upload."""
+        upload = self.status(upload_id)
+        upload_id = upload["upload_id"]
+        with self._lock:
+            if upload_id in self._writing:
+                raise UploadConflict("Another chunk of this upload is being written.", upload["offset"])
+            if offset != upload["offset"]:
+                raise UploadConflict(f"Upload is at offset {upload['offset']}, not {offset}.", upload["offset"])
+            self._writing.add(upload_id)
+        try:
+            return UploadAppend(self, upload, self._hasher(upload_id, upload["offset"]))
+        except Exception:
+            with self._lock:
+                self._writing.discard(upload_id)
+            raise
+
+    def _hasher(self, upload_id: str, offset: int):
+        with self._lock:
+            cached = self._hashers.get(upload_id)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        # the process restarted or the last chunk failed half way: hash what is on disk
+        data_path, _ = self._paths(upload_id)
+        hasher = hashlib.sha256()
+        with open(data_path, "rb") as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        return hasher
+
+    def _finish_append(self, upload_id: str, offset: int, hasher):
+        with self._lock:
+            self._hashers[upload_id] = (offset, hasher)
+            self._writing.discard(upload_id)
+
+    def finalize(self, upload_id: str, destination: str, expected_sha256: Optional[str] = None) -> dict:
+        """Moves the complete upload to `destination` and returns its status with the `content_hash`."""
+        upload = self.status(upload_id)
+        upload_id = upload["upload_id"]
+        with self._lock:
+            if upload_id in self._writing:
+                raise UploadConflict("A chunk of this upload is still being written.", upload["offset"])
+            self._writing.add(upload_id)
+        try:
+            if upload["size"] is not None and upload["offset"] != upload["size"]:
+                raise UploadConflict(f"Upload has {upload['offset']} of {upload['size']} bytes.", upload["offset"])
+            content_hash = self._hasher(upload_id, upload["offset"]).hexdigest()
+            if expected_sha256 and expected_sha256.lower() != content_hash:
+                raise ValueError(f"Upload sha256 is {content_hash}, expected {expected_sha256}.")
+
+            data_path, meta_path = self._paths(upload_id)
+            os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+            os.replace(data_path, destination)
+            os.remove(meta_path)
+        finally:
+            with self._lock:
+                self._writing.discard(upload_id)
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        return {**upload, "content_hash": content_hash}
+
+    def abort(self, upload_id: str):
+        data_path, meta_path = self._paths(upload_id)
+        upload_id = uuid.UUID(upload_id).hex
+        for path in (data_path, meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+
+    def remove_expired(self) -> int:
+        """Deletes uploads that were not finalized within `expire_after` seconds."""
+        removed = 0
+        cutoff = time.time() - self.expire_after
+        if not os.path.isdir(self.directory):
+            return removed
+        for name in os.listdir(self.directory):
+            upload_id, ext = os.path.splitext(name)
+            if ext != ".json":
+                continue
+            try:
+                if os.path.getmtime(os.path.join(self.directory, name)) < cutoff:
+                    self.abort(upload_id)
+                    removed += 1
+            except (OSError, UploadNotFound):
+                continue
+        return removed
+
+
+class UploadAppend:
+    """Appends one chunk to an upload. `close()` returns the new offset."""
+
+    def __init__(self, spool: UploadSpool, upload: dict, hasher):
+        self.spool = spool
+        self.upload = upload
+        self.hasher = hasher
+        self.offset = upload["offset"]
+        data_path, _ = spool._paths(upload["upload_id"])
+        self._file = open(data_path, "ab")
+        self._failed = False
+
+    def write(self, chunk: bytes):
+        size = self.upload["size"]
+        if size is not None and self.offset + len(chunk) > size:
+            self._failed = True
+            raise ValueError(f"Chunk goes past the declared upload size of {size} bytes.")
+        try:
+            self._file.write(chunk)
+        except Exception:
+            self._failed = True
+            raise
+        self.hasher.update(chunk)
+        self.offset += len(chunk)
+
+    def close(self) -> int:
+        self._file.close()
+        upload_id = self.upload["upload_id"]
+        if self._failed:
+            # the bytes on disk may no longer match the running hash, drop the part past the last good write
+            data_path, _ = self.spool._paths(upload_id)
+            with open(data_path, "r+b") as f:
+                f.truncate(self.offset)
+        self.spool._finish_append(upload_id, self.offset, self.hasher)
+        return self.offset
+
+
+def hash_file(fileobj) -> str:
+    """The sha256 of the content of `fileobj`, which is rewound afterwards."""
+    hasher = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(READ_CHUNK_SIZE), b""):
+        hasher.update(chunk)
+    fileobj.seek(0)
+    return hasher.hexdigest()
+
+
+def copy_and_hash(fileobj, path: str) -> str:
+    """Copies `fileobj` to `path` in chunks and returns the sha256 of the content."""
+    hasher = hashlib.sha256()
+    with open(path, "wb") as f:
+        for chunk in iter(lambda: fileobj.read(READ_CHUNK_SIZE), b""):
+            f.write(chunk)
+            hasher.update(chunk)
+    return hasher.hexdigest()
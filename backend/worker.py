@@ -0,0 +1,21 @@
+import signal
+import threading
+
+from ai.agent_registry import agent_registry, PERSONALIZED_MARKETING, VIDEO_TO_BLOG
+from backend.backend import firestore_writer, job_queue, job_handlers, job_workers
+from backend.jobs.worker_pool import WorkerPool
+
+# Runs the video and CSV job workers in their own process so they can be scaled apart from the API replicas:
+#   JOB_WORKERS=4 python -m backend.worker
+if __name__ == "__main__":
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    agent_registry.warm_up([VIDEO_TO_BLOG, PERSONALIZED_MARKETING])
+    pool = WorkerPool(job_queue, job_handlers, size=max(job_workers, 1))
+    pool.start()
+    stop.wait()
+    print("Stopping job workers")
+    pool.stop()
+    firestore_writer.close(timeout=10)